@@ -1,18 +1,31 @@
-from fastapi import FastAPI, HTTPException, File, UploadFile
-from fastapi.responses import Response, JSONResponse
+from fastapi import FastAPI, HTTPException, File, UploadFile, WebSocket, WebSocketDisconnect
+from fastapi.responses import Response, JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
 import io
+import os
 from PIL import Image
 import uvicorn
 import asyncio
 import logging
 from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager  # 添加这行
+from datetime import datetime
+import contextvars
+import sys
+import time
 
 # 假設你的ADB控制器代碼在同一目錄下的 adb_controller.py 文件中
 from adb_controller import ADBController
+from frame_stream import FrameBroadcaster
+from capture_scheduler import CaptureScheduler
+from frame_recorder import FrameRecorder, FrameReader
+import metrics
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from loop_monitor import LoopLagMonitor  # noqa: E402
+from block_detector import BlockDetector, BlockTagMiddleware  # noqa: E402
 
 # 配置日誌
 logging.basicConfig(level=logging.INFO)
@@ -21,52 +34,89 @@ logger = logging.getLogger(__name__)
 # 全局变量
 adb_controller: Optional[ADBController] = None
 background_task = None
+frame_broadcaster = FrameBroadcaster(default_format='jpeg', default_quality=70)
+frame_recorder: Optional[FrameRecorder] = None
+RECORDINGS_DIR = os.path.join(os.getcwd(), 'recordings')
+
+# 目前請求中 adb 指令的累計耗時 [秒, 次數]，由 Server-Timing 回報給呼叫端
+_request_adb_time: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar('request_adb_time', default=None)
+
+
+def record_adb_command(controller: ADBController, command: List[str], seconds: float, ok: bool) -> None:
+    """ADBController.on_command：記錄指令延遲並累計到目前請求"""
+    metrics.observe_command(metrics.device_label(controller.device_id), command, seconds, ok)
+    totals = _request_adb_time.get()
+    if totals is not None:
+        totals[0] += seconds
+        totals[1] += 1
+
+
+def new_controller(**kwargs) -> ADBController:
+    controller = ADBController(**kwargs)
+    controller.on_command = lambda command, seconds, ok: record_adb_command(controller, command, seconds, ok)
+    return controller
+
+
+def capture_frame():
+    """擷取目前畫面，控制器未初始化時回傳 None"""
+    if not adb_controller:
+        return None
+    controller = adb_controller
+    start = time.perf_counter()
+    frame = controller.screenshot_numpy()
+    metrics.observe_capture(metrics.device_label(controller.device_id), time.perf_counter() - start,
+                            frame is not None)
+    return frame
+
+
+def save_screenshot(screenshot_array, filename: str = "screenshot.png") -> None:
+    """把截圖寫入 screenshots 目錄（先寫暫存檔再替換，讀取端不會讀到寫一半的檔案）"""
+    screenshots_dir = os.path.join(os.getcwd(), 'screenshots')
+    os.makedirs(screenshots_dir, exist_ok=True)
+    saved_path = os.path.join(screenshots_dir, filename)
+    tmp_path = saved_path + '.tmp'
+    Image.fromarray(screenshot_array).save(tmp_path, format='PNG', compress_level=1)
+    os.replace(tmp_path, saved_path)
+
+
+async def handle_frame(screenshot_array) -> None:
+    """每張新截圖：推送給串流觀看者並寫入檔案"""
+    changed = frame_broadcaster.publish(screenshot_array)
+    if changed and adb_controller:
+        # 畫面變了，之前的 UI 階層不再可信
+        adb_controller.invalidate_cache('ui_tree')
+    if frame_recorder and changed:
+        frame_recorder.submit(screenshot_array)
+    await asyncio.to_thread(save_screenshot, screenshot_array)
+
+
+# 依需求調整截圖頻率：沒人看時降速，有觀看者時 0.5 秒，視覺等待時全速
+capture_scheduler = CaptureScheduler(
+    capture=capture_frame,
+    on_frame=handle_frame,
+    demand=lambda: frame_broadcaster.subscriber_count + (1 if frame_recorder else 0),
+    idle_interval=5.0,
+    viewer_interval=0.5,
+    boost_interval=0.0
+)
 
-async def auto_update_screenshot():
-    """每5秒自动更新截图的后台任务"""
-    while True:
-        try:
-            if adb_controller:
-                import os
-                
-                filename = "screenshot.png"
-                screenshots_dir = os.path.join(os.getcwd(), 'screenshots')
-                os.makedirs(screenshots_dir, exist_ok=True)
-                
-                # 添加超时和取消检查
-                screenshot_array = adb_controller.screenshot_numpy()
-                if screenshot_array is not None:
-                    img = Image.fromarray(screenshot_array)
-                    saved_path = os.path.join(screenshots_dir, filename)
-                    img.save(saved_path)
-                    print(f"Auto-updated screenshot")
-            
-                # 使用可中断的sleep
-                await asyncio.sleep(0.5)
-
-                filename = "screenshot1.png"
-                screenshots_dir = os.path.join(os.getcwd(), 'screenshots')
-                
-                # 添加超时和取消检查
-                screenshot_array = adb_controller.screenshot_numpy()
-                if screenshot_array is not None:
-                    img = Image.fromarray(screenshot_array)
-                    saved_path = os.path.join(screenshots_dir, filename)
-                    img.save(saved_path)
-                    print(f"Auto-updated screenshot")
-            
-                # 使用可中断的sleep
-                await asyncio.sleep(0.5)
-            
-        except asyncio.CancelledError:
-            print("Screenshot task cancelled")
-            break  # 正确退出循环
-        except Exception as e:
-            print(f"Auto-update error: {e}")
-            try:
-                await asyncio.sleep(1)
-            except asyncio.CancelledError:
-                break
+# 擷取狀態、串流與快取在 /metrics 被抓取時才讀取
+metrics.register_state(lambda: adb_controller, capture_scheduler, frame_broadcaster, lambda: frame_recorder)
+
+# 事件迴圈延遲（同步的 adb 呼叫會阻塞整個迴圈）
+loop_monitor = LoopLagMonitor(on_lag=metrics.LOOP_LAG_SECONDS.observe)
+
+
+def report_block(block: Dict[str, Any]) -> None:
+    """BlockDetector.on_block：記錄阻塞事件迴圈的請求與程式位置"""
+    metrics.observe_block(block)
+    logger.warning(f"Event loop blocked {block['duration_ms']} ms "
+                   f"({block['tags'].get('endpoint', 'background')}) at {block['culprit']}")
+
+
+# 阻塞偵測預設關閉，MQA_BLOCK_DETECTOR=1 啟動時開啟，或以 POST /debug/loop 切換
+block_detector = BlockDetector(threshold=float(os.environ.get('MQA_BLOCK_THRESHOLD_MS', 100)) / 1000,
+                               on_block=report_block)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -74,18 +124,27 @@ async def lifespan(app: FastAPI):
     
     # 启动
     try:
-        adb_controller = ADBController()
+        adb_controller = new_controller(use_sendevent=True)
         logger.info("ADB Controller initialized successfully")
         
-        background_task = asyncio.create_task(auto_update_screenshot())
-        print("Started auto-screenshot update task")
+        background_task = asyncio.create_task(capture_scheduler.run())
+        print("Started capture scheduler")
     except Exception as e:
         logger.error(f"Failed to initialize: {e}")
+    loop_monitor.start()
+    if os.environ.get('MQA_BLOCK_DETECTOR') == '1':
+        block_detector.start()
     
     yield
     
     # 关闭
     print("Shutting down...")
+    await loop_monitor.stop()
+    block_detector.stop()
+    if adb_controller:
+        adb_controller.close()
+    if frame_recorder:
+        frame_recorder.close()
     if background_task:
         background_task.cancel()
         try:
@@ -115,9 +174,32 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 以端點標記請求，阻塞事件會歸屬到該端點；須在 server_timing 之前加入（見 BlockTagMiddleware）
+app.add_middleware(BlockTagMiddleware)
+
+
+@app.middleware("http")
+async def server_timing(request, call_next):
+    """在回應加上 Server-Timing：處理時間 (app) 與其中 adb 指令的耗時 (adb)"""
+    totals = [0.0, 0]
+    token = _request_adb_time.set(totals)
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        _request_adb_time.reset(token)
+    app_ms = (time.perf_counter() - start) * 1000
+    timing = f"app;dur={app_ms:.1f}"
+    if totals[1]:
+        timing += f', adb;dur={totals[0] * 1000:.1f};desc="{totals[1]} cmds"'
+    response.headers['Server-Timing'] = timing
+    return response
+
 # 請求模型定義
 class DeviceConfig(BaseModel):
+    # adb 執行檔只由伺服器端的 ADB_PATH 環境變數決定，不接受客戶端指定
     device_id: Optional[str] = None
+    use_sendevent: bool = True
 
 class ClickRequest(BaseModel):
     x: int
@@ -152,13 +234,49 @@ class DoubleTapRequest(BaseModel):
     x: int
     y: int
 
+class SwipePathRequest(BaseModel):
+    points: List[List[int]]
+    duration_ms: int = 500
+
+class MultiTouchRequest(BaseModel):
+    paths: List[List[List[int]]]
+    duration_ms: int = 500
+
+class ElementRequest(BaseModel):
+    text: Optional[str] = None
+    resource_id: Optional[str] = None
+    class_name: Optional[str] = None
+    content_desc: Optional[str] = None
+    # True 時 text / content_desc 為正則（re.search），否則需完全相同
+    regex: bool = True
+    # True 時 text / content_desc 為一般文字，正規化（全半形、大小寫、空白、誤認字）後包含即相符，
+    # 與 OCR 找文字相同；優先於 regex
+    normalized: bool = False
+
+class CaptureBoostRequest(BaseModel):
+    duration_ms: int = 5000
+
+class RecordingStartRequest(BaseModel):
+    run_id: Optional[str] = None
+    keyframe_interval: int = 50
+    max_mb: int = 1024
+
+class RecordingStepRequest(BaseModel):
+    step: int
+    function: str
+    args: List[Any] = []
+
+class LoopDebugRequest(BaseModel):
+    enabled: bool
+    threshold_ms: Optional[float] = None
+
 
 @app.on_event("startup")
 async def startup_event():
     """應用啟動時初始化ADB控制器"""
     global adb_controller
     try:
-        adb_controller = ADBController()
+        adb_controller = new_controller()
         logger.info("ADB Controller initialized successfully")
     except Exception as e:
         logger.error(f"Failed to initialize ADB Controller: {e}")
@@ -174,13 +292,52 @@ async def root():
     }
 
 
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus 格式的運作指標"""
+    return Response(content=metrics.render(), headers={"Content-Type": metrics.CONTENT_TYPE})
+
+
+@app.get("/debug/loop")
+async def get_loop_debug():
+    """事件迴圈延遲與最近的阻塞事件（含堆疊取樣與歸屬的端點）"""
+    return {"lag": loop_monitor.stats(), **block_detector.status()}
+
+
+@app.post("/debug/loop")
+async def set_loop_debug(request: LoopDebugRequest):
+    """開啟/關閉阻塞偵測，可同時調整門檻"""
+    if request.threshold_ms is not None and request.threshold_ms <= 0:
+        raise HTTPException(status_code=400, detail="threshold_ms must be positive")
+    threshold = request.threshold_ms / 1000 if request.threshold_ms else None
+    if request.enabled:
+        block_detector.start(threshold)
+    else:
+        block_detector.stop()
+        if threshold:
+            block_detector.threshold = threshold
+    return {"enabled": block_detector.enabled, "threshold_ms": block_detector.threshold * 1000}
+
+
+@app.delete("/debug/loop/blocks")
+async def clear_loop_blocks():
+    block_detector.clear()
+    return {"message": "Block history cleared"}
+
+
 @app.post("/init")
 async def initialize_device(config: DeviceConfig):
     """初始化或重新配置設備連接"""
     global adb_controller
     try:
-        adb_controller = ADBController(device_id=config.device_id)
-        return {"message": "Device initialized successfully", "device_id": config.device_id}
+        if adb_controller:
+            adb_controller.close()
+        adb_controller = new_controller(device_id=config.device_id, use_sendevent=config.use_sendevent)
+        return {
+            "message": "Device initialized successfully",
+            "device_id": config.device_id,
+            "touch_engine": "sendevent" if adb_controller.touch else "input"
+        }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to initialize device: {str(e)}")
 
@@ -210,6 +367,32 @@ async def get_screen_size():
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/screen/info")
+async def get_screen_info():
+    """獲取屏幕尺寸與密度（連線期間快取）"""
+    try:
+        if not adb_controller:
+            raise HTTPException(status_code=400, detail="ADB Controller not initialized")
+        
+        width, height = adb_controller.get_screen_size()
+        return {"width": width, "height": height, "density": adb_controller.get_density(),
+                "device_id": adb_controller.device_id}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/device/cache/clear")
+async def clear_device_cache():
+    """清除設備狀態快取"""
+    if not adb_controller:
+        raise HTTPException(status_code=400, detail="ADB Controller not initialized")
+    
+    adb_controller.invalidate_cache()
+    return {"message": "Device state cache cleared"}
+
+
 @app.post("/input/click")
 async def click(request: ClickRequest):
     """點擊指定坐標"""
@@ -281,6 +464,60 @@ async def double_tap(request: DoubleTapRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/input/swipe-path")
+async def swipe_path(request: SwipePathRequest):
+    """沿任意路徑滑動"""
+    try:
+        if not adb_controller:
+            raise HTTPException(status_code=400, detail="ADB Controller not initialized")
+        if len(request.points) < 2:
+            raise HTTPException(status_code=400, detail="At least two points are required")
+        
+        adb_controller.swipe_path([tuple(p) for p in request.points], request.duration_ms)
+        return {
+            "message": f"Swipe along {len(request.points)} points",
+            "duration_ms": request.duration_ms
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/input/multi-touch")
+async def multi_touch(request: MultiTouchRequest):
+    """多點觸控手勢"""
+    try:
+        if not adb_controller:
+            raise HTTPException(status_code=400, detail="ADB Controller not initialized")
+        if not adb_controller.touch:
+            raise HTTPException(status_code=400, detail="Multi-touch requires the sendevent touch engine")
+        
+        adb_controller.multi_touch([[tuple(p) for p in path] for path in request.paths], request.duration_ms)
+        return {
+            "message": f"Multi-touch with {len(request.paths)} fingers",
+            "duration_ms": request.duration_ms
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/input/engine")
+async def get_input_engine():
+    """獲取目前的觸控注入方式"""
+    if not adb_controller:
+        raise HTTPException(status_code=400, detail="ADB Controller not initialized")
+    
+    touch = adb_controller.touch
+    return {
+        "engine": "sendevent" if touch else "input",
+        "device": touch.device.path if touch else None,
+        "max_contacts": touch.device.max_slots if touch else 1
+    }
+
+
 @app.post("/screen/unlock")
 async def unlock_screen():
     """解鎖屏幕"""
@@ -480,8 +717,47 @@ async def get_current_app():
         if not adb_controller:
             raise HTTPException(status_code=400, detail="ADB Controller not initialized")
         
-        current_app = adb_controller.get_current_app()
-        return {"current_app": current_app}
+        focus = adb_controller.get_current_focus() or {}
+        return {"current_app": focus.get('package'), "activity": focus.get('activity')}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/ui/dump")
+async def dump_ui():
+    """目前畫面的 UI 階層（uiautomator dump，畫面改變前重複使用）"""
+    try:
+        if not adb_controller:
+            raise HTTPException(status_code=400, detail="ADB Controller not initialized")
+        
+        tree = await asyncio.to_thread(adb_controller.dump_ui)
+        if tree is None:
+            raise HTTPException(status_code=503, detail="UI hierarchy unavailable")
+        return {"nodes": [node.to_dict() for node in tree.nodes], "count": len(tree)}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/ui/find")
+async def find_elements(request: ElementRequest):
+    """依文字、resource-id、類別或 content-desc 找畫面上的元件（由上而下）"""
+    try:
+        if not adb_controller:
+            raise HTTPException(status_code=400, detail="ADB Controller not initialized")
+        
+        tree = await asyncio.to_thread(adb_controller.dump_ui)
+        if tree is None:
+            # 取不到階層（遊戲、安全畫面等），呼叫端改用 OCR / 模板比對
+            return {"elements": [], "count": 0, "available": False}
+        elements = [node.to_dict() for node in tree.find(
+            text=request.text, resource_id=request.resource_id, class_name=request.class_name,
+            content_desc=request.content_desc, regex=request.regex, normalized=request.normalized)]
+        return {"elements": elements, "count": len(elements), "available": True,
+                "text_nodes": len(tree.by_text)}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -499,6 +775,193 @@ async def open_chrome_with_url(request: UrlRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.websocket("/ws/screen")
+async def stream_screen(websocket: WebSocket, format: str = "jpeg", quality: int = 70, seq: bool = False):
+    """
+    以 WebSocket 推送畫面（只在畫面變化時推送，慢的客戶端會跳過舊畫面）
+
+    seq 為 true 時每張畫面前先送一則文字訊息 {"seq": 序號}，可用 /stream/frame 取得同一張畫面的無損版本
+    """
+    await websocket.accept()
+    try:
+        subscriber = frame_broadcaster.subscribe(format, quality)
+    except ValueError as e:
+        await websocket.close(code=1003, reason=str(e))
+        return
+    capture_scheduler.wake()
+    
+    try:
+        while True:
+            frame_seq, data = await frame_broadcaster.next_frame(subscriber)
+            if seq:
+                await websocket.send_json({"seq": frame_seq})
+            await websocket.send_bytes(data)
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        frame_broadcaster.unsubscribe(subscriber)
+
+
+@app.get("/stream.mjpeg")
+async def stream_mjpeg(quality: int = 70):
+    """MJPEG 畫面串流，可直接用於 <img src>"""
+    subscriber = frame_broadcaster.subscribe('jpeg', quality)
+    capture_scheduler.wake()
+    
+    async def frames():
+        try:
+            while True:
+                _, data = await frame_broadcaster.next_frame(subscriber)
+                yield (b"--frame\r\nContent-Type: image/jpeg\r\n"
+                       + f"Content-Length: {len(data)}\r\n\r\n".encode() + data + b"\r\n")
+        finally:
+            frame_broadcaster.unsubscribe(subscriber)
+    
+    return StreamingResponse(frames(), media_type="multipart/x-mixed-replace; boundary=frame")
+
+
+@app.get("/stream/frame")
+async def get_stream_frame(seq: int, format: str = "png", quality: int = 95):
+    """取得串流中序號為 seq 的畫面（預設 PNG 無損）；已有更新的畫面時回傳 409"""
+    if format not in frame_broadcaster.FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {format}")
+    data = await frame_broadcaster.encoded_seq(seq, format, quality)
+    if data is None:
+        raise HTTPException(status_code=409, detail=f"Frame {seq} is no longer current (now {frame_broadcaster.seq})")
+    return Response(content=data, media_type=frame_broadcaster.MEDIA_TYPES[format],
+                    headers={"X-Frame-Seq": str(seq)})
+
+
+@app.get("/stream/status")
+async def get_stream_status():
+    """獲取畫面串流狀態"""
+    return {
+        "viewers": frame_broadcaster.subscriber_count,
+        "frame_seq": frame_broadcaster.seq,
+        "format": frame_broadcaster.default_format,
+        "quality": frame_broadcaster.default_quality
+    }
+
+
+@app.post("/capture/now")
+async def capture_now():
+    """立即擷取一張新截圖（擷取在請求之後才開始，擷取進行中到達的請求共用下一次擷取）"""
+    try:
+        if not adb_controller:
+            raise HTTPException(status_code=400, detail="ADB Controller not initialized")
+        
+        seq = await capture_scheduler.capture_now()
+        return {"message": "Frame captured", "frame_seq": seq}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/capture/boost")
+async def capture_boost(request: CaptureBoostRequest):
+    """在指定時間內全速截圖（視覺等待時使用）"""
+    capture_scheduler.boost(request.duration_ms / 1000)
+    return {"message": f"Capture boosted for {request.duration_ms}ms"}
+
+
+@app.get("/capture/status")
+async def get_capture_status():
+    """獲取截圖排程狀態"""
+    return {
+        "mode": capture_scheduler.mode,
+        "interval": capture_scheduler.current_interval(),
+        "fps": round(capture_scheduler.fps(), 2),
+        "frame_seq": capture_scheduler.seq,
+        "viewers": frame_broadcaster.subscriber_count,
+        "last_error": capture_scheduler.last_error
+    }
+
+
+def recording_dir(run_id: str) -> str:
+    """錄影目錄，拒絕包含路徑的 run_id"""
+    if not run_id or os.path.basename(run_id) != run_id or run_id.startswith('.'):
+        raise HTTPException(status_code=400, detail=f"Invalid run id: {run_id}")
+    return os.path.join(RECORDINGS_DIR, run_id)
+
+
+@app.post("/recording/start")
+async def start_recording(request: RecordingStartRequest):
+    """開始錄製畫面時間軸"""
+    global frame_recorder
+    if frame_recorder:
+        raise HTTPException(status_code=409, detail="A recording is already running")
+    
+    run_id = request.run_id or datetime.now().strftime('%Y%m%d_%H%M%S')
+    frame_recorder = FrameRecorder(
+        recording_dir(run_id),
+        keyframe_interval=request.keyframe_interval,
+        max_bytes=request.max_mb * 1024 * 1024
+    )
+    capture_scheduler.wake()
+    return {"message": f"Recording started: {run_id}", "run_id": run_id}
+
+
+@app.post("/recording/step")
+async def mark_recording_step(request: RecordingStepRequest):
+    """標記目前執行中的腳本步驟"""
+    if not frame_recorder:
+        raise HTTPException(status_code=400, detail="No recording is running")
+    
+    frame_recorder.mark_step(request.step, request.function, request.args)
+    return {"message": f"Step {request.step} marked"}
+
+
+@app.post("/recording/stop")
+async def stop_recording():
+    """停止錄製"""
+    global frame_recorder
+    if not frame_recorder:
+        raise HTTPException(status_code=400, detail="No recording is running")
+    
+    recorder, frame_recorder = frame_recorder, None
+    await asyncio.to_thread(recorder.close)
+    return {
+        "message": "Recording stopped",
+        "run_id": os.path.basename(recorder.run_dir),
+        "frames": recorder.frames,
+        "dropped": recorder.dropped,
+        "bytes": recorder.total_bytes
+    }
+
+
+@app.get("/recordings")
+async def list_recordings():
+    """列出所有錄影"""
+    if not os.path.isdir(RECORDINGS_DIR):
+        return {"recordings": []}
+    return {"recordings": sorted(os.listdir(RECORDINGS_DIR))}
+
+
+@app.get("/recordings/{run_id}/frames/{index}")
+async def get_recorded_frame(run_id: str, index: int):
+    """讀取錄影中的某一張畫面（PNG）"""
+    path = recording_dir(run_id)
+    if not os.path.isdir(path):
+        raise HTTPException(status_code=404, detail=f"Recording not found: {run_id}")
+    
+    def render() -> bytes:
+        reader = FrameReader(path)
+        try:
+            if not -len(reader) <= index < len(reader):
+                raise IndexError(index)
+            buffer = io.BytesIO()
+            Image.fromarray(reader.frame(index)).save(buffer, format='PNG')
+            return buffer.getvalue()
+        finally:
+            reader.close()
+    
+    try:
+        return Response(content=await asyncio.to_thread(render), media_type="image/png")
+    except IndexError:
+        raise HTTPException(status_code=404, detail=f"Frame {index} not found")
+
+
 @app.get("/health")
 async def health_check():
     """健康檢查端點"""
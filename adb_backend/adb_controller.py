@@ -1,51 +1,191 @@
+import os
+import shlex
 import subprocess
 import time
-from typing import Optional, Tuple, List
+from typing import Optional, Tuple, List, Dict, Any, Callable
 import re
 import io
 from datetime import datetime 
 import numpy as np
 from PIL import Image
+from touch_injector import TouchInjector
+from ui_tree import UITree, extract_xml
 
 
 class ADBController:
     """Android Debug Bridge (ADB) Controller for device automation"""
     
-    def __init__(self, device_id: Optional[str] = None):
+    # Seconds a cached device-state query stays valid (None = whole connection)
+    STATE_TTL = {
+        'screen_size': None,
+        'density': None,
+        'screen_on': 2.0,
+        'current_app': 1.0,
+        'keyboard': 1.0,
+        # Also dropped on every input and whenever a captured frame differs
+        'ui_tree': 5.0,
+    }
+    
+    # `uiautomator dump` waits for the screen to become idle, which never
+    # happens on animating screens; give up quickly and fall back to OCR
+    UI_DUMP_TIMEOUT = 3.0
+    
+    def __init__(self, device_id: Optional[str] = None, use_sendevent: bool = False,
+                 adb_path: Optional[str] = None):
         """
         Initialize ADB Controller
         
         Args:
             device_id: Specific device ID for multiple devices (optional)
+            use_sendevent: Inject gestures with sendevent instead of `input` (optional)
+            adb_path: adb executable, may include arguments such as
+                      "python fake_adb.py" (default: $ADB_PATH or `adb`)
         """
         self.device_id = device_id
-        self.base_cmd = ['adb']
+        self.adb_path = adb_path or os.environ.get('ADB_PATH', 'adb')
+        self.base_cmd = shlex.split(self.adb_path)
+        self.touch: Optional[TouchInjector] = None
+        self._state_cache: Dict[str, Tuple[float, Any]] = {}
+        # key -> number of invalidations, so a query racing an invalidation is not stored
+        self._cache_generation: Dict[str, int] = {}
+        # key -> [hits, misses] of the device-state cache
+        self.cache_stats: Dict[str, List[int]] = {key: [0, 0] for key in self.STATE_TTL}
+        # Called as on_command(command, seconds, ok) after every adb invocation
+        self.on_command: Optional[Callable[[List[str], float, bool], None]] = None
         
         if device_id:
             self.base_cmd.extend(['-s', device_id])
+        
+        if use_sendevent:
+            self.enable_touch_injector()
+    
+    def enable_touch_injector(self) -> bool:
+        """
+        Switch gestures to the low-latency sendevent injector
+        
+        Returns:
+            True if the injector is active, False if `input` is still used
+        """
+        injector = TouchInjector(self.base_cmd, self.get_screen_size())
+        if injector.probe():
+            self.touch = injector
+            return True
+        injector.close()
+        return False
+    
+    def close(self) -> None:
+        """Release the persistent shell used by the touch injector"""
+        if self.touch:
+            self.touch.close()
+            self.touch = None
+    
+    def _cached(self, key: str, loader: Callable[[], Any]) -> Any:
+        """
+        Return a cached device-state value, reloading it once its TTL expired
+        
+        Args:
+            key: Cache key from STATE_TTL
+            loader: Function querying the device
+        """
+        now = time.monotonic()
+        entry = self._state_cache.get(key)
+        stats = self.cache_stats.setdefault(key, [0, 0])
+        if entry is not None and (entry[0] is None or now < entry[0]):
+            stats[0] += 1
+            return entry[1]
+        
+        stats[1] += 1
+        generation = self._cache_generation.get(key, 0)
+        value = loader()
+        # Invalidated while loading (e.g. the frame changed during a UI dump):
+        # the value may describe the old screen, so return it without caching
+        if self._cache_generation.get(key, 0) == generation:
+            ttl = self.STATE_TTL.get(key)
+            self._state_cache[key] = (None if ttl is None else now + ttl, value)
+        return value
+    
+    def invalidate_cache(self, *keys: str) -> None:
+        """
+        Drop cached device state
+        
+        Args:
+            keys: Keys to drop; all volatile state when omitted
+        """
+        if not keys:
+            keys = tuple(k for k, ttl in self.STATE_TTL.items() if ttl is not None)
+        for key in keys:
+            self._cache_generation[key] = self._cache_generation.get(key, 0) + 1
+            self._state_cache.pop(key, None)
+    
+    def _invalidate_after(self, command: List[str]) -> None:
+        """Invalidate state that the given shell command may have changed"""
+        if len(command) < 2 or command[0] != 'shell':
+            return
+        if command[1] == 'input':
+            self.invalidate_cache('current_app', 'keyboard', 'ui_tree')
+            if 'KEYCODE_WAKEUP' in command or 'KEYCODE_POWER' in command:
+                self.invalidate_cache('screen_on')
+        elif command[1] in ('am', 'monkey'):
+            self.invalidate_cache('current_app', 'keyboard', 'ui_tree')
     
-    def _execute_command(self, command: List[str]) -> str:
+    def _touch_gesture(self, gesture, *args, **kwargs) -> bool:
+        """
+        Run a gesture on the touch injector if it is enabled
+        
+        Returns:
+            True if handled, False if the caller should fall back to `input`
+        """
+        if not self.touch:
+            return False
+        try:
+            getattr(self.touch, gesture)(*args, **kwargs)
+            self.invalidate_cache('current_app', 'keyboard', 'ui_tree')
+            return True
+        except Exception as e:
+            print(f"sendevent {gesture} failed, falling back to input: {e}")
+            return False
+    
+    def _report_command(self, command: List[str], started: float, ok: bool) -> None:
+        if self.on_command:
+            try:
+                self.on_command(command, time.perf_counter() - started, ok)
+            except Exception as e:
+                print(f"on_command hook failed: {e}")
+    
+    def _execute_command(self, command: List[str], timeout: Optional[float] = None) -> str:
         """
         Execute ADB command
         
         Args:
             command: Command parts to execute
+            timeout: Seconds before the command is killed (default: no limit)
             
         Returns:
-            Command output as string
+            Command output as string, empty if the command failed or timed out
         """
+        started = time.perf_counter()
+        ok = False
         try:
             full_cmd = self.base_cmd + command
             result = subprocess.run(
                 full_cmd,
                 capture_output=True,
-                text=True,
-                check=True
+                encoding='utf-8',
+                errors='replace',
+                check=True,
+                timeout=timeout
             )
+            ok = True
             return result.stdout.strip()
         except subprocess.CalledProcessError as e:
             print(f"Command failed: {e}")
             return ""
+        except subprocess.TimeoutExpired as e:
+            print(f"Command timed out: {e}")
+            return ""
+        finally:
+            self._report_command(command, started, ok)
+            self._invalidate_after(command)
     
     def get_devices(self) -> List[str]:
         """Get list of connected devices"""
@@ -63,11 +203,43 @@ class ADBController:
         Returns:
             Tuple of (width, height)
         """
+        try:
+            return self._cached('screen_size', self._query_screen_size)
+        except ValueError as e:
+            # Not cached, so the next call asks the device again
+            print(f"Screen size unavailable: {e}")
+            return 1080, 1920  # Default fallback
+    
+    def _query_screen_size(self) -> Tuple[int, int]:
         output = self._execute_command(['shell', 'wm', 'size'])
         match = re.search(r'Physical size: (\d+)x(\d+)', output)
+        if not match:
+            raise ValueError(f"unexpected `wm size` output: {output[:200]!r}")
+        return int(match.group(1)), int(match.group(2))
+    
+    def get_density(self) -> int:
+        """
+        Get device screen density (dpi)
+        
+        Returns:
+            Density in dpi, override density if one is set
+        """
+        try:
+            return self._cached('density', self._query_density)
+        except ValueError as e:
+            # Not cached, so the next call asks the device again
+            print(f"Density unavailable: {e}")
+            return 420  # Default fallback
+    
+    def _query_density(self) -> int:
+        output = self._execute_command(['shell', 'getprop ro.sf.lcd_density; wm density'])
+        match = re.search(r'Override density: (\d+)', output) or re.search(r'Physical density: (\d+)', output)
         if match:
-            return int(match.group(1)), int(match.group(2))
-        return 1080, 1920  # Default fallback
+            return int(match.group(1))
+        match = re.match(r'\s*(\d+)', output)
+        if not match:
+            raise ValueError(f"unexpected density output: {output[:200]!r}")
+        return int(match.group(1))
     
     def click(self, coords: List[int]) -> None:
         """
@@ -77,6 +249,8 @@ class ADBController:
             coords: [x, y] coordinates as list or tuple
         """
         x, y = coords
+        if self._touch_gesture('tap', x, y):
+            return
         self._execute_command(['shell', 'input', 'tap', str(x), str(y)])
     
     def slide(self, x1: int, y1: int, x2: int, y2: int, 
@@ -91,11 +265,40 @@ class ADBController:
             y2: Ending Y coordinate
             duration_ms: Swipe duration in milliseconds
         """
+        if self._touch_gesture('swipe', [(x1, y1), (x2, y2)], duration_ms):
+            return
         self._execute_command([
             'shell', 'input', 'swipe',
             str(x1), str(y1), str(x2), str(y2), str(duration_ms)
         ])
     
+    def swipe_path(self, points: List[Tuple[int, int]], duration_ms: int = 500) -> None:
+        """
+        Swipe along an arbitrary path
+        
+        Args:
+            points: Path vertices as [(x, y), ...]
+            duration_ms: Total swipe duration in milliseconds
+        """
+        if self._touch_gesture('swipe', points, duration_ms):
+            return
+        # `input swipe` only draws straight lines, split the time across segments
+        segment_ms = max(duration_ms // max(len(points) - 1, 1), 1)
+        for (x1, y1), (x2, y2) in zip(points, points[1:]):
+            self.slide(x1, y1, x2, y2, segment_ms)
+    
+    def multi_touch(self, paths: List[List[Tuple[int, int]]], duration_ms: int = 500) -> None:
+        """
+        Perform a multi-finger gesture (requires the sendevent injector)
+        
+        Args:
+            paths: One point sequence per finger
+            duration_ms: Gesture duration in milliseconds
+        """
+        if not self.touch:
+            raise RuntimeError("Multi-touch requires the sendevent touch injector")
+        self.touch.perform(paths, duration_ms)
+    
     def text(self, text: str) -> None:
         """
         Input text (requires text field to be focused)
@@ -191,18 +394,61 @@ class ADBController:
     
     def get_current_app(self) -> Optional[str]:
         """Get current foreground app package name"""
+        focus = self.get_current_focus()
+        return focus['package'] if focus else None
+    
+    def get_current_focus(self) -> Optional[Dict[str, str]]:
+        """
+        Get the focused app and activity
+        
+        Returns:
+            {'package': ..., 'activity': ...} with the activity fully qualified,
+            or None when no app window has focus
+        """
+        return self._cached('current_app', self._query_current_focus)
+    
+    def _query_current_focus(self) -> Optional[Dict[str, str]]:
+        # Filter on the device so only the focus lines cross the USB link
         output = self._execute_command([
-            'shell', 'dumpsys', 'window', 'windows'
+            'shell', "dumpsys window windows | grep -E 'mCurrentFocus|mFocusedApp' || true"
         ])
         
-        # Look for mCurrentFocus or mFocusedApp
+        # Look for mCurrentFocus or mFocusedApp ("package/activity")
         for line in output.split('\n'):
-            if 'mCurrentFocus' in line or 'mFocusedApp' in line:
-                match = re.search(r'([a-zA-Z][a-zA-Z0-9_]*(\.[a-zA-Z][a-zA-Z0-9_]*)+)/', line)
-                if match:
-                    return match.group(1)
+            match = re.search(r'([a-zA-Z][a-zA-Z0-9_]*(?:\.[a-zA-Z][a-zA-Z0-9_]*)+)/([a-zA-Z0-9_.$]*)', line)
+            if match:
+                package, activity = match.groups()
+                if activity.startswith('.'):
+                    activity = package + activity
+                return {'package': package, 'activity': activity or None}
         return None
     
+    def dump_ui(self) -> Optional[UITree]:
+        """
+        Get the view hierarchy of the current screen
+        
+        Cached until an input command, a changed frame or the TTL invalidates it.
+        
+        Returns:
+            UITree, or None when the dump failed (e.g. the screen never became
+            idle, or a secure/game surface without views)
+        """
+        return self._cached('ui_tree', self._query_ui_tree)
+    
+    def _query_ui_tree(self) -> Optional[UITree]:
+        # Dump to the shell's stdout instead of a file on /sdcard and a pull
+        output = self._execute_command(['exec-out', 'uiautomator', 'dump', '--compressed', '/dev/tty'],
+                                       timeout=self.UI_DUMP_TIMEOUT)
+        xml = extract_xml(output)
+        if xml is None:
+            print(f"uiautomator dump failed: {output[:200]}")
+            return None
+        try:
+            return UITree(xml)
+        except Exception as e:
+            print(f"Error parsing UI hierarchy: {e}")
+            return None
+    
     def press_recent_apps(self) -> None:
         """Open recent apps menu"""
         self._execute_command(['shell', 'input', 'keyevent', 'KEYCODE_APP_SWITCH'])
@@ -247,14 +493,21 @@ class ADBController:
             numpy.ndarray: Screenshot as RGB numpy array with shape (height, width, 3)
                           Returns None if screenshot fails
         """
+        command = ['shell', 'screencap', '-p']
+        started = time.perf_counter()
+        captured = False
         try:
             # Capture screenshot directly to stdout as PNG
-            full_cmd = self.base_cmd + ['shell', 'screencap', '-p']
-            result = subprocess.run(
-                full_cmd,
-                capture_output=True,
-                check=True
-            )
+            full_cmd = self.base_cmd + command
+            try:
+                result = subprocess.run(
+                    full_cmd,
+                    capture_output=True,
+                    check=True
+                )
+                captured = True
+            finally:
+                self._report_command(command, started, captured)
             
             # Check if we got data
             if not result.stdout:
@@ -289,7 +542,10 @@ class ADBController:
     
     def is_screen_on(self) -> bool:
         """Check if screen is on"""
-        output = self._execute_command(['shell', 'dumpsys', 'power'])
+        return self._cached('screen_on', self._query_screen_on)
+    
+    def _query_screen_on(self) -> bool:
+        output = self._execute_command(['shell', "dumpsys power | grep -m 1 'mWakefulness=' || true"])
         return 'mWakefulness=Awake' in output
     
     def open_app(self, package_name: str, activity: Optional[str] = None) -> None:
@@ -323,6 +579,8 @@ class ADBController:
             y: Y coordinate
             duration_ms: Press duration in milliseconds
         """
+        if self._touch_gesture('long_press', x, y, duration_ms):
+            return
         self.slide(x, y, x, y, duration_ms)
     
     def double_tap(self, x: int, y: int) -> None:
@@ -333,6 +591,8 @@ class ADBController:
             x: X coordinate
             y: Y coordinate
         """
+        if self._touch_gesture('double_tap', x, y):
+            return
         self.click([x, y])
         time.sleep(0.05)
         self.click([x, y])
@@ -344,9 +604,14 @@ class ADBController:
         Returns:
             bool: True if keyboard is shown, False otherwise
         """
+        return self._cached('keyboard', self._query_keyboard_shown)
+    
+    def _query_keyboard_shown(self) -> bool:
         try:
             # Method 1: Check input method visibility
-            output = self._execute_command(['shell', 'dumpsys', 'input_method'])
+            output = self._execute_command([
+                'shell', "dumpsys input_method | grep -E 'mInputShown|mShowRequested|mIsInputViewShown' || true"
+            ])
             
             # Look for indicators that keyboard is visible
             visible_indicators = [
@@ -360,7 +625,9 @@ class ADBController:
                     return True
             
             # Method 2: Alternative check using window focus
-            window_output = self._execute_command(['shell', 'dumpsys', 'window', 'InputMethod'])
+            window_output = self._execute_command([
+                'shell', "dumpsys window InputMethod | grep -E 'mHasSurface|shown=' || true"
+            ])
             if 'mHasSurface=true' in window_output and 'shown=true' in window_output:
                 return True
             
@@ -0,0 +1,162 @@
+import asyncio
+import time
+from collections import deque
+from typing import Awaitable, Callable, Optional
+
+import numpy as np
+
+
+class CaptureScheduler:
+    """
+    Demand-driven screenshot capture loop
+
+    The capture rate follows whoever needs frames:
+    - boosted (a vision wait is running): capture back to back
+    - viewers connected: `viewer_interval`
+    - nobody: throttle down to `idle_interval`
+
+    `capture_now()` lets callers request a fresh frame. A capture already in
+    flight may predate the caller's input, so callers arriving meanwhile
+    share the next capture, started as soon as the current one finishes.
+    """
+
+    def __init__(self,
+                 capture: Callable[[], Optional[np.ndarray]],
+                 on_frame: Callable[[np.ndarray], Awaitable[None]],
+                 demand: Callable[[], int],
+                 idle_interval: float = 5.0,
+                 viewer_interval: float = 0.5,
+                 boost_interval: float = 0.0):
+        """
+        Initialize capture scheduler
+
+        Args:
+            capture: Blocking function returning an RGB frame or None
+            on_frame: Coroutine called with every captured frame
+            demand: Returns the number of active frame viewers
+            idle_interval: Seconds between captures without demand
+            viewer_interval: Seconds between captures while viewers are connected
+            boost_interval: Seconds between captures while boosted
+        """
+        self.capture = capture
+        self.on_frame = on_frame
+        self.demand = demand
+        self.idle_interval = idle_interval
+        self.viewer_interval = viewer_interval
+        self.boost_interval = boost_interval
+
+        self.seq = 0
+        self.last_capture = 0.0
+        self.last_error: Optional[str] = None
+        self._boost_until = 0.0
+        self._inflight: Optional[asyncio.Future] = None
+        self._next: Optional[asyncio.Future] = None
+        self._wake = asyncio.Event()
+        self._history = deque(maxlen=30)
+
+    @property
+    def mode(self) -> str:
+        if time.monotonic() < self._boost_until:
+            return 'boost'
+        if self.demand() > 0:
+            return 'viewer'
+        return 'idle'
+
+    def current_interval(self) -> float:
+        return {
+            'boost': self.boost_interval,
+            'viewer': self.viewer_interval,
+            'idle': self.idle_interval,
+        }[self.mode]
+
+    def fps(self) -> float:
+        """Capture rate over the recent history"""
+        if len(self._history) < 2:
+            return 0.0
+        span = self._history[-1] - self._history[0]
+        return (len(self._history) - 1) / span if span > 0 else 0.0
+
+    def wake(self) -> None:
+        """Re-evaluate the schedule (e.g. after a viewer connected)"""
+        self._wake.set()
+
+    def boost(self, duration_s: float) -> None:
+        """
+        Capture at full rate for a while
+
+        Args:
+            duration_s: Boost duration in seconds, extends any running boost
+        """
+        self._boost_until = max(self._boost_until, time.monotonic() + duration_s)
+        self.wake()
+
+    async def capture_now(self) -> int:
+        """
+        Capture a frame that starts after this call
+
+        Joins a capture queued but not started yet; while one is in flight,
+        queues the next capture rather than returning a frame that may have
+        been taken before the caller's click or swipe.
+
+        Returns:
+            Sequence number of the captured frame
+        """
+        if self._next is None:
+            if self._inflight is None:
+                self._inflight = asyncio.ensure_future(self._capture())
+                self._inflight.add_done_callback(self._clear_inflight)
+                return await asyncio.shield(self._inflight)
+            self._next = asyncio.ensure_future(self._capture_after(self._inflight))
+            self._next.add_done_callback(self._clear_inflight)
+        return await asyncio.shield(self._next)
+
+    async def _capture_after(self, previous: asyncio.Future) -> int:
+        await asyncio.wait([previous])
+        self._inflight, self._next = self._next, None
+        return await self._capture()
+
+    def _clear_inflight(self, future) -> None:
+        if self._inflight is future:
+            self._inflight = None
+        if self._next is future:
+            self._next = None
+
+    async def _capture(self) -> int:
+        frame = await asyncio.to_thread(self.capture)
+        if frame is None:
+            self.last_error = "Capture returned no frame"
+            raise RuntimeError(self.last_error)
+
+        await self.on_frame(frame)
+        self.seq += 1
+        self.last_capture = time.monotonic()
+        self.last_error = None
+        self._history.append(self.last_capture)
+        return self.seq
+
+    async def run(self) -> None:
+        """Capture loop, run as a background task"""
+        while True:
+            try:
+                delay = self.last_capture + self.current_interval() - time.monotonic()
+                if delay > 0:
+                    try:
+                        await asyncio.wait_for(self._wake.wait(), timeout=delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    self._wake.clear()
+                    # Woken up early: the demand may have changed, check again
+                    if time.monotonic() < self.last_capture + self.current_interval():
+                        continue
+
+                await self.capture_now()
+
+            except asyncio.CancelledError:
+                print("Capture scheduler cancelled")
+                break
+            except Exception as e:
+                print(f"Auto-update error: {e}")
+                try:
+                    await asyncio.sleep(1)
+                except asyncio.CancelledError:
+                    break
@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""
+Fake `adb` executable for load and latency testing without a phone
+
+Point the controller at it instead of the real adb:
+
+    chmod +x fake_adb.py
+    ADB_PATH=$PWD/fake_adb.py python adb_api.py
+    ADB_PATH="python fake_adb.py" python load_test.py --devices 200
+
+State lives in FAKE_ADB_HOME (default /tmp/fake_adb), one directory per serial:
+- `config.json` in the home directory applies to every device and is
+  overridden by `<serial>/config.json`
+- `<serial>/events.jsonl` records every `input` command with a timestamp
+- `<serial>/state.json` holds the screen/app state and the frame counter
+
+Config keys (all optional):
+- `screen_size`: [width, height] (default [1080, 2340])
+- `density`: dpi (default 420)
+- `frames`: list of PNG files or a directory; `screencap` serves them in turn.
+  Without frames, a few synthetic frames are generated once and cycled.
+- `frame_mode`: `cycle` (next frame on every capture) or `hold` (advance only
+  after an `input` command, like a real UI reacting to taps)
+- `latency_ms`: number or {command: ms, 'default': ms}, e.g. {"screencap": 120}
+- `jitter_ms`: uniform random extra latency
+- `failure_rate`: number or {command: rate}; failing commands exit 1
+- `offline`: true makes the device report `offline`
+- `ui_dump`: XML file answered by `uiautomator dump`; without it a small
+  hierarchy of the focused app is generated (a title and an "OK" button)
+
+FAKE_ADB_DEVICES=N lists serials fake-0000 .. fake-N-1 in `adb devices`;
+FAKE_ADB_LATENCY_MS and FAKE_ADB_FAILURE_RATE override the config files.
+"""
+import fcntl
+import json
+import os
+import random
+import shutil
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+HOME = os.environ.get('FAKE_ADB_HOME', '/tmp/fake_adb')
+DEFAULT_SERIAL = 'fake-0000'
+DEFAULTS: Dict[str, Any] = {
+    'screen_size': [1080, 2340],
+    'density': 420,
+    'frames': None,
+    'frame_mode': 'cycle',
+    'latency_ms': 0,
+    'jitter_ms': 0,
+    'failure_rate': 0.0,
+    'offline': False,
+    'ui_dump': None,
+}
+SYNTHETIC_FRAMES = 8
+LAUNCHER = 'com.android.launcher3/.Launcher'
+
+
+class FakeFailure(Exception):
+    """Injected failure, reported like a dropped adb connection"""
+
+
+def read_json(path: str) -> Dict[str, Any]:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_json(path: str, data: Dict[str, Any]) -> None:
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def listed_serials() -> List[str]:
+    count = int(os.environ.get('FAKE_ADB_DEVICES', '1'))
+    serials = [f'fake-{i:04d}' for i in range(count)]
+    if os.path.isdir(HOME):
+        for name in sorted(os.listdir(HOME)):
+            if os.path.isdir(os.path.join(HOME, name)) and not name.startswith('_') and name not in serials:
+                serials.append(name)
+    return serials
+
+
+class FakeDevice:
+    """One simulated device backed by its state directory"""
+
+    def __init__(self, serial: str):
+        self.serial = serial
+        self.dir = os.path.join(HOME, serial)
+        os.makedirs(self.dir, exist_ok=True)
+        self.config = {**DEFAULTS, **read_json(os.path.join(HOME, 'config.json')),
+                       **read_json(os.path.join(self.dir, 'config.json'))}
+        if 'FAKE_ADB_LATENCY_MS' in os.environ:
+            self.config['latency_ms'] = float(os.environ['FAKE_ADB_LATENCY_MS'])
+        if 'FAKE_ADB_FAILURE_RATE' in os.environ:
+            self.config['failure_rate'] = float(os.environ['FAKE_ADB_FAILURE_RATE'])
+
+    # ------------------------------------------------------------------
+    # State
+    # ------------------------------------------------------------------
+    def _update_state(self, change) -> Dict[str, Any]:
+        """Read-modify-write state.json under a file lock (captures run concurrently)"""
+        with open(os.path.join(self.dir, 'state.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            path = os.path.join(self.dir, 'state.json')
+            state = {'screen_on': True, 'focus': LAUNCHER, 'frame': 0, 'keyboard': False, **read_json(path)}
+            if change:
+                change(state)
+                write_json(path, state)
+            return state
+
+    def state(self) -> Dict[str, Any]:
+        return self._update_state(None)
+
+    def record_input(self, args: List[str]) -> None:
+        with open(os.path.join(self.dir, 'events.jsonl'), 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'ts': time.time(), 'args': args}) + '\n')
+
+        def change(state):
+            if 'KEYCODE_POWER' in args:
+                state['screen_on'] = not state['screen_on']
+            elif 'KEYCODE_WAKEUP' in args:
+                state['screen_on'] = True
+            elif 'KEYCODE_HOME' in args:
+                state['focus'] = LAUNCHER
+            if args[:1] == ['text']:
+                state['keyboard'] = True
+            elif 'KEYCODE_BACK' in args:
+                state['keyboard'] = False
+            if self.config['frame_mode'] == 'hold':
+                state['frame'] += 1
+        self._update_state(change)
+
+    # ------------------------------------------------------------------
+    # Latency / failures
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _per_command(setting, command: str, default: float = 0) -> float:
+        if isinstance(setting, dict):
+            return float(setting.get(command, setting.get('default', default)))
+        return float(setting or default)
+
+    def simulate_link(self, command: str) -> None:
+        delay = self._per_command(self.config['latency_ms'], command)
+        delay += random.uniform(0, float(self.config['jitter_ms'] or 0))
+        if delay > 0:
+            time.sleep(delay / 1000)
+        if random.random() < self._per_command(self.config['failure_rate'], command):
+            raise FakeFailure(f"error: closed (injected failure on {command})")
+
+    # ------------------------------------------------------------------
+    # Frames
+    # ------------------------------------------------------------------
+    def frame_files(self) -> List[str]:
+        frames = self.config['frames']
+        if isinstance(frames, str) and os.path.isdir(frames):
+            frames = sorted(os.path.join(frames, f) for f in os.listdir(frames) if f.lower().endswith('.png'))
+        if frames:
+            return frames
+        return synthetic_frames(*self.config['screen_size'])
+
+    def next_frame(self) -> bytes:
+        frames = self.frame_files()
+        advance = self.config['frame_mode'] == 'cycle'
+
+        def change(state):
+            if advance:
+                state['frame'] += 1
+        index = self._update_state(change)['frame']
+        with open(frames[index % len(frames)], 'rb') as f:
+            return f.read()
+
+
+def synthetic_frames(width: int, height: int) -> List[str]:
+    """Render a few distinct frames once per screen size and reuse them"""
+    directory = os.path.join(HOME, f'_frames_{width}x{height}')
+    paths = [os.path.join(directory, f'{i:02d}.png') for i in range(SYNTHETIC_FRAMES)]
+    if all(os.path.exists(p) for p in paths):
+        return paths
+
+    from PIL import Image, ImageDraw
+    os.makedirs(directory, exist_ok=True)
+    for i, path in enumerate(paths):
+        img = Image.new('RGB', (width, height), (235, 235, 235))
+        draw = ImageDraw.Draw(img)
+        # A block moving down the screen so consecutive frames differ
+        top = int(height * i / SYNTHETIC_FRAMES)
+        draw.rectangle([width // 4, top, width * 3 // 4, top + height // 10], fill=(40, 120, 220))
+        draw.text((20, 20), f'fake frame {i}', fill=(0, 0, 0))
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        img.save(tmp_path, format='PNG')
+        os.replace(tmp_path, path)
+    return paths
+
+
+# ----------------------------------------------------------------------
+# Shell commands
+# ----------------------------------------------------------------------
+def shell(device: FakeDevice, command: str) -> bytes:
+    """
+    Answer one shell command line the way the controller expects
+
+    Pipes into grep are ignored: the canned outputs only contain the lines
+    the controller greps for.
+    """
+    outputs = []
+    for part in command.split(';'):
+        part = part.split('|')[0].strip()
+        if part:
+            outputs.append(shell_command(device, part.split()))
+    return b''.join(outputs)
+
+
+def shell_command(device: FakeDevice, args: List[str]) -> bytes:
+    name = args[0]
+    device.simulate_link(name)
+    width, height = device.config['screen_size']
+
+    if name == 'screencap':
+        data = device.next_frame()
+        paths = [a for a in args[1:] if not a.startswith('-')]
+        if paths:
+            target = os.path.join(device.dir, 'sdcard', os.path.basename(paths[0]))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, 'wb') as f:
+                f.write(data)
+            return b''
+        return data
+    if name == 'input':
+        device.record_input(args[1:])
+        return b''
+    if name == 'wm':
+        if args[1:2] == ['size']:
+            return f'Physical size: {width}x{height}\n'.encode()
+        if args[1:2] == ['density']:
+            return f"Physical density: {device.config['density']}\n".encode()
+        return b''
+    if name == 'getprop':
+        if 'ro.sf.lcd_density' in args:
+            return f"{device.config['density']}\n".encode()
+        return b''
+    if name == 'dumpsys':
+        return dumpsys(device, args[1:])
+    if name in ('am', 'monkey'):
+        package = args[args.index('-n') + 1] if '-n' in args else args[args.index('-p') + 1] + '/.MainActivity'
+
+        def change(state):
+            state['focus'] = package if '/' in package else package + '/.MainActivity'
+        device._update_state(change)
+        return b''
+    if name == 'uiautomator' and args[1:2] == ['dump']:
+        return ui_dump(device)
+    if name == 'echo':
+        return (' '.join(args[1:]) + '\n').encode()
+    if name in ('getevent', '['):
+        return b''  # no writable touchscreen: the touch injector falls back to `input`
+    return b''
+
+
+def dumpsys(device: FakeDevice, args: List[str]) -> bytes:
+    state = device.state()
+    service = args[0] if args else ''
+    if service == 'window':
+        if 'InputMethod' in args:
+            shown = 'true' if state['keyboard'] else 'false'
+            return f'  mHasSurface={shown}\n  shown={shown}\n'.encode()
+        focus = state['focus']
+        return (f"  mCurrentFocus=Window{{1 u0 {focus}}}\n"
+                f"  mFocusedApp=ActivityRecord{{2 u0 {focus} t1}}\n").encode()
+    if service == 'power':
+        return f"  mWakefulness={'Awake' if state['screen_on'] else 'Asleep'}\n".encode()
+    if service == 'input_method':
+        return f"  mInputShown={'true' if state['keyboard'] else 'false'}\n".encode()
+    if service == 'input':
+        return b'    SurfaceOrientation: 0\n'
+    return b''
+
+
+def ui_dump(device: FakeDevice) -> bytes:
+    """`uiautomator dump /dev/tty`: the hierarchy followed by uiautomator's trailer line"""
+    if device.config['ui_dump']:
+        with open(device.config['ui_dump'], 'rb') as f:
+            xml = f.read()
+    else:
+        from xml.sax.saxutils import quoteattr
+        width, height = device.config['screen_size']
+        package = device.state()['focus'].split('/')[0]
+
+        def node(index, text, resource_id, cls, bounds, clickable=False, children=''):
+            return (f'<node index="{index}" text={quoteattr(text)} resource-id={quoteattr(resource_id)} '
+                    f'class="{cls}" package="{package}" content-desc="" clickable="{str(clickable).lower()}" '
+                    f'enabled="true" bounds="[{bounds[0]},{bounds[1]}][{bounds[2]},{bounds[3]}]">{children}</node>')
+        title = node(0, package, f'{package}:id/title', 'android.widget.TextView',
+                     (0, height // 20, width, height // 10))
+        ok = node(1, 'OK', f'{package}:id/ok', 'android.widget.Button',
+                  (width // 4, height * 8 // 10, width * 3 // 4, height * 9 // 10), clickable=True)
+        root = node(0, '', '', 'android.widget.FrameLayout', (0, 0, width, height), children=title + ok)
+        xml = f"<?xml version='1.0' encoding='UTF-8' standalone='yes' ?><hierarchy rotation=\"0\">{root}</hierarchy>".encode()
+    return xml + b'UI hierchary dumped to: /dev/tty\n'
+
+
+def interactive_shell(device: FakeDevice) -> None:
+    """`adb shell` without arguments: run stdin line by line (used by the touch injector)"""
+    for line in sys.stdin:
+        try:
+            sys.stdout.buffer.write(shell(device, line.strip()))
+        except FakeFailure:
+            return
+        sys.stdout.flush()
+
+
+# ----------------------------------------------------------------------
+# Entry point
+# ----------------------------------------------------------------------
+def main(argv: List[str]) -> int:
+    serial: Optional[str] = os.environ.get('ANDROID_SERIAL')
+    while argv and argv[0].startswith('-'):
+        option = argv.pop(0)
+        if option == '-s' and argv:
+            serial = argv.pop(0)
+    if not argv:
+        sys.stderr.write('fake adb: no command\n')
+        return 1
+
+    command, args = argv[0], argv[1:]
+    if command == 'version':
+        print('Android Debug Bridge version 1.0.41 (fake_adb)')
+        return 0
+    if command == 'devices':
+        print('List of devices attached')
+        for name in listed_serials():
+            offline = FakeDevice(name).config['offline']
+            print(f"{name}\t{'offline' if offline else 'device'}")
+        print()
+        return 0
+    if command in ('start-server', 'kill-server'):
+        return 0
+
+    device = FakeDevice(serial or DEFAULT_SERIAL)
+    if device.config['offline']:
+        sys.stderr.write("error: device offline\n")
+        return 1
+    try:
+        if command in ('shell', 'exec-out'):
+            if not args:
+                interactive_shell(device)
+                return 0
+            sys.stdout.buffer.write(shell(device, ' '.join(args)))
+        elif command == 'pull' and len(args) >= 2:
+            device.simulate_link('pull')
+            shutil.copyfile(os.path.join(device.dir, 'sdcard', os.path.basename(args[0])), args[1])
+        elif command == 'push' and len(args) >= 2:
+            device.simulate_link('push')
+            os.makedirs(os.path.join(device.dir, 'sdcard'), exist_ok=True)
+            shutil.copyfile(args[0], os.path.join(device.dir, 'sdcard', os.path.basename(args[1])))
+        else:
+            device.simulate_link(command)
+    except FakeFailure as e:
+        sys.stderr.write(f"{e}\n")
+        return 1
+    except (OSError, ValueError, IndexError, ImportError) as e:
+        sys.stderr.write(f"fake adb: {e}\n")
+        return 1
+    sys.stdout.flush()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
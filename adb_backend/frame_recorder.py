@@ -0,0 +1,340 @@
+import io
+import json
+import mmap
+import os
+import queue
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+# One fixed-size record per stored frame, appended to index.bin
+INDEX_DTYPE = np.dtype([
+    ('ts', '<f8'),        # capture time (unix seconds)
+    ('segment', '<u4'),   # segment file number
+    ('offset', '<u8'),    # byte offset inside the segment
+    ('length', '<u4'),    # payload length
+    ('kind', 'u1'),       # KEYFRAME or DELTA
+    ('x', '<u2'),         # delta patch position and size
+    ('y', '<u2'),
+    ('w', '<u2'),
+    ('h', '<u2'),
+    ('step', '<i4'),      # script step active when captured (-1: none)
+])
+
+KEYFRAME = 0
+DELTA = 1
+
+
+def segment_path(run_dir: str, segment: int) -> str:
+    return os.path.join(run_dir, f"seg_{segment:05d}.bin")
+
+
+class FrameRecorder:
+    """
+    Record the capture stream of one run as keyframes plus dirty-rectangle deltas
+
+    Layout of a recording directory:
+    - `seg_NNNNN.bin`: appended PNG payloads, every segment starts with a keyframe
+    - `index.bin`: one INDEX_DTYPE record per frame (memory-mapped by FrameReader)
+    - `steps.jsonl`: script steps marked during the run
+    - `meta.json`: run metadata
+
+    Encoding happens on a worker thread; `submit` never blocks the capture
+    loop and drops frames if the worker falls behind. When the run exceeds
+    `max_bytes`, the oldest segments are deleted.
+    """
+
+    def __init__(self, run_dir: str,
+                 keyframe_interval: int = 50,
+                 segment_bytes: int = 32 * 1024 * 1024,
+                 max_bytes: int = 1024 * 1024 * 1024,
+                 queue_size: int = 8):
+        """
+        Initialize frame recorder
+
+        Args:
+            run_dir: Directory of this recording (created if missing)
+            keyframe_interval: Frames between forced keyframes
+            segment_bytes: Size after which a new segment is started
+            max_bytes: Storage budget, oldest segments are dropped beyond it
+            queue_size: Frames buffered for the encoder before dropping
+        """
+        self.run_dir = run_dir
+        self.keyframe_interval = keyframe_interval
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        os.makedirs(run_dir, exist_ok=True)
+
+        self.step = -1
+        self.frames = 0
+        self.dropped = 0
+        self.total_bytes = 0
+        self._segment = 0
+        self._segment_sizes: Dict[int, int] = {}
+        self._since_key = 0
+        self._previous: Optional[np.ndarray] = None
+        self._queue: "queue.Queue[Optional[Tuple[float, int, np.ndarray]]]" = queue.Queue(maxsize=queue_size)
+
+        self._index = open(os.path.join(run_dir, 'index.bin'), 'ab')
+        self._steps = open(os.path.join(run_dir, 'steps.jsonl'), 'a', encoding='utf-8')
+        self._data = open(segment_path(run_dir, self._segment), 'ab')
+        self._write_meta(started_at=time.time())
+
+        self._worker = threading.Thread(target=self._run, name='frame-recorder', daemon=True)
+        self._worker.start()
+
+    def _write_meta(self, **fields) -> None:
+        meta_path = os.path.join(self.run_dir, 'meta.json')
+        meta = {}
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        meta.update(fields)
+        with open(meta_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    @property
+    def queue_depth(self) -> int:
+        """Frames waiting for the encoder thread"""
+        return self._queue.qsize()
+
+    def mark_step(self, index: int, function: str, args: Optional[list] = None) -> None:
+        """
+        Mark the script step that is active from now on
+
+        Args:
+            index: Step number within the script
+            function: Blockly function name
+            args: Function arguments
+        """
+        self.step = index
+        self._steps.write(json.dumps({
+            'step': index, 'function': function, 'args': args or [], 'ts': time.time()
+        }, ensure_ascii=False) + '\n')
+        self._steps.flush()
+
+    def submit(self, frame: np.ndarray) -> bool:
+        """
+        Queue a frame for recording without blocking
+
+        Returns:
+            False if the frame was dropped because the encoder is busy
+        """
+        try:
+            self._queue.put_nowait((time.time(), self.step, frame))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def close(self) -> None:
+        """Flush pending frames and close the recording"""
+        self._queue.put(None)
+        self._worker.join()
+        for f in (self._index, self._steps, self._data):
+            f.close()
+        self._write_meta(stopped_at=time.time(), frames=self.frames,
+                         dropped=self.dropped, bytes=self.total_bytes)
+
+    # ------------------------------------------------------------------
+    # Encoder thread
+    # ------------------------------------------------------------------
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            try:
+                self._record(*item)
+            except Exception as e:
+                print(f"Frame recorder error: {e}")
+
+    @staticmethod
+    def _encode(image: np.ndarray) -> bytes:
+        buffer = io.BytesIO()
+        Image.fromarray(image).save(buffer, format='PNG', compress_level=3)
+        return buffer.getvalue()
+
+    def _record(self, ts: float, step: int, frame: np.ndarray) -> None:
+        previous = self._previous
+        key = (previous is None or previous.shape != frame.shape
+               or self._since_key >= self.keyframe_interval
+               or self._data.tell() == 0)
+
+        x = y = 0
+        h, w = frame.shape[:2]
+        patch = frame
+        if not key:
+            changed = np.any(frame != previous, axis=2)
+            rows = np.flatnonzero(changed.any(axis=1))
+            if rows.size == 0:
+                return  # identical frame, nothing to store
+            cols = np.flatnonzero(changed.any(axis=0))
+            y, x = int(rows[0]), int(cols[0])
+            h, w = int(rows[-1]) - y + 1, int(cols[-1]) - x + 1
+            # A delta covering most of the screen costs as much as a keyframe
+            if h * w > 0.5 * frame.shape[0] * frame.shape[1]:
+                key = True
+                x = y = 0
+                h, w = frame.shape[:2]
+            else:
+                patch = frame[y:y + h, x:x + w]
+
+        payload = self._encode(patch)
+        offset = self._data.tell()
+        self._data.write(payload)
+        self._data.flush()
+
+        record = np.zeros(1, dtype=INDEX_DTYPE)
+        record[0] = (ts, self._segment, offset, len(payload),
+                     KEYFRAME if key else DELTA, x, y, w, h, step)
+        self._index.write(record.tobytes())
+        self._index.flush()
+
+        self._previous = frame
+        self._since_key = 0 if key else self._since_key + 1
+        self.frames += 1
+        self.total_bytes += len(payload)
+        self._segment_sizes[self._segment] = offset + len(payload)
+
+        if offset + len(payload) >= self.segment_bytes:
+            self._next_segment()
+        self._enforce_budget()
+
+    def _next_segment(self) -> None:
+        self._data.close()
+        self._segment += 1
+        self._data = open(segment_path(self.run_dir, self._segment), 'ab')
+        self._since_key = self.keyframe_interval  # new segment starts with a keyframe
+
+    def _enforce_budget(self) -> None:
+        while self.total_bytes > self.max_bytes and len(self._segment_sizes) > 1:
+            oldest = min(self._segment_sizes)
+            self.total_bytes -= self._segment_sizes.pop(oldest)
+            try:
+                os.remove(segment_path(self.run_dir, oldest))
+            except OSError:
+                pass
+
+
+class FrameReader:
+    """
+    Random access to a recording written by FrameRecorder
+
+    The index and segments are memory-mapped; frames are rebuilt from the
+    nearest preceding keyframe, and sequential reads reuse the previous
+    frame so iterating a run decodes every payload once.
+    """
+
+    def __init__(self, run_dir: str):
+        self.run_dir = run_dir
+        self._segments: Dict[int, mmap.mmap] = {}
+        self._cache: Optional[Tuple[int, np.ndarray]] = None
+        self.index = self._load_index()
+        self.steps = self._load_steps()
+
+    def _load_index(self) -> np.ndarray:
+        path = os.path.join(self.run_dir, 'index.bin')
+        count = os.path.getsize(path) // INDEX_DTYPE.itemsize if os.path.exists(path) else 0
+        if count == 0:
+            return np.zeros(0, dtype=INDEX_DTYPE)
+        index = np.memmap(path, dtype=INDEX_DTYPE, mode='r', shape=(count,))
+        # Frames of segments dropped by the storage budget cannot be decoded
+        available = np.array([os.path.exists(segment_path(self.run_dir, s))
+                              for s in np.unique(index['segment'])])
+        if available.all():
+            return index
+        keep = np.isin(index['segment'], np.unique(index['segment'])[available])
+        return index[keep]
+
+    def _load_steps(self) -> List[dict]:
+        path = os.path.join(self.run_dir, 'steps.jsonl')
+        if not os.path.exists(path):
+            return []
+        with open(path, 'r', encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def refresh(self) -> None:
+        """Pick up frames appended since the reader was opened"""
+        self.index = self._load_index()
+        self.steps = self._load_steps()
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        return self.index['ts']
+
+    def seek(self, ts: float) -> int:
+        """Index of the last frame captured at or before `ts`"""
+        return max(int(np.searchsorted(self.index['ts'], ts, side='right')) - 1, 0)
+
+    def frames_for_step(self, step: int) -> np.ndarray:
+        """Frame indices captured while `step` was active"""
+        return np.flatnonzero(self.index['step'] == step)
+
+    def _payload(self, i: int) -> np.ndarray:
+        record = self.index[i]
+        segment = int(record['segment'])
+        if segment not in self._segments:
+            with open(segment_path(self.run_dir, segment), 'rb') as f:
+                self._segments[segment] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        data = self._segments[segment]
+        offset = int(record['offset'])
+        return np.array(Image.open(io.BytesIO(data[offset:offset + int(record['length'])])))
+
+    def frame(self, i: int) -> np.ndarray:
+        """
+        Rebuild frame `i`
+
+        Returns:
+            RGB frame as numpy array
+        """
+        if i < 0:
+            i += len(self)
+        kinds = self.index['kind']
+
+        if self._cache is not None and self._cache[0] <= i:
+            start, frame = self._cache[0] + 1, self._cache[1].copy()
+            # Restart from a keyframe if one lies between cache and target
+            keys = np.flatnonzero(kinds[start:i + 1] == KEYFRAME)
+            if keys.size:
+                start = start + int(keys[-1])
+                frame = None
+        else:
+            keys = np.flatnonzero(kinds[:i + 1] == KEYFRAME)
+            if keys.size == 0:
+                raise ValueError(f"No keyframe before frame {i}")
+            start, frame = int(keys[-1]), None
+
+        for j in range(start, i + 1):
+            record = self.index[j]
+            patch = self._payload(j)
+            if record['kind'] == KEYFRAME:
+                frame = patch
+            else:
+                y, x = int(record['y']), int(record['x'])
+                frame[y:y + patch.shape[0], x:x + patch.shape[1]] = patch
+
+        self._cache = (i, frame)
+        return frame.copy()
+
+    def __iter__(self) -> Iterator[Tuple[int, float, int, np.ndarray]]:
+        """Yield (index, timestamp, step, frame) for every frame"""
+        for i in range(len(self)):
+            yield i, float(self.index['ts'][i]), int(self.index['step'][i]), self.frame(i)
+
+    def close(self) -> None:
+        for data in self._segments.values():
+            data.close()
+        self._segments.clear()
+
+    def __enter__(self) -> 'FrameReader':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -0,0 +1,182 @@
+import asyncio
+import io
+import zlib
+from typing import Dict, Optional, Set, Tuple
+
+import numpy as np
+from PIL import Image
+
+
+class FrameSubscriber:
+    """
+    One viewer of the frame stream
+
+    Holds only the sequence number of the newest frame, so a viewer that
+    cannot keep up skips intermediate frames instead of queuing them.
+    """
+
+    def __init__(self, image_format: str, quality: int):
+        self.image_format = image_format
+        self.quality = quality
+        self.last_sent = 0
+        self.dropped = 0
+        self._event = asyncio.Event()
+
+    def notify(self) -> None:
+        if self._event.is_set():
+            self.dropped += 1
+        self._event.set()
+
+    async def wait(self) -> None:
+        await self._event.wait()
+        self._event.clear()
+
+
+class FrameBroadcaster:
+    """
+    Share captured frames between any number of stream viewers
+
+    Frames are published by the capture loop; unchanged frames are
+    skipped and every (format, quality) pair is encoded once per frame no
+    matter how many viewers ask for it.
+    """
+
+    FORMATS = {'jpeg': 'JPEG', 'webp': 'WEBP', 'png': 'PNG'}
+    MEDIA_TYPES = {'jpeg': 'image/jpeg', 'webp': 'image/webp', 'png': 'image/png'}
+
+    def __init__(self, default_format: str = 'jpeg', default_quality: int = 70):
+        """
+        Initialize frame broadcaster
+
+        Args:
+            default_format: 'jpeg', 'webp' or 'png' (lossless)
+            default_quality: Encoder quality (1-100)
+        """
+        self.default_format = default_format
+        self.default_quality = default_quality
+        self.frame: Optional[np.ndarray] = None
+        self.seq = 0
+        self.unchanged = 0
+        self._dropped_closed = 0
+        self._signature: Optional[int] = None
+        self._subscribers: Set[FrameSubscriber] = set()
+        self._encoded: Dict[Tuple[str, int], Tuple[int, bytes]] = {}
+        self._encoding: Dict[Tuple[str, int, int], asyncio.Future] = {}
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    @property
+    def dropped_total(self) -> int:
+        """Frames skipped by slow viewers, including viewers that left"""
+        return self._dropped_closed + sum(s.dropped for s in self._subscribers)
+
+    def publish(self, frame: np.ndarray) -> bool:
+        """
+        Publish a captured frame
+
+        Args:
+            frame: RGB frame as numpy array
+
+        Returns:
+            True if the frame differs from the previous one
+        """
+        frame = np.ascontiguousarray(frame)
+        signature = zlib.crc32(frame.data) ^ hash(frame.shape)
+        if signature == self._signature:
+            self.unchanged += 1
+            return False
+
+        self._signature = signature
+        self.frame = frame
+        self.seq += 1
+        for subscriber in self._subscribers:
+            subscriber.notify()
+        return True
+
+    def subscribe(self, image_format: Optional[str] = None,
+                  quality: Optional[int] = None) -> FrameSubscriber:
+        """
+        Register a viewer
+
+        Args:
+            image_format: 'jpeg', 'webp' or 'png' (default: broadcaster default)
+            quality: Encoder quality (default: broadcaster default)
+
+        Returns:
+            Subscriber handle, pass it to `unsubscribe` when done
+        """
+        image_format = (image_format or self.default_format).lower()
+        if image_format not in self.FORMATS:
+            raise ValueError(f"Unsupported stream format: {image_format}")
+        quality = max(1, min(100, int(quality or self.default_quality)))
+
+        subscriber = FrameSubscriber(image_format, quality)
+        self._subscribers.add(subscriber)
+        if self.frame is not None:
+            subscriber.notify()
+        return subscriber
+
+    def unsubscribe(self, subscriber: FrameSubscriber) -> None:
+        if subscriber in self._subscribers:
+            self._subscribers.discard(subscriber)
+            self._dropped_closed += subscriber.dropped
+
+    async def next_frame(self, subscriber: FrameSubscriber) -> Tuple[int, bytes]:
+        """
+        Wait for a frame newer than the last one sent to this subscriber
+
+        Returns:
+            Tuple of (sequence number, encoded image bytes)
+        """
+        while True:
+            await subscriber.wait()
+            if self.seq != subscriber.last_sent:
+                break
+        seq, data = await self.encoded(subscriber.image_format, subscriber.quality)
+        subscriber.last_sent = seq
+        return seq, data
+
+    async def encoded(self, image_format: str, quality: int) -> Tuple[int, bytes]:
+        """
+        Encoded bytes of the current frame, shared between concurrent callers
+
+        Returns:
+            Tuple of (sequence number, encoded image bytes)
+        """
+        key = (image_format, quality)
+        cached = self._encoded.get(key)
+        if cached and cached[0] == self.seq:
+            return cached
+
+        seq, frame = self.seq, self.frame
+        pending_key = (image_format, quality, seq)
+        future = self._encoding.get(pending_key)
+        if future is None:
+            future = asyncio.ensure_future(
+                asyncio.to_thread(self._encode, frame, image_format, quality)
+            )
+            self._encoding[pending_key] = future
+            future.add_done_callback(lambda _: self._encoding.pop(pending_key, None))
+
+        data = await asyncio.shield(future)
+        self._encoded[key] = (seq, data)
+        return seq, data
+
+    async def encoded_seq(self, seq: int, image_format: str, quality: int) -> Optional[bytes]:
+        """
+        Encoded bytes of frame `seq`, e.g. the lossless version of a frame a viewer shows
+
+        Returns:
+            None when a newer frame has been published since
+        """
+        if seq != self.seq or self.frame is None:
+            return None
+        encoded_seq, data = await self.encoded(image_format, quality)
+        return data if encoded_seq == seq else None
+
+    def _encode(self, frame: np.ndarray, image_format: str, quality: int) -> bytes:
+        buffer = io.BytesIO()
+        Image.fromarray(frame).save(buffer, format=self.FORMATS[image_format], quality=quality)
+        return buffer.getvalue()
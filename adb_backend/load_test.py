@@ -0,0 +1,196 @@
+"""
+Load test of the capture/input/vision stack against simulated devices
+
+Every simulated device gets its own ADBController and CaptureScheduler, as
+adb_api.py would run them, talking to fake_adb.py instead of a phone:
+
+    python load_test.py --devices 10 50 100 200 --duration 20
+    python load_test.py --devices 50 --latency-ms 80 --failure-rate 0.02 \\
+        --template ../process_backend/templates/google.png -o load.json
+
+Each device count in `--devices` is one stage; the report shows where
+achieved capture rate or latency stops keeping up with the target.
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import shlex
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from adb_controller import ADBController
+from capture_scheduler import CaptureScheduler
+from frame_stream import FrameBroadcaster
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+FAKE_ADB = f"{shlex.quote(sys.executable)} {shlex.quote(os.path.join(BASE_DIR, 'fake_adb.py'))}"
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {}
+    values = np.asarray(samples)
+    return {
+        'p50': round(float(np.percentile(values, 50)), 2),
+        'p90': round(float(np.percentile(values, 90)), 2),
+        'p99': round(float(np.percentile(values, 99)), 2),
+        'max': round(float(values.max()), 2),
+    }
+
+
+class SimulatedDevice:
+    """One device: controller, capture loop, broadcaster and a tapping client"""
+
+    def __init__(self, serial: str, adb_path: str, interval: float, vision=None):
+        self.serial = serial
+        self.controller = ADBController(device_id=serial, adb_path=adb_path)
+        self.broadcaster = FrameBroadcaster()
+        self.vision = vision
+        self.capture_ms: List[float] = []
+        self.action_ms: List[float] = []
+        self.vision_ms: List[float] = []
+        self.failures = 0
+        self.changed = 0
+        self.scheduler = CaptureScheduler(
+            capture=self._capture,
+            on_frame=self._on_frame,
+            demand=lambda: 1,
+            viewer_interval=interval,
+        )
+
+    def _capture(self) -> Optional[np.ndarray]:
+        start = time.perf_counter()
+        frame = self.controller.screenshot_numpy()
+        if frame is None:
+            self.failures += 1
+        else:
+            self.capture_ms.append((time.perf_counter() - start) * 1000)
+        return frame
+
+    async def _on_frame(self, frame: np.ndarray) -> None:
+        if self.broadcaster.publish(frame):
+            self.changed += 1
+        if self.vision:
+            start = time.perf_counter()
+            await asyncio.to_thread(self.vision, frame)
+            self.vision_ms.append((time.perf_counter() - start) * 1000)
+
+    async def tap_loop(self, interval: float) -> None:
+        width, height = await asyncio.to_thread(self.controller.get_screen_size)
+        while True:
+            await asyncio.sleep(interval)
+            start = time.perf_counter()
+            await asyncio.to_thread(self.controller.click, [width // 2, height // 2])
+            self.action_ms.append((time.perf_counter() - start) * 1000)
+
+
+def template_vision(template_path: str):
+    """Run the process backend's template matcher on every captured frame"""
+    sys.path.append(os.path.join(BASE_DIR, '..', 'process_backend'))
+    import cv2
+    from template_match import mixed_template_match
+
+    def run(frame: np.ndarray):
+        return mixed_template_match(template_path, frame=cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
+    return run
+
+
+async def run_stage(count: int, args, vision) -> Dict[str, Any]:
+    devices = [SimulatedDevice(f'fake-{i:04d}', args.adb_path, args.interval, vision) for i in range(count)]
+    usage_before = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    tasks = [asyncio.create_task(d.scheduler.run()) for d in devices]
+    if args.tap_interval > 0:
+        tasks += [asyncio.create_task(d.tap_loop(args.tap_interval)) for d in devices]
+
+    # Event loop lag: how late a 100 ms sleep wakes up
+    lag_ms: List[float] = []
+    start = time.monotonic()
+    while time.monotonic() - start < args.duration:
+        tick = time.perf_counter()
+        await asyncio.sleep(0.1)
+        lag_ms.append(max((time.perf_counter() - tick - 0.1) * 1000, 0.0))
+    elapsed = time.monotonic() - start
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    usage_after = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu_s = sum((a.ru_utime + a.ru_stime) - (b.ru_utime + b.ru_stime)
+                for a, b in zip(usage_after, usage_before))
+
+    fps = [len(d.capture_ms) / elapsed for d in devices]
+    captures = sum(len(d.capture_ms) for d in devices)
+    return {
+        'devices': count,
+        'duration_s': round(elapsed, 2),
+        'target_fps_per_device': round(1 / args.interval, 2) if args.interval > 0 else None,
+        'fps_per_device': {'mean': round(float(np.mean(fps)), 2), 'min': round(float(np.min(fps)), 2)},
+        'captures_per_s': round(captures / elapsed, 1),
+        'capture_ms': percentiles([v for d in devices for v in d.capture_ms]),
+        'action_ms': percentiles([v for d in devices for v in d.action_ms]),
+        'vision_ms': percentiles([v for d in devices for v in d.vision_ms]),
+        'capture_failures': sum(d.failures for d in devices),
+        'changed_frames': sum(d.changed for d in devices),
+        'loop_lag_ms': percentiles(lag_ms),
+        'cpu_cores_used': round(cpu_s / elapsed, 2),
+    }
+
+
+def print_stage(stage: Dict[str, Any]) -> None:
+    capture = stage['capture_ms']
+    print(f"{stage['devices']:>5} devices  {stage['captures_per_s']:8.1f} cap/s  "
+          f"fps/device {stage['fps_per_device']['mean']:5.2f} (min {stage['fps_per_device']['min']:.2f})  "
+          f"capture p50 {capture.get('p50', 0):7.1f}ms p99 {capture.get('p99', 0):7.1f}ms  "
+          f"failures {stage['capture_failures']}  loop lag p99 {stage['loop_lag_ms'].get('p99', 0):.1f}ms  "
+          f"cpu {stage['cpu_cores_used']:.1f} cores")
+
+
+async def main_async(args) -> List[Dict[str, Any]]:
+    # asyncio.to_thread runs on the default executor; its size caps concurrent adb calls
+    workers = args.workers or max(args.devices) * 2
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=workers))
+    vision = template_vision(args.template) if args.template else None
+
+    stages = []
+    for count in args.devices:
+        stage = await run_stage(count, args, vision)
+        print_stage(stage)
+        stages.append(stage)
+    return stages
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test against simulated adb devices')
+    parser.add_argument('--devices', nargs='+', type=int, default=[1, 10, 50])
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per stage')
+    parser.add_argument('--interval', type=float, default=0.5, help='capture interval per device (s)')
+    parser.add_argument('--tap-interval', type=float, default=1.0, help='seconds between taps, 0 to disable')
+    parser.add_argument('--template', help='run template matching on every frame')
+    parser.add_argument('--workers', type=int, help='thread pool size (default: 2 per device)')
+    parser.add_argument('--adb-path', default=os.environ.get('ADB_PATH', FAKE_ADB))
+    parser.add_argument('--latency-ms', type=float, help='fake adb latency per command')
+    parser.add_argument('--failure-rate', type=float, help='fake adb failure probability per command')
+    parser.add_argument('-o', '--output', help='write results as JSON')
+    args = parser.parse_args()
+
+    os.environ['FAKE_ADB_DEVICES'] = str(max(args.devices))
+    if args.latency_ms is not None:
+        os.environ['FAKE_ADB_LATENCY_MS'] = str(args.latency_ms)
+    if args.failure_rate is not None:
+        os.environ['FAKE_ADB_FAILURE_RATE'] = str(args.failure_rate)
+
+    stages = asyncio.run(main_async(args))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'args': vars(args), 'stages': stages}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Prometheus metrics of the ADB API, served on `/metrics`
+
+Latencies are observed where they happen (adb commands through
+`ADBController.on_command`, captures in `capture_frame`); state that is
+only interesting when scraped (capture rate, queue depths, cache hit
+counts) is read by `StateCollector` at scrape time.
+"""
+import time
+from typing import Callable, List, Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+ADB_COMMAND_SECONDS = Histogram(
+    'mqa_adb_command_seconds', 'adb command latency', ['device', 'command'], buckets=LATENCY_BUCKETS)
+ADB_COMMAND_FAILURES = Counter(
+    'mqa_adb_command_failures_total', 'adb commands that exited with an error', ['device', 'command'])
+CAPTURE_SECONDS = Histogram(
+    'mqa_capture_seconds', 'Screenshot capture latency (adb + PNG decode)', ['device'], buckets=LATENCY_BUCKETS)
+CAPTURES = Counter('mqa_captures_total', 'Screenshot captures', ['device', 'result'])
+LOOP_LAG_SECONDS = Histogram(
+    'mqa_event_loop_lag_seconds', 'How late a periodic asyncio.sleep woke up',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+LOOP_BLOCKS = Counter('mqa_event_loop_blocks_total', 'Times a handler blocked the event loop past the threshold')
+LOOP_BLOCK_SECONDS = Histogram(
+    'mqa_event_loop_block_seconds', 'Duration of event-loop blocks',
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0))
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+# Shell commands that are labeled with their first argument too (`input tap`)
+_SUBCOMMANDS = {'input', 'am', 'wm', 'dumpsys'}
+
+
+def device_label(device_id: Optional[str]) -> str:
+    return device_id or 'default'
+
+
+def command_label(command: List[str]) -> str:
+    """
+    Low-cardinality label for an adb command
+
+    ['shell', 'input', 'tap', '1', '2'] -> 'input tap'
+    ['shell', "dumpsys power | grep ..."] -> 'dumpsys power'
+    """
+    if not command:
+        return 'unknown'
+    if command[0] not in ('shell', 'exec-out') or len(command) < 2:
+        return command[0]
+    words = ' '.join(command[1:]).split()
+    if words and words[0] in _SUBCOMMANDS and len(words) > 1:
+        return f"{words[0]} {words[1]}"
+    return words[0] if words else command[0]
+
+
+def observe_command(device: str, command: List[str], seconds: float, ok: bool) -> None:
+    label = command_label(command)
+    ADB_COMMAND_SECONDS.labels(device, label).observe(seconds)
+    if not ok:
+        ADB_COMMAND_FAILURES.labels(device, label).inc()
+
+
+def observe_capture(device: str, seconds: float, ok: bool) -> None:
+    if ok:
+        CAPTURE_SECONDS.labels(device).observe(seconds)
+    CAPTURES.labels(device, 'ok' if ok else 'error').inc()
+
+
+def observe_block(block: dict) -> None:
+    LOOP_BLOCKS.inc()
+    LOOP_BLOCK_SECONDS.observe(block['duration_ms'] / 1000)
+
+
+class StateCollector:
+    """Capture loop, stream and cache state, read when Prometheus scrapes"""
+
+    def __init__(self, get_controller: Callable, scheduler, broadcaster, get_recorder: Callable):
+        self.get_controller = get_controller
+        self.scheduler = scheduler
+        self.broadcaster = broadcaster
+        self.get_recorder = get_recorder
+
+    def collect(self):
+        controller = self.get_controller()
+        device = device_label(controller.device_id if controller else None)
+
+        fps = GaugeMetricFamily('mqa_capture_fps', 'Capture rate over recent frames', labels=['device'])
+        fps.add_metric([device], self.scheduler.fps())
+        yield fps
+
+        age = GaugeMetricFamily('mqa_capture_age_seconds',
+                                'Seconds since the last successful capture (stalled loop detection)',
+                                labels=['device'])
+        if self.scheduler.last_capture:
+            age.add_metric([device], time.monotonic() - self.scheduler.last_capture)
+        yield age
+
+        interval = GaugeMetricFamily('mqa_capture_interval_seconds', 'Current capture interval',
+                                     labels=['device', 'mode'])
+        interval.add_metric([device, self.scheduler.mode], self.scheduler.current_interval())
+        yield interval
+
+        yield GaugeMetricFamily('mqa_stream_viewers', 'Connected stream viewers',
+                                value=self.broadcaster.subscriber_count)
+        yield CounterMetricFamily('mqa_stream_frames_skipped', 'Frames skipped by slow viewers',
+                                  value=self.broadcaster.dropped_total)
+        yield CounterMetricFamily('mqa_frames_unchanged', 'Captured frames identical to the previous one',
+                                  value=self.broadcaster.unchanged)
+
+        recorder = self.get_recorder()
+        depth = GaugeMetricFamily('mqa_recorder_queue_depth', 'Frames waiting for the recording encoder')
+        dropped = CounterMetricFamily('mqa_recorder_frames_dropped', 'Frames dropped by a busy recorder')
+        if recorder:
+            depth.add_metric([], recorder.queue_depth)
+            dropped.add_metric([], recorder.dropped)
+        yield depth
+        yield dropped
+
+        cache = CounterMetricFamily('mqa_state_cache_requests', 'Device-state cache lookups',
+                                    labels=['device', 'key', 'result'])
+        if controller:
+            for key, (hits, misses) in controller.cache_stats.items():
+                cache.add_metric([device, key, 'hit'], hits)
+                cache.add_metric([device, key, 'miss'], misses)
+        yield cache
+
+
+def register_state(get_controller: Callable, scheduler, broadcaster, get_recorder: Callable) -> None:
+    REGISTRY.register(StateCollector(get_controller, scheduler, broadcaster, get_recorder))
+
+
+def render() -> bytes:
+    return generate_latest(REGISTRY)
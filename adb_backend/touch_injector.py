@@ -0,0 +1,440 @@
+import queue
+import re
+import subprocess
+import threading
+import time
+from typing import List, Optional, Sequence, Tuple
+
+# Linux input event constants (linux/input-event-codes.h)
+EV_SYN = 0
+EV_KEY = 1
+EV_ABS = 3
+SYN_REPORT = 0
+BTN_TOUCH = 330
+BTN_TOOL_FINGER = 325
+ABS_MT_SLOT = 47
+ABS_MT_TOUCH_MAJOR = 48
+ABS_MT_POSITION_X = 53
+ABS_MT_POSITION_Y = 54
+ABS_MT_TRACKING_ID = 57
+ABS_MT_PRESSURE = 58
+
+Point = Tuple[int, int]
+
+
+class TouchDevice:
+    """Touchscreen description parsed from `getevent -lp`"""
+
+    def __init__(self, path: str, name: str):
+        self.path = path
+        self.name = name
+        self.x_range = (0, 0)
+        self.y_range = (0, 0)
+        self.max_slots = 1
+        self.has_pressure = False
+        self.has_touch_major = False
+        self.has_btn_touch = False
+
+    def __repr__(self) -> str:
+        return (f"TouchDevice({self.path!r}, {self.name!r}, x={self.x_range}, "
+                f"y={self.y_range}, slots={self.max_slots})")
+
+
+class TouchInjector:
+    """
+    Low-latency touch injection by writing input events with `sendevent`
+
+    A single `adb shell` session is kept open and every gesture is compiled
+    into one shell script (sendevent bursts separated by on-device `sleep`),
+    so timing between events is enforced on the phone instead of across
+    several host-side process spawns.
+    """
+
+    # Interval between move events when sampling a swipe path
+    STEP_MS = 16
+
+    def __init__(self, base_cmd: List[str], screen_size: Point):
+        """
+        Initialize touch injector
+
+        Args:
+            base_cmd: adb command prefix (e.g. ['adb', '-s', serial])
+            screen_size: Natural (portrait) screen size as (width, height)
+        """
+        self.base_cmd = list(base_cmd)
+        self.screen_size = screen_size
+        self.device: Optional[TouchDevice] = None
+        self._shell: Optional[subprocess.Popen] = None
+        # Lines read from the shell by a reader thread (None once stdout closes)
+        self._lines: Optional[queue.Queue] = None
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._tracking_id = 0
+        self._rotation = 0
+        self._rotation_checked = 0.0
+
+    # ------------------------------------------------------------------
+    # Shell session
+    # ------------------------------------------------------------------
+    def _ensure_shell(self) -> subprocess.Popen:
+        if self._shell is None or self._shell.poll() is not None:
+            self._shell = subprocess.Popen(
+                self.base_cmd + ['shell'],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+                bufsize=1
+            )
+            # readline() cannot time out, so a reader thread feeds a queue that _run waits on
+            self._lines = queue.Queue()
+            threading.Thread(target=self._pump, args=(self._shell, self._lines), daemon=True).start()
+        return self._shell
+
+    @staticmethod
+    def _pump(shell: subprocess.Popen, lines: queue.Queue) -> None:
+        try:
+            for line in shell.stdout:
+                lines.put(line)
+        except (OSError, ValueError):
+            pass
+        lines.put(None)
+
+    def _run(self, script: str, timeout: float = 30.0) -> str:
+        """
+        Run a script in the persistent shell and wait until it has finished
+
+        Args:
+            script: Shell commands to execute
+            timeout: Seconds to wait for completion
+
+        Returns:
+            Output printed by the script
+        """
+        with self._lock:
+            shell = self._ensure_shell()
+            self._seq += 1
+            marker = f"__mqa_done_{self._seq}__"
+            shell.stdin.write(f"{script}\necho {marker}\n")
+            shell.stdin.flush()
+
+            deadline = time.monotonic() + timeout
+            lines = []
+            while True:
+                try:
+                    line = self._lines.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    # A stalled shell would otherwise hold the lock for every later gesture
+                    self.close()
+                    raise TimeoutError("Touch script timed out")
+                if line is None:
+                    self._shell = None
+                    raise RuntimeError("adb shell session closed")
+                if line.strip() == marker:
+                    break
+                lines.append(line)
+            return ''.join(lines)
+
+    def close(self) -> None:
+        """Terminate the persistent shell session"""
+        if self._shell is not None:
+            try:
+                self._shell.stdin.close()
+                self._shell.terminate()
+                self._shell.wait(timeout=2)
+            except Exception:
+                self._shell.kill()
+            self._shell = None
+
+    # ------------------------------------------------------------------
+    # Device discovery
+    # ------------------------------------------------------------------
+    def probe(self) -> bool:
+        """
+        Find the multi-touch screen device and check it is writable
+
+        Returns:
+            True if sendevent injection can be used
+        """
+        try:
+            output = self._run('getevent -lp 2>/dev/null')
+        except Exception as e:
+            print(f"Touch probe failed: {e}")
+            return False
+
+        self.device = self.parse_getevent(output)
+        if self.device is None:
+            print("No multi-touch device found, falling back to `input`")
+            return False
+
+        check = self._run(f"[ -w {self.device.path} ] && echo writable")
+        if 'writable' not in check:
+            print(f"{self.device.path} is not writable, falling back to `input`")
+            self.device = None
+            return False
+
+        print(f"Touch injector ready: {self.device}")
+        return True
+
+    @staticmethod
+    def parse_getevent(output: str) -> Optional[TouchDevice]:
+        """
+        Parse `getevent -lp` output and return the first direct touch device
+
+        Args:
+            output: Raw getevent output
+
+        Returns:
+            TouchDevice or None if no touchscreen reports ABS_MT_POSITION_X/Y
+        """
+        candidates = []
+        current = None
+        for line in output.splitlines():
+            added = re.match(r'add device \d+: (\S+)', line)
+            if added:
+                current = TouchDevice(added.group(1), '')
+                candidates.append(current)
+                continue
+            if current is None:
+                continue
+
+            name = re.search(r'name:\s+"(.*)"', line)
+            if name:
+                current.name = name.group(1)
+                continue
+
+            axis = re.search(r'(ABS_MT_\w+|BTN_TOUCH)\s*:?\s*(?:value -?\d+, min (-?\d+), max (-?\d+))?', line)
+            if not axis:
+                continue
+            code = axis.group(1)
+            if code == 'BTN_TOUCH':
+                current.has_btn_touch = True
+            elif axis.group(2) is None:
+                continue
+            elif code == 'ABS_MT_POSITION_X':
+                current.x_range = (int(axis.group(2)), int(axis.group(3)))
+            elif code == 'ABS_MT_POSITION_Y':
+                current.y_range = (int(axis.group(2)), int(axis.group(3)))
+            elif code == 'ABS_MT_SLOT':
+                current.max_slots = int(axis.group(3)) + 1
+            elif code == 'ABS_MT_PRESSURE':
+                current.has_pressure = True
+            elif code == 'ABS_MT_TOUCH_MAJOR':
+                current.has_touch_major = True
+
+        for device in candidates:
+            if device.x_range[1] > 0 and device.y_range[1] > 0:
+                return device
+        return None
+
+    def _refresh_rotation(self) -> None:
+        """Read the display rotation, cached for a couple of seconds"""
+        now = time.monotonic()
+        if now - self._rotation_checked < 2.0:
+            return
+        output = self._run("dumpsys input | grep -m 1 -E 'SurfaceOrientation|orientation='")
+        match = re.search(r'(?:SurfaceOrientation: |orientation=)(\d)', output)
+        self._rotation = int(match.group(1)) if match else 0
+        self._rotation_checked = now
+
+    # ------------------------------------------------------------------
+    # Event compilation
+    # ------------------------------------------------------------------
+    def _to_device(self, point: Point) -> Point:
+        """Map display coordinates to raw touch panel coordinates"""
+        width, height = self.screen_size
+        x, y = point
+        if self._rotation == 1:
+            x, y = width - 1 - y, x
+        elif self._rotation == 2:
+            x, y = width - 1 - x, height - 1 - y
+        elif self._rotation == 3:
+            x, y = y, height - 1 - x
+
+        (x_min, x_max), (y_min, y_max) = self.device.x_range, self.device.y_range
+        dx = x_min + round(x * (x_max - x_min) / max(width - 1, 1))
+        dy = y_min + round(y * (y_max - y_min) / max(height - 1, 1))
+        return min(max(dx, x_min), x_max), min(max(dy, y_min), y_max)
+
+    def _event(self, ev_type: int, code: int, value: int) -> str:
+        return f"sendevent {self.device.path} {ev_type} {code} {value}"
+
+    def _down(self, slot: int, point: Point, first: bool) -> List[str]:
+        x, y = self._to_device(point)
+        self._tracking_id = (self._tracking_id + 1) % 65535
+        events = [
+            self._event(EV_ABS, ABS_MT_SLOT, slot),
+            self._event(EV_ABS, ABS_MT_TRACKING_ID, self._tracking_id),
+            self._event(EV_ABS, ABS_MT_POSITION_X, x),
+            self._event(EV_ABS, ABS_MT_POSITION_Y, y),
+        ]
+        if self.device.has_touch_major:
+            events.append(self._event(EV_ABS, ABS_MT_TOUCH_MAJOR, 5))
+        if self.device.has_pressure:
+            events.append(self._event(EV_ABS, ABS_MT_PRESSURE, 50))
+        if first and self.device.has_btn_touch:
+            events.append(self._event(EV_KEY, BTN_TOUCH, 1))
+            events.append(self._event(EV_KEY, BTN_TOOL_FINGER, 1))
+        return events
+
+    def _move(self, slot: int, point: Point) -> List[str]:
+        x, y = self._to_device(point)
+        return [
+            self._event(EV_ABS, ABS_MT_SLOT, slot),
+            self._event(EV_ABS, ABS_MT_POSITION_X, x),
+            self._event(EV_ABS, ABS_MT_POSITION_Y, y),
+        ]
+
+    def _up(self, slot: int, last: bool) -> List[str]:
+        events = [
+            self._event(EV_ABS, ABS_MT_SLOT, slot),
+            self._event(EV_ABS, ABS_MT_TRACKING_ID, -1),
+        ]
+        if last and self.device.has_btn_touch:
+            events.append(self._event(EV_KEY, BTN_TOUCH, 0))
+            events.append(self._event(EV_KEY, BTN_TOOL_FINGER, 0))
+        return events
+
+    def _sync(self) -> str:
+        return self._event(EV_SYN, SYN_REPORT, 0)
+
+    @staticmethod
+    def resample_path(points: Sequence[Point], samples: int) -> List[Point]:
+        """
+        Resample a polyline to evenly spaced points along its length
+
+        Args:
+            points: Path vertices
+            samples: Number of output points (>= 2)
+
+        Returns:
+            List of resampled points including both endpoints
+        """
+        if len(points) == 1:
+            return [tuple(points[0])] * samples
+        lengths = [0.0]
+        for (x0, y0), (x1, y1) in zip(points, points[1:]):
+            lengths.append(lengths[-1] + ((x1 - x0) ** 2 + (y1 - y0) ** 2) ** 0.5)
+        total = lengths[-1]
+
+        result = []
+        seg = 0
+        for i in range(samples):
+            target = total * i / (samples - 1)
+            while seg < len(points) - 2 and lengths[seg + 1] < target:
+                seg += 1
+            span = lengths[seg + 1] - lengths[seg]
+            t = (target - lengths[seg]) / span if span else 0.0
+            x0, y0 = points[seg]
+            x1, y1 = points[seg + 1]
+            result.append((round(x0 + (x1 - x0) * t), round(y0 + (y1 - y0) * t)))
+        return result
+
+    def compile_gesture(self, paths: Sequence[Sequence[Point]], duration_ms: int) -> List[str]:
+        """
+        Compile a (multi-)touch gesture into shell lines
+
+        Every finger follows its own path; all fingers go down together,
+        move in lockstep for `duration_ms` and lift together.
+
+        Args:
+            paths: One point sequence per finger
+            duration_ms: Total gesture duration
+
+        Returns:
+            Shell command lines, one burst per line
+        """
+        if not paths:
+            return []
+        if len(paths) > self.device.max_slots:
+            raise ValueError(f"Device supports at most {self.device.max_slots} contacts")
+
+        samples = max(2, duration_ms // self.STEP_MS + 1)
+        tracks = [self.resample_path(path, samples) for path in paths]
+        interval = duration_ms / 1000 / (samples - 1)
+
+        lines = []
+        down = []
+        for slot, track in enumerate(tracks):
+            down.extend(self._down(slot, track[0], first=slot == 0))
+        down.append(self._sync())
+        lines.append(';'.join(down))
+
+        stationary = all(len(set(track)) == 1 for track in tracks)
+        if stationary:
+            lines.append(f"sleep {duration_ms / 1000:.3f}")
+        else:
+            for i in range(1, samples):
+                burst = []
+                for slot, track in enumerate(tracks):
+                    if track[i] != track[i - 1]:
+                        burst.extend(self._move(slot, track[i]))
+                lines.append(f"sleep {interval:.3f}")
+                if burst:
+                    burst.append(self._sync())
+                    lines.append(';'.join(burst))
+
+        up = []
+        for slot in range(len(tracks)):
+            up.extend(self._up(slot, last=slot == len(tracks) - 1))
+        up.append(self._sync())
+        lines.append(';'.join(up))
+        return lines
+
+    # ------------------------------------------------------------------
+    # Gestures
+    # ------------------------------------------------------------------
+    def perform(self, paths: Sequence[Sequence[Point]], duration_ms: int) -> None:
+        """
+        Perform an arbitrary (multi-)touch gesture
+
+        Args:
+            paths: One point sequence per finger
+            duration_ms: Total gesture duration in milliseconds
+        """
+        self._refresh_rotation()
+        self._run('\n'.join(self.compile_gesture(paths, duration_ms)))
+
+    def tap(self, x: int, y: int, hold_ms: int = 40) -> None:
+        """Single tap"""
+        self.perform([[(x, y)]], hold_ms)
+
+    def double_tap(self, x: int, y: int, interval_ms: int = 80, hold_ms: int = 40) -> None:
+        """
+        Double tap with the gap between taps enforced on the device
+
+        Args:
+            x: X coordinate
+            y: Y coordinate
+            interval_ms: Time between first lift and second touch
+            hold_ms: Contact time of each tap
+        """
+        self._refresh_rotation()
+        tap = self.compile_gesture([[(x, y)]], hold_ms)
+        script = tap + [f"sleep {interval_ms / 1000:.3f}"] + self.compile_gesture([[(x, y)]], hold_ms)
+        self._run('\n'.join(script))
+
+    def long_press(self, x: int, y: int, duration_ms: int = 1000) -> None:
+        """Press and hold"""
+        self.perform([[(x, y)]], duration_ms)
+
+    def swipe(self, points: Sequence[Point], duration_ms: int = 300) -> None:
+        """Single finger swipe along an arbitrary path"""
+        self.perform([points], duration_ms)
+
+    def pinch(self, center: Point, start_radius: int, end_radius: int,
+              duration_ms: int = 400) -> None:
+        """
+        Two finger pinch (end_radius < start_radius) or zoom gesture
+
+        Args:
+            center: Pinch center
+            start_radius: Initial distance of each finger from center
+            end_radius: Final distance of each finger from center
+            duration_ms: Gesture duration
+        """
+        cx, cy = center
+        self.perform([
+            [(cx - start_radius, cy), (cx - end_radius, cy)],
+            [(cx + start_radius, cy), (cx + end_radius, cy)],
+        ], duration_ms)
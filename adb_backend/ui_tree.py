@@ -0,0 +1,228 @@
+import functools
+import re
+import unicodedata
+import xml.etree.ElementTree as ET
+from typing import Any, Dict, List, Optional, Tuple
+
+Bounds = Tuple[int, int, int, int]
+
+_BOUNDS = re.compile(r'\[(-?\d+),(-?\d+)\]\[(-?\d+),(-?\d+)\]')
+
+# Same folding as process_backend/text_query.normalize, so a normalized lookup
+# agrees with what OCR text search counts as a match
+CONFUSABLE_GROUPS = (
+    '0oO', '1lI|!', '5sS', '8B', '2zZ',
+    '己已巳', '未末', '土士', '日曰', '人入', '戊戌戍', '千干', '天夭', '王壬', '刀力',
+)
+CONFUSABLE_SEQUENCES = (('rn', 'm'), ('vv', 'w'), ('cl', 'd'))
+
+_FOLD = {}
+for _group in CONFUSABLE_GROUPS:
+    for _char in _group:
+        _FOLD[ord(_char.casefold())] = _group[0].casefold()
+
+
+@functools.lru_cache(maxsize=256)
+def _compile(pattern: str) -> 're.Pattern':
+    """Compile a text pattern once; invalid regexes match literally"""
+    try:
+        return re.compile(pattern)
+    except re.error:
+        return re.compile(re.escape(pattern))
+
+
+@functools.lru_cache(maxsize=4096)
+def normalize(text: str) -> str:
+    """Fold width, case, whitespace and common OCR confusions (0/O, 1/l, rn/m)"""
+    text = unicodedata.normalize('NFKC', text).casefold()
+    text = ''.join(text.split())
+    for sequence, replacement in CONFUSABLE_SEQUENCES:
+        text = text.replace(sequence, replacement)
+    return text.translate(_FOLD)
+
+
+def parse_bounds(value: str) -> Optional[Bounds]:
+    """Parse uiautomator bounds "[x1,y1][x2,y2]" """
+    match = _BOUNDS.fullmatch(value or '')
+    if not match:
+        return None
+    return tuple(int(v) for v in match.groups())
+
+
+def extract_xml(output: str) -> Optional[str]:
+    """
+    Cut the hierarchy out of `uiautomator dump /dev/tty` output
+
+    The dump is followed by "UI hierchary dumped to: /dev/tty" and may be
+    preceded by warnings; errors such as "could not get idle state" yield None.
+    """
+    start = output.find('<hierarchy')
+    end = output.rfind('</hierarchy>')
+    if start < 0 or end < 0:
+        return None
+    return output[start:end + len('</hierarchy>')]
+
+
+class UINode:
+    """One view of the hierarchy with the attributes used for lookups"""
+
+    __slots__ = ('index', 'text', 'resource_id', 'class_name', 'package',
+                 'content_desc', 'bounds', 'clickable', 'enabled', 'checked', 'selected',
+                 'focused', 'scrollable')
+
+    def __init__(self, index: int, attrs: Dict[str, str]):
+        self.index = index
+        self.text = attrs.get('text', '')
+        self.resource_id = attrs.get('resource-id', '')
+        self.class_name = attrs.get('class', '')
+        self.package = attrs.get('package', '')
+        self.content_desc = attrs.get('content-desc', '')
+        self.bounds = parse_bounds(attrs.get('bounds', ''))
+        self.clickable = attrs.get('clickable') == 'true'
+        self.enabled = attrs.get('enabled') != 'false'
+        self.checked = attrs.get('checked') == 'true'
+        self.selected = attrs.get('selected') == 'true'
+        self.focused = attrs.get('focused') == 'true'
+        self.scrollable = attrs.get('scrollable') == 'true'
+
+    @property
+    def center(self) -> Optional[Tuple[int, int]]:
+        if not self.bounds:
+            return None
+        x1, y1, x2, y2 = self.bounds
+        return (x1 + x2) // 2, (y1 + y2) // 2
+
+    @property
+    def visible(self) -> bool:
+        """Non-empty bounds (views scrolled away or collapsed have none)"""
+        return bool(self.bounds) and self.bounds[2] > self.bounds[0] and self.bounds[3] > self.bounds[1]
+
+    def to_dict(self) -> Dict[str, Any]:
+        center = self.center
+        return {
+            'index': self.index,
+            'text': self.text,
+            'resource_id': self.resource_id,
+            'class_name': self.class_name,
+            'package': self.package,
+            'content_desc': self.content_desc,
+            'bounds': list(self.bounds) if self.bounds else None,
+            'x': center[0] if center else None,
+            'y': center[1] if center else None,
+            'clickable': self.clickable,
+            'enabled': self.enabled,
+            'checked': self.checked,
+            'selected': self.selected,
+            'focused': self.focused,
+            'scrollable': self.scrollable,
+        }
+
+    def __repr__(self) -> str:
+        return f"UINode({self.class_name!r}, text={self.text!r}, id={self.resource_id!r}, bounds={self.bounds})"
+
+
+class UITree:
+    """
+    View hierarchy from `uiautomator dump`, indexed by text, resource-id and class
+
+    Exact lookups go through dictionaries; text and content-desc patterns are
+    regexes (or normalized literals) searched over the (few hundred) distinct
+    strings of the screen.
+    Results are in document order, which is roughly top-to-bottom.
+    """
+
+    def __init__(self, xml: str):
+        """
+        Args:
+            xml: Hierarchy XML (see extract_xml)
+        """
+        self.nodes: List[UINode] = []
+        self.by_text: Dict[str, List[UINode]] = {}
+        self.by_desc: Dict[str, List[UINode]] = {}
+        self.by_id: Dict[str, List[UINode]] = {}
+        self.by_class: Dict[str, List[UINode]] = {}
+
+        root = ET.fromstring(xml)
+        for element in root.iter('node'):
+            self._add(UINode(len(self.nodes), element.attrib))
+
+    def _add(self, node: UINode) -> None:
+        self.nodes.append(node)
+        if node.text:
+            self.by_text.setdefault(node.text, []).append(node)
+        if node.content_desc:
+            self.by_desc.setdefault(node.content_desc, []).append(node)
+        if node.resource_id:
+            self.by_id.setdefault(node.resource_id, []).append(node)
+            # "com.app:id/login" is also reachable as "login"
+            short = node.resource_id.rpartition(':id/')[2]
+            if short != node.resource_id:
+                self.by_id.setdefault(short, []).append(node)
+        if node.class_name:
+            self.by_class.setdefault(node.class_name, []).append(node)
+            short = node.class_name.rpartition('.')[2]
+            if short != node.class_name:
+                self.by_class.setdefault(short, []).append(node)
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    @staticmethod
+    def _match_strings(index: Dict[str, List[UINode]], pattern: str, regex: bool,
+                       normalized: bool = False) -> List[UINode]:
+        if normalized:
+            target = normalize(pattern)
+            if not target:
+                return []
+            return [node for value, nodes in index.items() if target in normalize(value) for node in nodes]
+        if not regex:
+            return index.get(pattern, [])
+        compiled = _compile(pattern)
+        return [node for value, nodes in index.items() if compiled.search(value) for node in nodes]
+
+    def find(self, text: Optional[str] = None, resource_id: Optional[str] = None,
+             class_name: Optional[str] = None, content_desc: Optional[str] = None,
+             regex: bool = True, normalized: bool = False, visible_only: bool = True) -> List[UINode]:
+        """
+        Find nodes matching every given criterion
+
+        Args:
+            text: Pattern for the node text; with regex or normalized, content-desc is
+                  searched too (icons often carry their label only there)
+            resource_id: Full ("com.app:id/login") or short ("login") resource id
+            class_name: Full or short class name (e.g. "Button")
+            content_desc: Pattern for the content description
+            regex: Treat text/content_desc as regexes (re.search), else exact strings
+            normalized: Treat text/content_desc as literal text the node's string must
+                        contain once both go through normalize() (as OCR text
+                        search does); overrides regex
+            visible_only: Skip nodes without on-screen bounds
+
+        Returns:
+            Matching nodes in document order
+        """
+        candidates: Optional[List[UINode]] = None
+
+        def narrow(nodes: List[UINode]) -> None:
+            nonlocal candidates
+            if candidates is None:
+                candidates = nodes
+            else:
+                keep = {node.index for node in nodes}
+                candidates = [node for node in candidates if node.index in keep]
+
+        if resource_id:
+            narrow(self.by_id.get(resource_id, []))
+        if class_name:
+            narrow(self.by_class.get(class_name, []))
+        if text is not None:
+            nodes = self._match_strings(self.by_text, text, regex, normalized)
+            if regex or normalized:
+                nodes = nodes + self._match_strings(self.by_desc, text, regex, normalized)
+            narrow(nodes)
+        if content_desc is not None:
+            narrow(self._match_strings(self.by_desc, content_desc, regex, normalized))
+
+        nodes = self.nodes if candidates is None else candidates
+        unique = {node.index: node for node in nodes}
+        return [unique[i] for i in sorted(unique) if not visible_only or unique[i].visible]
@@ -0,0 +1,221 @@
+import asyncio
+import contextvars
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional
+
+# Tags of the code running now (endpoint, Blockly function), inherited by child tasks
+_tags: contextvars.ContextVar[Dict[str, Any]] = contextvars.ContextVar('block_tags', default={})
+# task -> tags; the watchdog thread cannot read another thread's context, but it can
+# see which task the loop is running
+_task_tags: Dict[asyncio.Task, Dict[str, Any]] = {}
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _running_task() -> Optional[asyncio.Task]:
+    try:
+        return asyncio.current_task()
+    except RuntimeError:
+        return None
+
+
+@contextmanager
+def tagged(**tags) -> Iterator[None]:
+    """
+    Attribute loop blocks inside this block to `tags` (e.g. function='click')
+
+    Nested blocks add to the outer tags. Costs a dict copy and a contextvar
+    set, so it can stay in place when the detector is off.
+    """
+    merged = {**_tags.get(), **tags}
+    token = _tags.set(merged)
+    task = _running_task()
+    previous = _task_tags.get(task) if task else None
+    if task:
+        _task_tags[task] = merged
+    try:
+        yield
+    finally:
+        _tags.reset(token)
+        if task:
+            if previous is None:
+                _task_tags.pop(task, None)
+            else:
+                _task_tags[task] = previous
+
+
+class BlockTagMiddleware:
+    """
+    ASGI middleware tagging every request with its endpoint
+
+    Must be added before `@app.middleware("http")` functions: those run the
+    rest of the app in a child task, and the tags belong to the task that
+    actually runs the handler.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        with tagged(endpoint=f"{scope['method']} {scope['path']}"):
+            await self.app(scope, receive, send)
+
+
+class BlockDetector:
+    """
+    Catch handlers that block the event loop and show what they were doing
+
+    A heartbeat task on the loop stamps the time every `heartbeat` seconds.
+    A watchdog thread checks the stamp; once it is older than `threshold`
+    the loop is blocked, and the watchdog samples the loop thread's stack
+    until the heartbeat comes back. Each block is recorded with its
+    duration, the most frequent stacks, the innermost project frame
+    ("culprit") and the tags of the blocked task (see `tagged`).
+
+    Off by default; `start()` / `stop()` toggle it at runtime. When off
+    nothing runs besides `tagged` bookkeeping.
+    """
+
+    def __init__(self, threshold: float = 0.1, sample_interval: float = 0.01,
+                 max_samples: int = 500, history: int = 50,
+                 on_block: Optional[Callable[[Dict[str, Any]], None]] = None):
+        """
+        Initialize block detector
+
+        Args:
+            threshold: Seconds without a heartbeat that count as a block
+            sample_interval: Seconds between stack samples while blocked
+            max_samples: Stack samples kept per block
+            history: Number of recent blocks kept for `blocks()`
+            on_block: Called with every finished block (e.g. metrics, logging)
+        """
+        self.threshold = threshold
+        self.sample_interval = sample_interval
+        self.max_samples = max_samples
+        self.on_block = on_block
+        self._blocks: Deque[Dict[str, Any]] = deque(maxlen=history)
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._beat = 0.0
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self._stop_event: Optional[threading.Event] = None
+        self._watchdog: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._heartbeat_task is not None
+
+    @property
+    def heartbeat(self) -> float:
+        return min(self.threshold / 4, 0.05)
+
+    def start(self, threshold: Optional[float] = None) -> None:
+        """Start watching the running loop; with a threshold, also change it"""
+        if threshold is not None:
+            self.threshold = threshold
+        if self.enabled:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._beat = time.perf_counter()
+        self._heartbeat_task = self._loop.create_task(self._heartbeat())
+        self._stop_event = threading.Event()
+        self._watchdog = threading.Thread(target=self._watch, args=(self._stop_event,),
+                                          name='loop-watchdog', daemon=True)
+        self._watchdog.start()
+
+    def stop(self) -> None:
+        if self._heartbeat_task:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+        if self._stop_event:
+            self._stop_event.set()
+            self._stop_event = None
+        self._watchdog = None
+
+    async def _heartbeat(self) -> None:
+        while True:
+            self._beat = time.perf_counter()
+            await asyncio.sleep(self.heartbeat)
+
+    def _watch(self, stop_event: threading.Event) -> None:
+        block: Optional[Dict[str, Any]] = None
+        while not stop_event.wait(self.sample_interval):
+            beat = self._beat
+            stalled = time.perf_counter() - beat - self.heartbeat
+            if block is not None and (beat != block['_beat'] or stalled < self.threshold):
+                self._finish(block, beat)
+                block = None
+            if stalled < self.threshold:
+                continue
+            if block is None:
+                block = self._begin(beat)
+            if block['sample_count'] < self.max_samples:
+                self._sample(block)
+
+    def _begin(self, beat: float) -> Dict[str, Any]:
+        task = asyncio.current_task(self._loop)
+        return {
+            '_beat': beat,
+            'started_at': time.time() - (time.perf_counter() - beat - self.heartbeat),
+            'tags': dict(_task_tags.get(task, {})) if task else {},
+            'task': task.get_name() if task else None,
+            'sample_count': 0,
+            '_stacks': Counter(),
+        }
+
+    def _sample(self, block: Dict[str, Any]) -> None:
+        frame = sys._current_frames().get(self._loop_thread)
+        if frame is None:
+            return
+        stack = tuple(f"{os.path.relpath(f.filename, PROJECT_ROOT) if f.filename.startswith(PROJECT_ROOT) else f.filename}"
+                      f":{f.lineno} {f.name}"
+                      for f in traceback.extract_stack(frame, limit=30))
+        block['_stacks'][stack] += 1
+        block['sample_count'] += 1
+
+    def _finish(self, block: Dict[str, Any], beat: float) -> None:
+        # The heartbeat that ended the block ran right after it
+        block['duration_ms'] = round(max(beat - block.pop('_beat') - self.heartbeat, self.threshold) * 1000, 1)
+        stacks = block.pop('_stacks')
+        block['stacks'] = [{'count': count, 'frames': list(stack)} for stack, count in stacks.most_common(5)]
+        block['culprit'] = self._culprit(stacks.most_common(1)[0][0]) if stacks else None
+        with self._lock:
+            self._blocks.append(block)
+        if self.on_block:
+            try:
+                self.on_block(block)
+            except Exception as e:
+                print(f"Block callback failed: {e}")
+
+    @staticmethod
+    def _culprit(stack) -> Optional[str]:
+        """Innermost frame of our own code in the stack"""
+        own = [frame for frame in stack
+               if not frame.startswith(('/', '<')) and not frame.startswith('common/block_detector.py')]
+        return own[-1] if own else (stack[-1] if stack else None)
+
+    def blocks(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self._blocks)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._blocks.clear()
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            'enabled': self.enabled,
+            'threshold_ms': round(self.threshold * 1000, 1),
+            'blocks': self.blocks(),
+        }
@@ -0,0 +1,71 @@
+import asyncio
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Optional
+
+
+class LoopLagMonitor:
+    """
+    Measure event-loop lag: how late a periodic `asyncio.sleep` wakes up
+
+    A handler that blocks the loop (sync adb call, OpenCV, OCR) shows up as
+    lag for everything else on the loop. `on_lag(seconds)` is called after
+    every sample, e.g. to feed a metrics histogram.
+    """
+
+    def __init__(self, interval: float = 0.25,
+                 on_lag: Optional[Callable[[float], None]] = None,
+                 history: int = 240):
+        """
+        Initialize loop lag monitor
+
+        Args:
+            interval: Seconds between samples
+            on_lag: Called with every measured lag in seconds
+            history: Number of recent samples kept for `stats()`
+        """
+        self.interval = interval
+        self.on_lag = on_lag
+        self.samples: Deque[float] = deque(maxlen=history)
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """Start sampling on the running loop (no-op if already running)"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(time.perf_counter() - start - self.interval, 0.0)
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            self.samples.append(lag)
+            if self.on_lag:
+                try:
+                    self.on_lag(lag)
+                except Exception as e:
+                    print(f"Loop lag callback failed: {e}")
+
+    def stats(self) -> Dict[str, float]:
+        """Recent lag in milliseconds"""
+        if not self.samples:
+            return {'last_ms': 0.0, 'p99_ms': 0.0, 'max_ms': 0.0}
+        ordered = sorted(self.samples)
+        return {
+            'last_ms': round(self.last_lag * 1000, 2),
+            'p99_ms': round(ordered[min(int(len(ordered) * 0.99), len(ordered) - 1)] * 1000, 2),
+            'max_ms': round(self.max_lag * 1000, 2),
+        }
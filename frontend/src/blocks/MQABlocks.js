@@ -57,8 +57,8 @@ function updateAllDropdowns() {
   if (Blockly.getMainWorkspace()) {
     const blocks = Blockly.getMainWorkspace().getAllBlocks();
     blocks.forEach(block => {
-      // 處理 find_template 區塊
-      if (block.type === 'find_template') {
+      // 處理 find_template / find_all_template 區塊
+      if (block.type === 'find_template' || block.type === 'find_all_template') {
         const dropdown = block.getField('TEMPLATE');
         if (dropdown) {
           dropdown.menuGenerator_ = templateOptions;
@@ -134,6 +134,58 @@ javascriptGenerator.forBlock['find_template'] = function(block) {
 };
 //find_template Leo------
 
+// find_all_template：找出畫面上模板的所有位置，之後用 click_nth 點第 n 個
+Blockly.Blocks['find_all_template'] = {
+  init: function() {
+    const dropdown = new Blockly.FieldDropdown(() => {
+      return templateOptions;
+    });
+
+    this.appendDummyInput()
+        .appendField("find all template")
+        .appendField(dropdown, 'TEMPLATE');
+
+    this.setPreviousStatement(true, null);
+    this.setNextStatement(true, null);
+    this.setColour(230);
+    this.setTooltip("Find every occurrence of a template (top to bottom, left to right)");
+
+    if (isLoaded && templateOptions[0][0] !== 'Loading...') {
+      dropdown.setValue(templateOptions[0][1]);
+    }
+  }
+};
+
+javascriptGenerator.forBlock['find_all_template'] = function(block) {
+  const templateId = block.getFieldValue('TEMPLATE');
+
+  if (templateId === 'empty' || templateId === 'loading') {
+    return `find_all_template(null);\n`;
+  }
+  return `find_all_template('${templateId}');\n`;
+};
+
+Blockly.Blocks['click_nth'] = {
+  init: function() {
+    // 第幾個（從 1 開始），順序為由上而下、由左而右
+    const nthField = new Blockly.FieldNumber(1, 1, Infinity, 1);
+
+    this.appendDummyInput()
+        .appendField("click match no.")
+        .appendField(nthField, 'NTH');
+
+    this.setPreviousStatement(true, null);
+    this.setNextStatement(true, null);
+    this.setColour(100);
+    this.setTooltip("Click the n-th match of the last find all template (1 = first).");
+  }
+};
+
+javascriptGenerator.forBlock['click_nth'] = function(block) {
+  const nth = block.getFieldValue('NTH');
+  return `click_nth(${nth});\n`;
+};
+
 Blockly.Blocks['find_text'] = {
   init: function() {
     // 建立一個文字輸入欄位，預設值為 'google'
@@ -141,14 +193,16 @@ Blockly.Blocks['find_text'] = {
 
     this.appendDummyInput()
         .appendField("find text:")
-        .appendField(textInput, 'TEXT_VALUE');
+        .appendField(textInput, 'TEXT_VALUE')
+        .appendField("fuzzy")
+        .appendField(new Blockly.FieldCheckbox('FALSE'), 'FUZZY');
     
     // 設定區塊為上下連接的指令區塊
     this.setPreviousStatement(true, null);
     this.setNextStatement(true, null);
     
     this.setColour(230); // 選擇一個不同的顏色
-    this.setTooltip("A block for find text.");
+    this.setTooltip("A block for find text. Fuzzy also accepts text with a few characters added, missing or changed.");
   }
 };
 javascriptGenerator.forBlock['find_text'] = function(block) {
@@ -157,11 +211,42 @@ javascriptGenerator.forBlock['find_text'] = function(block) {
 
   // 生成 JavaScript 程式碼，將輸入文字用引號包起來
   // 使用 JSON.stringify 以確保特殊字元被正確跳脫
-  const code = `find_text(${JSON.stringify(textValue)});\n`;
+  // 勾選 fuzzy 時才加上第二個參數，容許增刪改字
+  const fuzzy = block.getFieldValue('FUZZY') === 'TRUE' ? ', true' : '';
+  const code = `find_text(${JSON.stringify(textValue)}${fuzzy});\n`;
   
   return code;
 };
 
+// find_element：在 UI 階層（uiautomator dump）中找原生元件，之後用 click_object('element') 點擊
+Blockly.Blocks['find_element'] = {
+  init: function() {
+    const byDropdown = new Blockly.FieldDropdown([
+      ['text', 'text'],
+      ['resource id', 'id'],
+      ['class', 'class'],
+      ['content desc', 'desc'],
+    ]);
+    const valueInput = new Blockly.FieldTextInput('OK');
+
+    this.appendDummyInput()
+        .appendField("find element by")
+        .appendField(byDropdown, 'BY')
+        .appendField(valueInput, 'VALUE');
+
+    this.setPreviousStatement(true, null);
+    this.setNextStatement(true, null);
+    this.setColour(230);
+    this.setTooltip("Find a native UI element in the view hierarchy (text/desc are regexes, id may omit the package).");
+  }
+};
+
+javascriptGenerator.forBlock['find_element'] = function(block) {
+  const by = block.getFieldValue('BY');
+  const value = block.getFieldValue('VALUE');
+  return `find_element('${by}', ${JSON.stringify(value)});\n`;
+};
+
 
 Blockly.Blocks['wait_time'] = {
   init: function() {
@@ -445,11 +530,13 @@ Blockly.Blocks['check_text'] = {
 
     this.appendDummyInput()
         .appendField("check text:")
-        .appendField(textInput, 'TEXT_VALUE');
+        .appendField(textInput, 'TEXT_VALUE')
+        .appendField("fuzzy")
+        .appendField(new Blockly.FieldCheckbox('FALSE'), 'FUZZY');
     this.setPreviousStatement(true, null); // 前一個街口 (連接上方的區塊)
     this.setNextStatement(true, null);     // 後一個街口 (連接下方的區塊)
     this.setColour(170);
-    this.setTooltip("Check text shown on screen or not");
+    this.setTooltip("Check text shown on screen or not. Fuzzy also accepts text with a few characters added, missing or changed.");
   }
 };
 
@@ -459,7 +546,8 @@ javascriptGenerator.forBlock['check_text'] = function(block) {
 
   // 生成 JavaScript 程式碼，將輸入文字用引號包起來
   // 使用 JSON.stringify 以確保特殊字元被正確跳脫
-  const code = `check_text(${JSON.stringify(textValue)});\n`;
+  const fuzzy = block.getFieldValue('FUZZY') === 'TRUE' ? ', true' : '';
+  const code = `check_text(${JSON.stringify(textValue)}${fuzzy});\n`;
   return code;
 }
 // 每 5 秒重新載入一次模板（選擇性功能）
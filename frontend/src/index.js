@@ -176,19 +176,66 @@ document.addEventListener('DOMContentLoaded', function() {
     });
   });
 
-  loadScreenshotButton.onclick = function() {
-    
-    const imageUrl = `http://localhost:8000/screenshots/screenshot.png?${Date.now()}`;
+  // 畫面串流：透過 WebSocket 接收有變化的畫面，失敗時退回讀取靜態截圖
+  let screenSocket = null;
+  let currentFrameUrl = null;
+  // 正在顯示的串流畫面序號（靜態截圖時為 null），裁切時據此取得同一張畫面的 PNG
+  let nextFrameSeq = null;
+  let displayedFrameSeq = null;
+
+  function showScreenshot(url) {
     phoneScreenshot.crossOrigin = 'anonymous';
-    
     phoneScreenshot.onload = function() {
         this.style.display = 'block';
         this.style.visibility = 'visible';
         noScreenshotText.style.display = 'none';
-        console.log('图片加载完成，可以裁切');
     };
-    
-    phoneScreenshot.src = imageUrl;
+    phoneScreenshot.src = url;
+  }
+
+  function loadStaticScreenshot() {
+    displayedFrameSeq = null;
+    showScreenshot(`${ADB_API_BASE}/screenshots/screenshot.png?${Date.now()}`);
+  }
+
+  function startScreenStream() {
+    if (screenSocket && screenSocket.readyState <= WebSocket.OPEN) {
+      return;
+    }
+    const wsUrl = ADB_API_BASE.replace(/^http/, 'ws') + '/ws/screen?format=jpeg&quality=70&seq=true';
+    screenSocket = new WebSocket(wsUrl);
+    screenSocket.binaryType = 'blob';
+
+    screenSocket.onmessage = function(event) {
+      // 每張畫面前的文字訊息帶有序號
+      if (typeof event.data === 'string') {
+        nextFrameSeq = JSON.parse(event.data).seq;
+        return;
+      }
+      // 框選時暫停更新，避免裁切到不同畫面
+      if (isSelecting || cropSection.style.display === 'block') {
+        return;
+      }
+      displayedFrameSeq = nextFrameSeq;
+      const previousUrl = currentFrameUrl;
+      currentFrameUrl = URL.createObjectURL(event.data);
+      showScreenshot(currentFrameUrl);
+      if (previousUrl) {
+        URL.revokeObjectURL(previousUrl);
+      }
+    };
+    screenSocket.onerror = function() {
+      console.warn('畫面串流連線失敗，改用靜態截圖');
+      loadStaticScreenshot();
+    };
+    screenSocket.onclose = function() {
+      screenSocket = null;
+    };
+  }
+
+  loadScreenshotButton.onclick = function() {
+    loadStaticScreenshot();
+    startScreenStream();
     return false;
 };
 
@@ -366,37 +413,56 @@ document.addEventListener('DOMContentLoaded', function() {
     canvas.width = width;
     canvas.height = height;
     
-    // 等待圖片載入完成後進行裁切
-    if (phoneScreenshot.complete) {
-      performCrop();
+    // 串流畫面為 JPEG，裁切改用框選的那張畫面的 PNG 以保留模板細節；
+    // 後端已有更新的畫面（409）或顯示的是靜態截圖時，直接裁切顯示中的畫面
+    if (displayedFrameSeq === null) {
+      performCrop(phoneScreenshot);
     } else {
-      phoneScreenshot.onload = performCrop;
+      fetch(`${ADB_API_BASE}/stream/frame?seq=${displayedFrameSeq}&format=png`)
+        .then(response => {
+          if (!response.ok) {
+            throw new Error(`HTTP ${response.status}`);
+          }
+          return response.blob();
+        })
+        .then(blob => {
+          const sourceUrl = URL.createObjectURL(blob);
+          const source = new Image();
+          source.onload = () => {
+            performCrop(source);
+            URL.revokeObjectURL(sourceUrl);
+          };
+          source.onerror = () => {
+            URL.revokeObjectURL(sourceUrl);
+            performCrop(phoneScreenshot);
+          };
+          source.src = sourceUrl;
+        })
+        .catch(error => {
+          console.warn('無法取得框選畫面的 PNG，改用顯示中的畫面:', error.message);
+          performCrop(phoneScreenshot);
+        });
     }
-    
-    
 
-    function performCrop() {
+    function performCrop(image) {
       try {
         // 在canvas上繪製裁切的圖片區域
         ctx.drawImage(
-          phoneScreenshot,
+          image,
           coords.leftTop.x, coords.leftTop.y, width, height,
           0, 0, width, height
         );
         
-        // 將canvas轉換為base64，確保格式正確
-        const base64Data = canvas.toDataURL('image/png');
-        
-        // 調試：打印 base64 數據的前100個字符
-        console.log('Base64 data preview:', base64Data.substring(0, 100));
-        
-        // 驗證 base64 數據格式
-        if (!base64Data || !base64Data.startsWith('data:image/')) {
-          throw new Error('無法生成有效的圖片數據');
-        }
-        
-        // 發送到後端保存
-        saveCroppedTemplate(base64Data, filename);
+        // 直接輸出 PNG 二進位資料，不經過 base64
+        canvas.toBlob(blob => {
+          if (!blob) {
+            cropStatus.textContent = '裁切失敗: 無法生成有效的圖片數據';
+            cropStatus.className = 'error';
+            cropButton.disabled = false;
+            return;
+          }
+          saveCroppedTemplate(blob, filename);
+        }, 'image/png');
         
       } catch (error) {
         console.error('裁切錯誤:', error);
@@ -407,21 +473,19 @@ document.addEventListener('DOMContentLoaded', function() {
     }
 
     // 新增：保存裁切模板到後端的函數
-    async function saveCroppedTemplate(base64Data, filename) {
+    async function saveCroppedTemplate(blob, filename) {
       try {
         cropButton.disabled = true;
         cropStatus.textContent = '正在保存模板...';
         cropStatus.className = 'info';
         
-        const response = await fetch('http://localhost:8001/templates/save-cropped', {
+        const url = `${EXECUTOR_API_BASE}/templates/upload?filename=${encodeURIComponent(filename)}`;
+        const response = await fetch(url, {
           method: 'POST',
           headers: {
-            'Content-Type': 'application/json',
+            'Content-Type': 'image/png',
           },
-          body: JSON.stringify({
-            filename: filename,
-            image_data: base64Data
-          })
+          body: blob
         });
         
         if (!response.ok) {
@@ -526,7 +590,19 @@ function find_template(templateId) {
   return;
 }
 
-function find_text(words) {
+function find_all_template(templateId) {
+  return;
+}
+
+function click_nth(n) {
+  return;
+}
+
+function find_text(words, fuzzy) {
+  return;
+}
+
+function find_element(by, value) {
   return;
 }
 
@@ -562,7 +638,7 @@ function check_template(templateId){
   return;
 }
 
-function check_text(templateId){
+function check_text(templateId, fuzzy){
   return;
 }
 
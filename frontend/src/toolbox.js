@@ -50,10 +50,18 @@ export const toolbox = {
           kind: 'block',
           type: 'find_template',
         },
+        {
+          kind: 'block',
+          type: 'find_all_template',
+        },
         {
           kind: 'block',
           type: 'find_text',
         },
+        {
+          kind: 'block',
+          type: 'find_element',
+        },
       ]
     },
     {
@@ -69,6 +77,10 @@ export const toolbox = {
           kind: 'block',
           type: 'click_object',
         },
+        {
+          kind: 'block',
+          type: 'click_nth',
+        },
         {
           kind: 'block',
           type: 'slide',
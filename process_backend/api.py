@@ -1,16 +1,27 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Callable
 from PIL import Image
-from template_match import mixed_template_match
-from ocr import OCRProcessor
-from pathlib import Path
+from template_match import (mixed_template_match, batch_template_match, find_all_matches, batch_find_all_matches,
+                            precompute_template_features, seed_template_features, forget_template_features,
+                            DeviceScaleCache, get_template_features, prefetch_frame)
+from ocr import OCRProcessor, TextLayoutCache
+from execution_context import ExecutionContext
+from template_store import TemplateStore, DEDUP_MODES, DUPLICATE_DISTANCE
+from jobs import Job, JobManager, QueueFullError
+from run_history import RunHistory, step_rows
+from thread_budget import ThreadBudget
+from profiler import Trace, ProfileStats, span, parse_server_timing, export_otel
+from template_upload import (TempUpload, UploadError, IMAGE_SIGNATURES, ZIP_SIGNATURE, MAX_TEMPLATE_BYTES,
+                             MAX_ARCHIVE_BYTES, finalize_image, extract_template_pack, discard_path)
 import uvicorn
 import os
 import io
 import base64
 import shutil
+import zipfile
 import json
 import re
 import asyncio
@@ -18,6 +29,14 @@ import json
 import requests
 import logging
 import time
+import uuid
+import threading
+import sys
+import metrics
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from loop_monitor import LoopLagMonitor
+from block_detector import BlockDetector, BlockTagMiddleware, tagged
 
 
 # 配置日志
@@ -40,14 +59,152 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-ocr_text = OCRProcessor(lang='ch', fx = 0.5, threshold=0.7)
+# 以端點標記請求，阻塞事件迴圈時可知道是哪個端點
+app.add_middleware(BlockTagMiddleware)
+
+# 核心分配：OpenCV / OCR 在各自的執行緒池中執行，事件迴圈不被比對卡住（見 thread_budget.py）
+thread_budget = ThreadBudget.from_env()
+thread_budget.apply()
+metrics.register_thread_budget(thread_budget)
+
+ocr_text = OCRProcessor(lang='ch', fx = 0.5, threshold=0.7, cpu_threads=thread_budget.ocr_threads)
+
+# 模板庫：SQLite 索引，前端的 templates.json 由它產生
+TEMPLATES_JSON_PATH = '../frontend/build/templates.json'
+template_store = TemplateStore(os.path.join(os.getcwd(), 'templates'), json_path=TEMPLATES_JSON_PATH)
+
+
+def precompute_features(template_id: str) -> None:
+    """背景計算模板特徵並存入模板庫（別名直接使用原模板的特徵）"""
+    if template_store.resolve(template_id) != template_id:
+        return
+    try:
+        # 與比對時相同的快取鍵（template_path），預先計算的特徵才會被用到
+        blob = precompute_template_features(template_path(template_id))
+        if blob:
+            template_store.update(template_id, features=blob)
+    except Exception as e:
+        logger.warning(f"Feature precompute failed for {template_id}: {e}")
+
+
+async def record_density(template_id: str) -> None:
+    """記錄截取模板時裝置的螢幕密度，之後在其他裝置上據此推算縮放"""
+    try:
+        info = await BlocklyScriptExecutor().call_adb_api('GET', '/screen/info', full=True)
+        if info.get('density'):
+            await asyncio.to_thread(template_store.update, template_id, density=info['density'])
+    except Exception as e:
+        logger.warning(f"Density unavailable for {template_id}: {e}")
+
+
+def seed_feature_cache() -> None:
+    """啟動時把模板庫中已存的特徵載入比對快取"""
+    for template_id, blob in template_store.iter_features():
+        try:
+            seed_template_features('templates/' + template_id, blob)
+        except Exception as e:
+            logger.warning(f"Stored features of {template_id} unreadable: {e}")
+
+
+threading.Thread(target=seed_feature_cache, name='seed-features', daemon=True).start()
+
+# 執行紀錄：每次執行與步驟批次寫入 SQLite，保留 MQA_HISTORY_DAYS 天
+run_history = RunHistory(os.environ.get('MQA_HISTORY_DB', os.path.join(os.getcwd(), 'history', 'runs.db')))
+HISTORY_DAYS = float(os.environ.get('MQA_HISTORY_DAYS', 90))
+# 長時間執行的伺服器每隔這麼久清理一次過期的紀錄
+HISTORY_PRUNE_INTERVAL = 6 * 3600
+
+
+def prune_history() -> None:
+    try:
+        deleted = run_history.prune(time.time() - HISTORY_DAYS * 86400)
+        if deleted:
+            logger.info(f"Pruned {deleted} runs older than {HISTORY_DAYS} days")
+    except Exception as e:
+        logger.warning(f"Run history prune failed: {e}")
+
+
+def prune_history_periodically() -> None:
+    while True:
+        prune_history()
+        time.sleep(HISTORY_PRUNE_INTERVAL)
+
+
+threading.Thread(target=prune_history_periodically, name='prune-history', daemon=True).start()
 
 # ADB API服务器地址（你的手机操作API）
 ADB_API_BASE = "http://localhost:8000"
 
+# check_* 等待時每輪延長的全速截圖時間
+CHECK_BOOST_MS = 2000
+
+# 各裝置上模板的實際縮放（裝置, 模板來源密度）-> SIFT 估計值的中位數
+device_scales = DeviceScaleCache()
+
+# 各畫面（裝置, app, activity）上次完整 OCR 的文字位置，找文字時先只辨識這些位置
+text_layouts = TextLayoutCache()
+
+# 找文字時先查 UI 階層（uiautomator），MQA_UI_TREE=0 時關閉
+UI_TREE_LOOKUP = os.environ.get('MQA_UI_TREE', '1') != '0'
+# UI 階層中沒有、OCR 卻找到的 (畫面, 文字)：WebView、遊戲等自繪畫面，之後直接 OCR
+ui_tree_misses: set = set()
+UI_TREE_MISSES_MAX = 1000
+# 預取：執行目前步驟時先載入之後幾步的模板特徵與縮放；wait 後接視覺步驟時，在等待結束前
+# PREFETCH_LEAD_MS 擷取畫面並先算好 SIFT 特徵 / OCR（畫面沒再變時視覺步驟直接取用）。MQA_PREFETCH=0 關閉
+PREFETCH = os.environ.get('MQA_PREFETCH', '1') != '0'
+PREFETCH_LOOKAHEAD = 3
+PREFETCH_LEAD_MS = 800
+TEMPLATE_FUNCTIONS = ('find_template', 'find_all_template', 'check_template')
+TEXT_FUNCTIONS = ('find_text', 'check_text')
+# find_element 的查詢方式 -> /ui/find 的欄位
+ELEMENT_QUERIES = {'text': 'text', 'id': 'resource_id', 'class': 'class_name', 'desc': 'content_desc'}
+
+# 每次執行的 span 彙整成百分位數；MQA_OTEL_EXPORT=1 時另外送到 OpenTelemetry
+profile_stats = ProfileStats()
+OTEL_EXPORT = os.environ.get('MQA_OTEL_EXPORT') == '1'
+
+# 事件迴圈延遲（同步工作卡住迴圈時會反映在這裡；比對與 OCR 在 thread_budget 的執行緒池中執行）
+loop_monitor = LoopLagMonitor(on_lag=metrics.LOOP_LAG_SECONDS.observe)
+
+
+def report_block(block: Dict[str, Any]) -> None:
+    """BlockDetector.on_block：記錄阻塞事件迴圈的端點、Blockly 函數與程式位置"""
+    metrics.observe_block(block)
+    tags = block['tags']
+    logger.warning(f"Event loop blocked {block['duration_ms']} ms "
+                   f"({tags.get('endpoint', 'background')} {tags.get('function', '')}) at {block['culprit']}")
+
+
+# 阻塞偵測預設關閉，MQA_BLOCK_DETECTOR=1 啟動時開啟，或以 POST /debug/loop 切換
+block_detector = BlockDetector(threshold=float(os.environ.get('MQA_BLOCK_THRESHOLD_MS', 100)) / 1000,
+                               on_block=report_block)
+
+@app.on_event("startup")
+async def start_loop_monitor():
+    loop_monitor.start()
+    if os.environ.get('MQA_BLOCK_DETECTOR') == '1':
+        block_detector.start()
+
+@app.on_event("shutdown")
+async def stop_loop_monitor():
+    await loop_monitor.stop()
+    block_detector.stop()
+    await job_manager.shutdown()
+    run_history.close()
+    thread_budget.shutdown()
+
 # 请求模型
 class ScriptRequest(BaseModel):
     code: str
+    record: bool = False
+    
+class JobRequest(ScriptRequest):
+    # 同一裝置的工作依序執行；目前所有工作都送往 ADB_API_BASE，device 只用於排隊
+    device: str = 'default'
+
+class LoopDebugRequest(BaseModel):
+    enabled: bool
+    threshold_ms: Optional[float] = None
     
 class ExecutionResult(BaseModel):
     success: bool
@@ -55,10 +212,86 @@ class ExecutionResult(BaseModel):
     total_functions: int
     successful_functions: int
     errors: List[str]
+    recording_id: Optional[str] = None
+    spans: List[Dict[str, Any]] = []
+    timing: Optional[Dict[str, Any]] = None
 
 class CroppedTemplateRequest(BaseModel):
     filename: str
     image_data: str
+    dedup: str = 'keep'
+
+class TemplateMatchRequest(BaseModel):
+    template_ids: List[str]
+    refresh: bool = True
+    # True 時回傳每個模板的所有出現位置 (find_all_matches)
+    all_matches: bool = False
+
+class TextQueryRequest(BaseModel):
+    goals: List[str]
+    refresh: bool = True
+    # True 時沒有完全相符也接受容錯結果（增刪改字，見 text_query）；預設只容許大小寫與誤認字的差異
+    fuzzy: bool = False
+
+
+def check_dedup_mode(dedup: str) -> None:
+    if dedup not in DEDUP_MODES:
+        raise HTTPException(status_code=400, detail=f"dedup 必須是 {', '.join(DEDUP_MODES)} 之一")
+
+
+def template_path(template_id: str) -> str:
+    """比對用的模板路徑：別名解析為原模板"""
+    return 'templates/' + template_store.resolve(template_id)
+
+
+def match_template_ids(template_ids: List[str], screen=None) -> Dict[str, Any]:
+    """
+    批次比對模板 id：先把別名解析為原模板，每個原模板只比對一次
+
+    screen 為要比對的畫面（frame_cache.Frame），預設讀取目前的截圖檔
+
+    Returns:
+        {template_id: center 或 None}
+    """
+    canonical = template_store.resolve_many(template_ids)
+    positions = batch_template_match(['templates/' + canonical[tid] for tid in template_ids], screen=screen)
+    return {tid: positions['templates/' + canonical[tid]] for tid in template_ids}
+
+
+def match_all_template_ids(template_ids: List[str], screen=None) -> Dict[str, Any]:
+    """每個模板 id 的所有出現位置；別名解析為原模板後只比對一次"""
+    canonical = template_store.resolve_many(template_ids)
+    matches = batch_find_all_matches(['templates/' + canonical[tid] for tid in template_ids], screen=screen)
+    return {tid: matches['templates/' + canonical[tid]] for tid in template_ids}
+
+
+def current_frame(ctx: ExecutionContext):
+    """端點使用的畫面；讀不到截圖檔時回傳 503"""
+    try:
+        return ctx.current_frame()
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+
+def save_response(template: Dict[str, Any], size_bytes: int) -> Dict[str, Any]:
+    """儲存模板的回應；近似重複時註明對應的原模板，保留時列出近似的模板供使用者決定"""
+    filename = template['id']
+    response = {
+        "message": f"模板 '{filename}' 已成功保存",
+        "filename": filename,
+        "path": f"templates/{filename}",
+        "size_bytes": size_bytes
+    }
+    if template.get('merged'):
+        response["message"] = f"與既有模板 '{filename}' 相同，未新增"
+        response["merged_into"] = filename
+    elif template.get('alias_of'):
+        response["message"] += f"（與 '{template['alias_of']}' 近似，比對時使用原模板）"
+        response["alias_of"] = template['alias_of']
+    elif template.get('duplicates'):
+        response["message"] += f"（與 '{template['duplicates'][0]['id']}' 近似，已保留為獨立模板）"
+        response["duplicates"] = template['duplicates']
+    return response
 
 @app.get("/")
 async def root():
@@ -74,13 +307,114 @@ async def execute_blockly_script(request: ScriptRequest):
     """执行Blockly生成的脚本"""
     try:
         executor = BlocklyScriptExecutor()
-        result = await executor.execute(request.code)
+        result = await executor.execute(request.code, record=request.record)
         return result
         
     except Exception as e:
         logger.error(f"Script execution failed: {e}")
         raise HTTPException(status_code=500, detail=f"Script execution failed: {str(e)}")
 
+async def run_job(job: Job) -> Dict[str, Any]:
+    """JobManager 執行工作：每個步驟完成時推送進度事件"""
+    executor = BlocklyScriptExecutor(on_step=job.step)
+    result = await executor.execute(job.code, record=job.record, device=job.device, job_id=job.job_id)
+    # 完整的 span 可用 timing.trace_id 從 /profile/runs 取得
+    return result.model_dump(exclude={'spans'})
+
+# 非同步工作：每台裝置一個佇列。所有工作都經由同一個 ADB API（ADB_API_BASE）操作同一台手機，
+# 在依 device 分流之前一次只執行一個工作，否則 device 不同的兩個工作會同時操作同一台手機
+job_manager = JobManager(run_job, max_queued=100, max_concurrent=1)
+
+@app.post("/jobs", status_code=202)
+async def submit_job(request: JobRequest):
+    """送出腳本，立即回傳 job id；進度由 /jobs/{job_id}/events 串流"""
+    try:
+        job = job_manager.submit(request.code, device=request.device, record=request.record)
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return {**job.summary(), "position": job_manager.position(job),
+            "events": f"/jobs/{job.job_id}/events"}
+
+@app.get("/jobs")
+async def list_jobs(status: Optional[str] = None, device: Optional[str] = None):
+    return {"jobs": job_manager.list_jobs(status=status, device=device)}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """工作狀態、已完成的步驟與結束後的結果"""
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    return {**job.detail(), "position": job_manager.position(job)}
+
+@app.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str):
+    """Server-Sent Events：queued / position / running / step / finished，從第一個事件開始重播"""
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+
+    async def event_stream():
+        async for event in job_manager.events(job):
+            if event is None:
+                yield ": keepalive\n\n"
+            else:
+                yield f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False, default=str)}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    """取消工作；執行中的工作在下一個等待點（ADB 呼叫、等待畫面）停止"""
+    job = job_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    return job.summary()
+
+@app.get("/history/runs")
+async def list_history_runs(script: Optional[str] = None, device: Optional[str] = None,
+                            since: Optional[float] = None, until: Optional[float] = None,
+                            success: Optional[bool] = None, limit: int = 100):
+    """歷史執行（新的在前），可依腳本雜湊、裝置、時間 (epoch 秒) 與結果篩選"""
+    return {"runs": await asyncio.to_thread(run_history.runs, script, device, since, until, success,
+                                            min(limit, 1000))}
+
+@app.get("/history/runs/{run_id}")
+async def get_history_run(run_id: str):
+    """單次執行與其步驟（位置、信心值、畫面序號）；run_id 即 profiler 的 trace_id"""
+    run = await asyncio.to_thread(run_history.run, run_id)
+    if run is None:
+        raise HTTPException(status_code=404, detail=f"Run not found: {run_id}")
+    return run
+
+@app.get("/history/scripts")
+async def list_history_scripts(device: Optional[str] = None, since: Optional[float] = None,
+                               until: Optional[float] = None, limit: int = 100):
+    """每個腳本的執行次數、成功率與耗時"""
+    return {"scripts": await asyncio.to_thread(run_history.script_stats, device, since, until, limit)}
+
+@app.get("/history/scripts/{script_hash}")
+async def get_history_script(script_hash: str):
+    script = await asyncio.to_thread(run_history.script, script_hash)
+    if script is None:
+        raise HTTPException(status_code=404, detail=f"Script not found: {script_hash}")
+    return script
+
+@app.get("/history/flaky")
+async def list_flaky_steps(script: Optional[str] = None, device: Optional[str] = None,
+                           since: Optional[float] = None, until: Optional[float] = None,
+                           min_runs: int = 5, limit: int = 50):
+    """時好時壞的步驟（有成功也有失敗），含失敗率與結果翻轉次數"""
+    return {"steps": await asyncio.to_thread(run_history.flaky_steps, script, device, since, until,
+                                             min_runs, limit)}
+
+@app.get("/history/functions")
+async def list_function_stats(device: Optional[str] = None, since: Optional[float] = None,
+                              until: Optional[float] = None):
+    """各 Blockly 函數的呼叫次數、失敗數、耗時與平均信心值"""
+    return {"functions": await asyncio.to_thread(run_history.function_stats, device, since, until)}
+
 @app.get("/health")
 async def health_check():
     """健康检查"""
@@ -97,7 +431,7 @@ async def health_check():
         "adb_api_url": ADB_API_BASE
     }
 @app.post("/templates/save-cropped")
-async def save_cropped_template(request: CroppedTemplateRequest):
+async def save_cropped_template(request: CroppedTemplateRequest, background_tasks: BackgroundTasks):
     """保存裁切後的模板圖片（接收 base64 數據）"""
     try:
         # 處理 base64 數據
@@ -108,6 +442,7 @@ async def save_cropped_template(request: CroppedTemplateRequest):
         print(f"Image data preview: {image_data[:50]}...")
         
         # 檢查數據格式
+        check_dedup_mode(request.dedup)
         if not image_data:
             raise HTTPException(status_code=400, detail="圖片數據為空")
         
@@ -141,69 +476,19 @@ async def save_cropped_template(request: CroppedTemplateRequest):
             print(f"Image verification error: {e}")
             raise HTTPException(status_code=400, detail=f"無效的圖片數據: {str(e)}")
         
-        # 創建 templates 目錄
-        templates_dir = os.path.join(os.getcwd(), 'templates')
-        os.makedirs(templates_dir, exist_ok=True)
-        
-        # 處理文件名
-        if not filename.lower().endswith('.png'):
-            filename += '.png'
-        
-        file_path = os.path.join(templates_dir, filename)
-        
-        # 如果文件已存在，添加時間戳
-        if os.path.exists(file_path):
-            filename_without_ext = filename.rsplit('.', 1)[0]
-            filename = f"{filename_without_ext}_.png"
-            file_path = os.path.join(templates_dir, filename)
-        
-        # 保存文件
-        with open(file_path, "wb") as f:
-            f.write(image_bytes)
-        
-        print(f"File saved to: {file_path}")
-         # 確保文件路徑存在
-        json_Path = '../frontend/build/templates.json'
-        json_file = Path(json_Path)
-        
-        # 讀取現有的 JSON 文件，如果不存在則創建空列表
-        if json_file.exists():
-            with open(json_file, 'r', encoding='utf-8') as f:
-                try:
-                    templates_data = json.load(f)
-                    if not isinstance(templates_data, list):
-                        templates_data = []
-                except json.JSONDecodeError:
-                    templates_data = []
-        else:
-            templates_data = []
-        
-        # 創建新的模板條目
-        new_template = {
-            "id": filename,  # 移除副檔名作為 ID
-            "name": filename.rsplit('.', 1)[0]
-        }
+        # 寫入模板庫（檔名分配、檔案搬移與索引更新為原子操作）
+        template = await asyncio.to_thread(template_store.add_bytes, filename, image_bytes, None, request.dedup)
+        forget_template_features(template_path(template['id']))
+        filename = template['id']
+        print(f"Added template '{filename}'")
         
-        # 檢查是否已存在相同的模板（基於 ID）
-        existing_ids = [template.get('id') for template in templates_data if isinstance(template, dict)]
-        
-        if new_template['id'] not in existing_ids:
-            templates_data.append(new_template)
-            
-            # 寫回 JSON 文件
-            with open(json_file, 'w', encoding='utf-8') as f:
-                json.dump(templates_data, f, ensure_ascii=False, indent=2)
-            
-            print(f"Added template '{filename}'")
-        else:
-            print(f"Template '{filename}' already exists")
+        # 前端 templates.json 與模板特徵於回應後再處理
+        background_tasks.add_task(template_store.export_json)
+        background_tasks.add_task(precompute_features, filename)
+        if not template.get('merged'):
+            background_tasks.add_task(record_density, filename)
         
-        return {
-            "message": f"模板 '{filename}' 已成功保存",
-            "filename": filename,
-            "path": f"templates/{filename}",
-            "size_bytes": len(image_bytes)
-        }
+        return save_response(template, len(image_bytes))
         
         
     except HTTPException:
@@ -212,6 +497,265 @@ async def save_cropped_template(request: CroppedTemplateRequest):
         print(f"Unexpected error: {e}")
         raise HTTPException(status_code=500, detail=f"保存模板時發生錯誤: {str(e)}")
 
+async def iter_upload_file(upload_file, chunk_size: int = 1024 * 1024):
+    while True:
+        chunk = await upload_file.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+async def receive_upload(request: Request, signatures, max_bytes: int):
+    """
+    把請求內容串流寫入暫存檔：支援 multipart（欄位 file）或直接以 body 傳送二進位內容
+
+    Returns:
+        (TempUpload, 表單中的檔名或 None)
+    """
+    upload = TempUpload(template_store.templates_dir, signatures, max_bytes)
+    form_filename = None
+    if request.headers.get('content-type', '').startswith('multipart/form-data'):
+        form = await request.form()
+        upload_file = form.get('file')
+        if upload_file is None or isinstance(upload_file, str):
+            upload.discard()
+            raise UploadError("multipart 請求缺少 file 欄位")
+        form_filename = form.get('filename') or upload_file.filename
+        await upload.consume(iter_upload_file(upload_file))
+    else:
+        await upload.consume(request.stream())
+    return upload, form_filename
+
+
+@app.post("/templates/upload")
+async def upload_template(request: Request, background_tasks: BackgroundTasks, filename: Optional[str] = None,
+                          dedup: str = 'keep'):
+    """以二進位串流上傳模板（PNG/JPEG/WebP），不經過 base64"""
+    check_dedup_mode(dedup)
+    png_path = None
+    try:
+        upload, form_filename = await receive_upload(request, IMAGE_SIGNATURES, MAX_TEMPLATE_BYTES)
+        png_path = await asyncio.to_thread(finalize_image, upload)
+        filename = filename or form_filename or f"template_{time.strftime('%Y%m%d_%H%M%S')}"
+        filename = filename.rsplit('.', 1)[0] if filename.lower().endswith(('.jpg', '.jpeg', '.webp')) else filename
+        template = await asyncio.to_thread(template_store.add_file, filename, png_path, None, dedup)
+        forget_template_features(template_path(template['id']))
+    except UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        discard_path(png_path)
+    
+    background_tasks.add_task(template_store.export_json)
+    background_tasks.add_task(precompute_features, template['id'])
+    if not template.get('merged'):
+        background_tasks.add_task(record_density, template['id'])
+    return save_response(template, template['size_bytes'])
+
+
+@app.post("/templates/import-zip")
+async def import_template_pack(request: Request, background_tasks: BackgroundTasks, dedup: str = 'keep'):
+    """匯入模板包（zip），逐一驗證其中的圖片"""
+    check_dedup_mode(dedup)
+    archive_path = None
+    try:
+        upload, _ = await receive_upload(request, ZIP_SIGNATURE, MAX_ARCHIVE_BYTES)
+        archive_path = upload.path
+        entries = await asyncio.to_thread(extract_template_pack, archive_path, template_store.templates_dir)
+    except UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except zipfile.BadZipFile as e:
+        raise HTTPException(status_code=400, detail=f"無效的 zip 檔: {e}")
+    finally:
+        discard_path(archive_path)
+    
+    added, merged, skipped = [], [], []
+    # 保留下來但與既有模板近似的：{模板 id: 近似的模板}
+    duplicates = {}
+    for entry in entries:
+        if 'error' in entry:
+            skipped.append(entry)
+            continue
+        try:
+            template = await asyncio.to_thread(template_store.add_file, entry['filename'], entry['path'], None, dedup)
+            forget_template_features(template_path(template['id']))
+            if template.get('merged'):
+                merged.append({'filename': entry['filename'], 'merged_into': template['id']})
+                continue
+            added.append(template['id'])
+            if template.get('duplicates'):
+                duplicates[template['id']] = template['duplicates']
+            background_tasks.add_task(precompute_features, template['id'])
+            # 不記錄 density：模板包的圖片不是從目前連線的裝置截取的
+        except Exception as e:
+            skipped.append({'filename': entry['filename'], 'error': str(e)})
+        finally:
+            discard_path(entry['path'])
+    
+    background_tasks.add_task(template_store.export_json)
+    return {
+        "message": f"匯入完成: {len(added)} 個模板",
+        "added": added,
+        "merged": merged,
+        "duplicates": duplicates,
+        "skipped": skipped
+    }
+
+
+@app.get("/templates")
+async def list_templates():
+    """列出模板與中繼資料"""
+    templates = await asyncio.to_thread(template_store.list)
+    return {"templates": templates, "count": len(templates)}
+
+@app.get("/templates.json")
+async def get_templates_json():
+    """前端下拉選單用的模板清單"""
+    await asyncio.to_thread(template_store.export_json)
+    return await asyncio.to_thread(template_store.frontend_entries)
+
+@app.get("/templates/scales")
+async def get_template_scales():
+    """各裝置上學到的模板縮放（裝置、模板來源密度、中位數與樣本數）"""
+    return {"scales": device_scales.snapshot()}
+
+
+@app.get("/templates/{template_id}/duplicates")
+async def get_template_duplicates(template_id: str, max_distance: int = DUPLICATE_DISTANCE):
+    """列出近似重複的模板（pHash 漢明距離）與同組別名"""
+    if await asyncio.to_thread(template_store.get, template_id) is None:
+        raise HTTPException(status_code=404, detail=f"Template not found: {template_id}")
+    duplicates = await asyncio.to_thread(template_store.find_duplicates, template_id, max_distance)
+    return {
+        "template_id": template_id,
+        "canonical": await asyncio.to_thread(template_store.resolve, template_id),
+        "duplicates": duplicates
+    }
+
+@app.post("/templates/dedup")
+async def dedup_templates(background_tasks: BackgroundTasks, max_distance: int = DUPLICATE_DISTANCE,
+                          dry_run: bool = False):
+    """把模板庫中近似重複的模板設為最早建立者的別名（圖片檔保留）"""
+    groups = await asyncio.to_thread(template_store.dedup, max_distance, dry_run)
+    if not dry_run:
+        background_tasks.add_task(template_store.export_json)
+    return {
+        "groups": groups,
+        "aliased": sum(len(group['aliases']) for group in groups),
+        "dry_run": dry_run
+    }
+
+@app.post("/templates/{template_id}/unalias")
+async def unalias_template(template_id: str, background_tasks: BackgroundTasks):
+    """取消別名，模板恢復為獨立比對"""
+    try:
+        await asyncio.to_thread(template_store.set_alias, template_id, None)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Template not found: {template_id}")
+    background_tasks.add_task(precompute_features, template_id)
+    return {"message": f"模板 '{template_id}' 已恢復為獨立模板"}
+
+@app.post("/templates/match")
+async def match_templates(request: TemplateMatchRequest):
+    """在目前畫面上批次比對多個模板；同一原模板的別名只比對一次"""
+    ctx = ExecutionContext()
+    if request.refresh:
+        await BlocklyScriptExecutor().refresh_frame()
+    screen = current_frame(ctx)
+    if request.all_matches:
+        matches = await thread_budget.run_vision(match_all_template_ids, request.template_ids, screen)
+        return {"matches": matches, "matched": sum(bool(m) for m in matches.values())}
+    positions = await thread_budget.run_vision(match_template_ids, request.template_ids, screen)
+    return {"positions": positions, "matched": sum(pos is not None for pos in positions.values())}
+
+@app.post("/ocr/query")
+async def query_text(request: TextQueryRequest):
+    """對目前畫面做一次 OCR，查詢多個文字目標（每個目標回傳所有結果，最好的在前）"""
+    ctx = ExecutionContext()
+    if request.refresh:
+        await BlocklyScriptExecutor().refresh_frame()
+    frame = current_frame(ctx)
+    result = await thread_budget.run_ocr(frame.derive, 'ocr', ocr_text.mask_ocr)
+    hits = ocr_text.query_ocr(result, request.goals, request.fuzzy)
+    return {"hits": hits, "matched": sum(bool(h) for h in hits.values())}
+
+@app.delete("/templates/{template_id}")
+async def delete_template(template_id: str, background_tasks: BackgroundTasks):
+    """刪除模板"""
+    if not await asyncio.to_thread(template_store.remove, template_id):
+        raise HTTPException(status_code=404, detail=f"Template not found: {template_id}")
+    forget_template_features('templates/' + template_id)
+    background_tasks.add_task(template_store.export_json)
+    return {"message": f"模板 '{template_id}' 已刪除"}
+
+@app.get("/profile/stats")
+async def get_profile_stats():
+    """各 span（類別:名稱）耗時的百分位數，彙整最近的執行"""
+    return {"spans": profile_stats.percentiles()}
+
+@app.delete("/profile/stats")
+async def reset_profile_stats():
+    profile_stats.reset()
+    return {"message": "Profile stats cleared"}
+
+@app.get("/profile/runs")
+async def list_profile_runs():
+    """最近幾次執行的時間分配"""
+    return {"runs": profile_stats.recent()}
+
+@app.get("/profile/runs/{trace_id}")
+async def get_profile_run(trace_id: str, format: str = 'spans'):
+    """單次執行的 span；format=chrome 時回傳 chrome://tracing / Perfetto 格式"""
+    trace = profile_stats.get_trace(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail=f"Trace not found: {trace_id}")
+    if format == 'chrome':
+        return trace.chrome_trace()
+    return {**trace.summary(), "spans": trace.spans}
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus 指標"""
+    return Response(content=metrics.render(), headers={"Content-Type": metrics.CONTENT_TYPE})
+
+@app.get("/ocr/layouts")
+async def get_text_layouts():
+    """記住文字位置的畫面，以及只辨識即找到 / 未找到 / 直接完整 OCR 的次數"""
+    return text_layouts.snapshot()
+
+@app.delete("/ocr/layouts")
+async def clear_text_layouts():
+    text_layouts.clear()
+    return {"message": "Text layouts cleared"}
+
+@app.get("/debug/threads")
+async def get_thread_budget():
+    """核心分配設定與視覺 / OCR 執行緒池的排隊狀況"""
+    return thread_budget.status()
+
+@app.get("/debug/loop")
+async def get_loop_debug():
+    """事件迴圈延遲與最近的阻塞事件（含堆疊取樣、端點與 Blockly 函數）"""
+    return {"lag": loop_monitor.stats(), **block_detector.status()}
+
+@app.post("/debug/loop")
+async def set_loop_debug(request: LoopDebugRequest):
+    """開啟/關閉阻塞偵測，可同時調整門檻"""
+    if request.threshold_ms is not None and request.threshold_ms <= 0:
+        raise HTTPException(status_code=400, detail="threshold_ms must be positive")
+    threshold = request.threshold_ms / 1000 if request.threshold_ms else None
+    if request.enabled:
+        block_detector.start(threshold)
+    else:
+        block_detector.stop()
+        if threshold:
+            block_detector.threshold = threshold
+    return {"enabled": block_detector.enabled, "threshold_ms": block_detector.threshold * 1000}
+
+@app.delete("/debug/loop/blocks")
+async def clear_loop_blocks():
+    block_detector.clear()
+    return {"message": "Block history cleared"}
+
 @app.post("/reset-device")
 async def reset_device():
     """重置设备到初始状态"""
@@ -258,60 +802,196 @@ async def reset_device():
         raise HTTPException(status_code=500, detail=f"重置设备失败: {str(e)}")
 
 class BlocklyScriptExecutor:
-    """Blockly脚本执行器"""
+    """
+    Blockly脚本执行器
+
+    執行中的狀態（畫面、結果、預取工作）都在每次 execute 建立的 ExecutionContext 中，
+    同一個執行器可同時執行多個腳本（見 execution_context.py）
+    """
     
-    def __init__(self):
-        self.results = []
-        self.errors = []
-        self.templateId = ''
-        self.templatePos = [0,0]
-        self.OcrPos = [0,0]
-        
-    async def execute(self, code: str) -> ExecutionResult:
+    def __init__(self, on_step: Optional[Callable[[int, int, Dict[str, Any], float], None]] = None):
+        # on_step(步驟序號, 總步驟數, 結果, 耗時毫秒)：每個函數執行完呼叫，供工作進度串流
+        self.on_step = on_step
+        
+    async def execute(self, code: str, record: bool = False, device: str = 'default',
+                      job_id: Optional[str] = None) -> ExecutionResult:
         """执行代码"""
-        self.results = []
-        self.errors = []
+        trace = Trace()
+        ctx = ExecutionContext(device)
+        metrics.SCRIPTS_IN_FLIGHT.inc()
+        try:
+            with trace.activate():
+                result = await self._execute(code, record, ctx)
+        finally:
+            metrics.SCRIPTS_IN_FLIGHT.dec()
         
+        profile_stats.add_trace(trace)
+        metrics.observe_trace(trace, result.success)
+        if OTEL_EXPORT:
+            export_otel(trace)
+        result.spans = trace.spans
+        result.timing = trace.summary()
+        self.save_history(code, result, trace, device, job_id)
+        return result
+
+    def save_history(self, code: str, result: ExecutionResult, trace: Trace, device: str,
+                     job_id: Optional[str]) -> None:
+        """排入執行紀錄（背景批次寫入，不阻塞回應）"""
+        try:
+            run_history.record(code, {
+                'run_id': trace.trace_id,
+                'device': device,
+                'source': 'job' if job_id else 'execute',
+                'job_id': job_id,
+                'started_at': trace.started_at,
+                'duration_ms': result.timing['total_ms'],
+                'success': 1 if result.success else 0,
+                'total_steps': result.total_functions,
+                'failed_steps': result.total_functions - result.successful_functions,
+                'recording_id': result.recording_id,
+                'error': result.errors[0] if result.errors else None,
+            }, step_rows(trace.trace_id, result.results, trace.spans))
+        except Exception as e:
+            logger.warning(f"Run history record failed: {e}")
+    
+    async def _execute(self, code: str, record: bool, ctx: ExecutionContext) -> ExecutionResult:
         logger.info(f"Executing script: {code}")
         
         # 解析函数调用
-        function_calls = self.parse_function_calls(code)
+        with span('parse', 'executor') as parse_span:
+            function_calls = self.parse_function_calls(code)
+            parse_span['functions'] = len(function_calls)
         
         logger.info(f"Found {len(function_calls)} function calls")
         
+        # 錄製畫面時間軸，供事後離線回放
+        recording_id = await self.start_recording() if record else None
+        
         # 执行每个函数调用
-        for func_name, args in function_calls:
-            try:
-                result = await self.execute_function(func_name, args)
-                self.results.append({
-                    "function": func_name,
-                    "args": args,
-                    "result": result,
-                    "success": True
-                })
-                logger.info(f"Executed {func_name}({args}) -> {result}")
-                
-            except Exception as e:
-                error_msg = f"Function {func_name}({args}) failed: {str(e)}"
-                self.errors.append(error_msg)
-                self.results.append({
-                    "function": func_name,
-                    "args": args,
-                    "error": str(e),
-                    "success": False
-                })
-                logger.error(error_msg)
+        try:
+            for index, (func_name, args) in enumerate(function_calls):
+                if PREFETCH:
+                    self.prefetch(function_calls, index, ctx)
+                if recording_id:
+                    await self.mark_recording_step(index, func_name, args)
+                step_start = time.perf_counter()
+                try:
+                    with span(func_name, 'step', step=index, args=args), tagged(function=func_name, step=index):
+                        result = await self.execute_function(func_name, args, ctx)
+                    ctx.results.append({
+                        "function": func_name,
+                        "args": args,
+                        "result": result,
+                        "success": True
+                    })
+                    logger.info(f"Executed {func_name}({args}) -> {result}")
+                    
+                except Exception as e:
+                    error_msg = f"Function {func_name}({args}) failed: {str(e)}"
+                    ctx.errors.append(error_msg)
+                    ctx.results.append({
+                        "function": func_name,
+                        "args": args,
+                        "error": str(e),
+                        "success": False
+                    })
+                    logger.error(error_msg)
+                if self.on_step:
+                    self.on_step(index, len(function_calls), ctx.results[-1],
+                                 (time.perf_counter() - step_start) * 1000)
+        finally:
+            ctx.cancel_tasks()
+            if recording_id:
+                await self.stop_recording()
         
-        successful_count = sum(1 for r in self.results if r.get("success", False))
+        successful_count = sum(1 for r in ctx.results if r.get("success", False))
         
         return ExecutionResult(
-            success=len(self.errors) == 0,
-            results=self.results,
+            success=len(ctx.errors) == 0,
+            results=ctx.results,
             total_functions=len(function_calls),
             successful_functions=successful_count,
-            errors=self.errors
+            errors=ctx.errors,
+            recording_id=recording_id
         )
     
+    def prefetch(self, function_calls: List[tuple], index: int, ctx: ExecutionContext) -> None:
+        """
+        在背景準備之後的視覺步驟（目前步驟照常執行）
+
+        - 之後 PREFETCH_LOOKAHEAD 步內的模板：載入特徵快取與裝置縮放
+        - 目前是 wait 且下一步是視覺步驟：等待結束前擷取畫面並先做比對前的計算
+        """
+        for func_name, args in function_calls[index + 1:index + 1 + PREFETCH_LOOKAHEAD]:
+            if func_name in TEMPLATE_FUNCTIONS and args and args[0] not in ctx.prefetched:
+                ctx.prefetched.add(args[0])
+                ctx.spawn(self.prefetch_template(args[0], ctx))
+
+        func_name, args = function_calls[index]
+        if func_name == 'wait' and index + 1 < len(function_calls):
+            duration_ms = int(args[0]) if len(args) > 0 else 1000
+            next_name = function_calls[index + 1][0]
+            if duration_ms >= PREFETCH_LEAD_MS and next_name in TEMPLATE_FUNCTIONS + TEXT_FUNCTIONS:
+                ctx.spawn(self.prefetch_frame(next_name, (duration_ms - PREFETCH_LEAD_MS) / 1000, ctx))
+
+    async def prefetch_template(self, template_id: str, ctx: ExecutionContext) -> None:
+        """模板特徵與縮放提示放入快取；失敗時由步驟本身回報"""
+        try:
+            path = template_path(template_id)
+            with span('prefetch', 'executor', template=template_id):
+                await thread_budget.run_vision(get_template_features, path)
+                await self.scale_hint(path, ctx)
+        except Exception as e:
+            logger.debug(f"Prefetch of template {template_id} skipped: {e}")
+
+    async def prefetch_frame(self, func_name: str, delay: float, ctx: ExecutionContext) -> None:
+        """
+        推測性地擷取畫面並先做 SIFT 特徵（模板）或完整 OCR（文字）
+
+        結果掛在畫面上（frame_cache）：步驟重新擷取後畫面相同就直接取用，
+        仍在計算時等待同一份結果；畫面已改變則只浪費這次計算。
+        預取的畫面不固定到 ctx，目前步驟使用的畫面不受影響
+        """
+        try:
+            await asyncio.sleep(delay)
+            with span('prefetch', 'executor', target=func_name, speculative=True):
+                await self.refresh_frame()
+                frame = ctx.frames.load()
+                if frame is None:
+                    return
+                if func_name in TEXT_FUNCTIONS:
+                    await thread_budget.run_ocr(frame.derive, 'ocr', ocr_text.mask_ocr)
+                else:
+                    await thread_budget.run_vision(prefetch_frame, sift=func_name != 'find_all_template', screen=frame)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.debug(f"Speculative prefetch for {func_name} skipped: {e}")
+
+    async def start_recording(self) -> Optional[str]:
+        """請 ADB API 開始錄影，失敗時不錄影繼續執行"""
+        run_id = f"{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+        try:
+            await self.call_adb_api('POST', '/recording/start', {'run_id': run_id})
+            return run_id
+        except Exception as e:
+            logger.warning(f"Recording not started: {e}")
+            return None
+    
+    async def mark_recording_step(self, index: int, func_name: str, args: List[Any]) -> None:
+        try:
+            await self.call_adb_api('POST', '/recording/step', {
+                'step': index, 'function': func_name, 'args': args
+            })
+        except Exception as e:
+            logger.warning(f"Recording step not marked: {e}")
+    
+    async def stop_recording(self) -> None:
+        try:
+            await self.call_adb_api('POST', '/recording/stop')
+        except Exception as e:
+            logger.warning(f"Recording not stopped: {e}")
+    
     def parse_function_calls(self, code: str) -> List[tuple]:
         """解析代码中的函数调用"""
         # 匹配函数调用的正则表达式
@@ -389,7 +1069,7 @@ class BlocklyScriptExecutor:
         # 其他情况返回字符串
         return arg
     
-    async def execute_function(self, func_name: str, args: List[Any]) -> str:
+    async def execute_function(self, func_name: str, args: List[Any], ctx: ExecutionContext) -> str:
         """执行具体函数"""
         
         if func_name == 'click':
@@ -442,34 +1122,81 @@ class BlocklyScriptExecutor:
             })
         
         elif func_name == 'find_template':
-            path = 'templates/'+args[0]
-            self.templatePos = mixed_template_match(path)
-            return f'pos at x:{self.templatePos[0]} y:{self.templatePos[1]}'
+            path = template_path(args[0])
+            await self.refresh_frame(ctx)
+            scale, scale_key = await self.scale_hint(path, ctx)
+            ctx.template_pos = await thread_budget.run_vision(self.match_template, path, scale, scale_key,
+                                                              ctx.current_frame())
+            template_store.record_match(args[0], ctx.template_pos)
+            return f'pos at x:{ctx.template_pos[0]} y:{ctx.template_pos[1]}'
         
+        elif func_name == 'find_all_template':
+            path = template_path(args[0])
+            await self.refresh_frame(ctx)
+            scale, _ = await self.scale_hint(path, ctx)
+            ctx.template_matches = await thread_budget.run_vision(self.match_all_template, path, scale,
+                                                                  ctx.current_frame())
+            # click_object('template') 點第一個；沒找到時清除，不會點到上一步的位置
+            if ctx.template_matches:
+                ctx.template_pos = [ctx.template_matches[0]['x'], ctx.template_matches[0]['y']]
+            else:
+                ctx.template_pos = [0, 0]
+            return f"{len(ctx.template_matches)} found: {[(m['x'], m['y']) for m in ctx.template_matches]}"
+
+        elif func_name == 'click_nth':
+            n = int(args[0]) if len(args) > 0 else 1
+            if not ctx.template_matches:
+                raise Exception("No matches to click, run find_all_template first")
+            if n < 1 or n > len(ctx.template_matches):
+                raise Exception(f"click_nth({n}) out of range: {len(ctx.template_matches)} matches")
+            match = ctx.template_matches[n - 1]
+            return await self.call_adb_api('POST', '/input/click', {'x': match['x'], 'y': match['y']})
+
         elif func_name == 'find_text':
             goal = args[0]
-            result = ocr_text.mask_ocr()
-            self.OcrPos = ocr_text.re_ocr(result, goal)
-            return f'text:{self.OcrPos}'
+            # 第二個參數為 true 時容許增刪改字（容錯比對需明確指定）
+            fuzzy = bool(args[1]) if len(args) > 1 else False
+            await self.refresh_frame(ctx)
+            ctx.ocr_pos = await self.locate_text(goal, ctx, fuzzy)
+            return f'text:{ctx.ocr_pos}'
+
+        elif func_name == 'find_element':
+            by = args[0] if len(args) > 0 else 'text'
+            if by not in ELEMENT_QUERIES:
+                raise Exception(f"find_element: unknown query '{by}', expected one of {list(ELEMENT_QUERIES)}")
+            value = str(args[1]) if len(args) > 1 else ''
+            pos = await self.find_element(**{ELEMENT_QUERIES[by]: value})
+            if pos is None:
+                return f'element {by}={value} not found'
+            ctx.element_pos = pos
+            return f'element:{ctx.element_pos}'
             
         elif func_name == 'click_object':
             obj = args[0]
             print(obj)
             if obj == 'template':
-                if self.templatePos == [0,0]:
+                if ctx.template_pos == [0,0]:
                     return f"Template  {obj}"
                 else:
                     return await self.call_adb_api('POST', '/input/click', {
-                    'x': int(self.templatePos[0]),
-                    'y': int(self.templatePos[1])
+                    'x': int(ctx.template_pos[0]),
+                    'y': int(ctx.template_pos[1])
                 })
             elif obj == 'text':
-                if self.OcrPos == [0,0]:
+                if ctx.ocr_pos == [0,0]:
                     return f"Template  {obj}"
                 else:
                     return await self.call_adb_api('POST', '/input/click', {
-                    'x': int(self.OcrPos[0]),
-                    'y': int(self.OcrPos[1])
+                    'x': int(ctx.ocr_pos[0]),
+                    'y': int(ctx.ocr_pos[1])
+                })
+            elif obj == 'element':
+                if ctx.element_pos == [0,0]:
+                    return f"Template  {obj}"
+                else:
+                    return await self.call_adb_api('POST', '/input/click', {
+                    'x': int(ctx.element_pos[0]),
+                    'y': int(ctx.element_pos[1])
                 })
             elif obj == 'home':
                 return await self.call_adb_api('POST', '/navigation/home')
@@ -479,54 +1206,267 @@ class BlocklyScriptExecutor:
                 return "loading"
             
         elif func_name == 'check_template':
-            path = 'templates/'+args[0]
+            path = template_path(args[0])
             pos_temp = None
-            time.sleep(0.25)
+            hint = await self.scale_hint(path, ctx)
             while pos_temp is None:
-                pos_temp = mixed_template_match(path)
-                time.sleep(0.25)
-            self.templatePos = pos_temp
-            return f'pos at x:{self.templatePos[0]} y:{self.templatePos[1]}'
+                # 每輪先取得新畫面，等待期間截圖全速進行
+                await self.refresh_frame(ctx, boost_ms=CHECK_BOOST_MS)
+                pos_temp = await thread_budget.run_vision(self.match_template, path, *hint, ctx.current_frame())
+            ctx.template_pos = pos_temp
+            template_store.record_match(args[0], ctx.template_pos)
+            return f'pos at x:{ctx.template_pos[0]} y:{ctx.template_pos[1]}'
 
         elif func_name == 'check_text':
             goal = args[0]
+            fuzzy = bool(args[1]) if len(args) > 1 else False
             pos_temp = None
-            time.sleep(0.25)
+            # 這次等待中 UI 階層取不到或沒有這段文字的畫面，之後的輪詢只做 OCR
+            tree_skipped = set()
             try:
                 while pos_temp is None:
-                    result = ocr_text.mask_ocr()
-                    pos_temp = ocr_text.re_ocr(result, goal)
-                    time.sleep(0.25)
+                    await self.refresh_frame(ctx, boost_ms=CHECK_BOOST_MS)
+                    pos_temp = await self.locate_text(goal, ctx, fuzzy, tree_skipped)
             except Exception as e:
                 print(f"Exception in loop: {e}")
                 return None  # This would cause the None return
-            self.OcrPos = pos_temp
-            return f'text:{self.OcrPos}'
+            ctx.ocr_pos = pos_temp
+            return f'text:{ctx.ocr_pos}'
             
         else:
             raise Exception(f"Unknown function: {func_name}")
 
-    async def call_adb_api(self, method: str, endpoint: str, data: Optional[Dict] = None) -> str:
-        """调用ADB API"""
+    async def screen_info(self, ctx: ExecutionContext) -> Optional[Dict[str, Any]]:
+        """目前裝置的螢幕尺寸、密度與序號（每次執行查詢一次）；ADB API 無法連線時回傳 None"""
+        if ctx.screen_info is None:
+            try:
+                ctx.screen_info = await self.call_adb_api('GET', '/screen/info', full=True)
+            except Exception as e:
+                logger.warning(f"Screen info unavailable: {e}")
+                ctx.screen_info = {}
+        return ctx.screen_info or None
+
+    async def scale_hint(self, path: str, ctx: ExecutionContext):
+        """
+        模板在目前裝置上的預期縮放，SIFT 無法估計時使用
+
+        先用這台裝置上同來源密度模板學到的比例，否則以兩者的螢幕密度推算
+
+        Returns:
+            (scale 或 None, device_scales 的鍵)
+        """
+        info = await self.screen_info(ctx) or {}
+        template = template_store.get(os.path.basename(path))
+        template_density = template.get('density') if template else None
+        key = (info.get('device_id') or 'default', template_density)
+        learned = device_scales.get(key)
+        if learned:
+            return learned, key
+        if template_density and info.get('density'):
+            return info['density'] / template_density, key
+        return None, key
+
+    def match_template(self, path: str, scale: Optional[float] = None, scale_key=None, screen=None):
+        """模板比對（screen 為固定的畫面），各階段耗時記錄為 span；SIFT 估計出的縮放記入 device_scales"""
+        with span('template_match', 'vision', template=path) as match_span:
+            timings = {}
+            info = {}
+            pos = mixed_template_match(path, timings=timings, info=info, scale=scale, screen=screen)
+            match_span['stages'] = timings
+            match_span['found'] = pos is not None
+            match_span.update(info)
+            if pos is not None:
+                match_span['pos'] = list(pos)
+                if scale_key is not None and info.get('scale_source') == 'sift':
+                    device_scales.observe(scale_key, info['scale'])
+        return pos
+
+    def match_all_template(self, path: str, scale: Optional[float] = None, screen=None) -> List[Dict[str, Any]]:
+        """多目標比對：回傳所有出現位置（閱讀順序）"""
+        with span('template_match_all', 'vision', template=path, scale=scale) as match_span:
+            timings = {}
+            matches = find_all_matches(path, timings=timings, scale=scale, screen=screen) or []
+            match_span['stages'] = timings
+            match_span['found'] = bool(matches)
+            match_span['count'] = len(matches)
+            if matches:
+                match_span['pos'] = [matches[0]['x'], matches[0]['y']]
+                match_span['confidence'] = matches[0]['score']
+        return matches
+
+    async def screen_key(self, ctx: ExecutionContext):
+        """目前畫面的 (裝置, app, activity)，用於 text_layouts；查不到前台 app 時回傳 None"""
+        info = await self.screen_info(ctx) or {}
+        try:
+            current = await self.call_adb_api('GET', '/app/current', full=True)
+        except Exception as e:
+            logger.warning(f"Current app unavailable: {e}")
+            return None
+        if not current.get('current_app'):
+            return None
+        return (info.get('device_id') or 'default', current['current_app'], current.get('activity'))
+
+    async def find_element(self, **query) -> Optional[List[int]]:
+        """
+        在 UI 階層中找元件（/ui/find，欄位見 ELEMENT_QUERIES），回傳第一個的中心點
+
+        ADB API 無法連線或取不到階層時回傳 None
+        """
+        with span('ui_find', 'vision', **query) as find_span:
+            try:
+                result = await self.call_adb_api('POST', '/ui/find', query, full=True)
+            except Exception as e:
+                logger.warning(f"UI hierarchy lookup failed: {e}")
+                find_span['available'] = False
+                return None
+            find_span['available'] = result.get('available', False)
+            elements = result.get('elements') or []
+            find_span['found'] = bool(elements)
+            find_span['count'] = len(elements)
+            if not elements:
+                return None
+            pos = [elements[0]['x'], elements[0]['y']]
+            find_span['pos'] = pos
+            return pos
+
+    async def locate_text(self, goal: str, ctx: ExecutionContext, fuzzy: bool = False,
+                          tree_skipped: Optional[set] = None) -> Optional[List[int]]:
+        """
+        找文字：先查 UI 階層（原生元件幾毫秒），找不到再 OCR（fuzzy 時容許增刪改字）
+
+        UI 階層沒有、OCR 卻找到的文字記在 ui_tree_misses，同一畫面之後直接 OCR；
+        check_text 等待時傳入 tree_skipped，階層取不到或沒有相符元件的畫面記在其中，
+        之後的輪詢不再重新 dump（畫面變動時階層快取失效，每輪都要重新 dump）
+        """
+        screen = await self.screen_key(ctx)
+        use_tree = UI_TREE_LOOKUP and (screen, goal) not in ui_tree_misses
+        if use_tree and (tree_skipped is None or screen not in tree_skipped):
+            # goal 是一般文字（'1+1'、'.' 不是正則），比對方式與 OCR 找文字相同
+            pos = await self.find_element(text=goal, normalized=True)
+            if pos is not None:
+                return pos
+            if tree_skipped is not None:
+                tree_skipped.add(screen)
+        pos = await thread_budget.run_ocr(self.find_text, goal, screen, ctx.current_frame(), fuzzy)
+        if use_tree and pos is not None and screen:
+            if len(ui_tree_misses) >= UI_TREE_MISSES_MAX:
+                ui_tree_misses.clear()
+            ui_tree_misses.add((screen, goal))
+        return pos
+
+    def find_text(self, goal: str, screen=None, frame=None, fuzzy: bool = False):
+        """
+        在 frame（固定的畫面，見 ExecutionContext）上 OCR 後搜尋文字
+
+        畫面已有完整 OCR 結果（frame_cache）時直接搜尋；screen（見 screen_key）有值且這個畫面上之前讀到過相符的文字時，先只辨識那些位置；
+        找不到或沒有記住的位置時做完整的偵測 + 辨識，並記住這次的文字位置
+        """
+        if frame is None:
+            return None
+        # 這張畫面已做過完整 OCR（預取或上一輪輪詢）時直接搜尋
+        result = frame.peek('ocr')
+        cached = result is not None
+        boxes = text_layouts.candidates(screen, goal, fuzzy) if screen and not cached else []
+        if boxes:
+            try:
+                with span('ocr', 'vision', mode='recognition', boxes=len(boxes)):
+                    partial = ocr_text.recognize_boxes(boxes, frame.image)
+            except Exception as e:
+                # 只辨識的路徑失敗（例如辨識模型載入失敗）時改做完整 OCR，不讓步驟失敗
+                logger.warning(f"Recognition-only OCR failed, running full OCR: {e}")
+                partial = None
+            with span('text_search', 'vision', goal=goal, mode='recognition') as search_span:
+                pos = self.search_text(partial, goal, search_span, fuzzy)
+            text_layouts.record('hits' if pos is not None else 'misses')
+            if pos is not None:
+                return pos
+        elif screen and not cached:
+            text_layouts.record('full')
+
+        if not cached:
+            with span('ocr', 'vision', mode='full'):
+                result = frame.derive('ocr', ocr_text.mask_ocr)
+        if screen:
+            text_layouts.store(screen, result)
+        with span('text_search', 'vision', goal=goal, cached=cached) as search_span:
+            pos = self.search_text(result, goal, search_span, fuzzy)
+            search_span['found'] = pos is not None
+        return pos
+
+    @staticmethod
+    def search_text(result, goal: str, search_span, fuzzy: bool = False):
+        """在 OCR 結果中找 goal，最佳結果記在 span 上（完全相符或容錯的相似度）"""
+        hits = ocr_text.query_ocr(result, [goal], fuzzy)[goal]
+        if not hits:
+            return None
+        best = hits[0]
+        search_span.update(found=True, pos=[best['x'], best['y']], text=best['text'],
+                           similarity=best['similarity'], exact=best['exact'], hits=len(hits))
+        return [best['x'], best['y']]
+
+    async def refresh_frame(self, ctx: Optional[ExecutionContext] = None, boost_ms: int = 0) -> None:
+        """
+        請 ADB API 立即擷取新截圖；boost_ms > 0 時同時讓截圖全速進行一段時間
+
+        有 ctx 時擷取後立即固定這張畫面，這個步驟之後的比對都使用它
+        （其他腳本之後的擷取不會改變這個步驟看到的畫面）
+        """
+        with span('refresh_frame', 'frame', boost_ms=boost_ms):
+            try:
+                if boost_ms:
+                    await self.call_adb_api('POST', '/capture/boost', {'duration_ms': boost_ms})
+                await self.call_adb_api('POST', '/capture/now')
+            except Exception as e:
+                # 無法取得新截圖時退回舊行為：稍等後讀取目前的截圖檔
+                logger.warning(f"Frame refresh failed: {e}")
+                await asyncio.sleep(0.25)
+            if ctx is not None:
+                ctx.pin_frame()
+
+    async def call_adb_api(self, method: str, endpoint: str, data: Optional[Dict] = None, full: bool = False):
+        """调用ADB API；full=True 時回傳完整的 JSON 回應"""
+        url = f"{ADB_API_BASE}{endpoint}"
+        
+        with span(f"{method.upper()} {endpoint}", 'http') as http_span:
+            return await self._request_adb_api(method, url, data, http_span, full)
+
+    async def _request_adb_api(self, method: str, url: str, data: Optional[Dict], http_span: Dict,
+                               full: bool = False):
         import aiohttp
         
-        url = f"{ADB_API_BASE}{endpoint}"
+        def server_timing(response) -> None:
+            # ADB API 在 Server-Timing 中回報處理時間與 adb 指令耗時，差值即為 HTTP 往返成本
+            timings = parse_server_timing(response.headers.get('Server-Timing'))
+            http_span['status'] = response.status
+            if 'app' in timings:
+                http_span['stages'] = {'adb_api': timings['app']}
+                http_span['stage_category'] = 'adb_api'
+            if 'adb' in timings:
+                http_span['adb_ms'] = timings['adb']
         
         try:
             async with aiohttp.ClientSession() as session:
                 if method.upper() == 'POST':
                     async with session.post(url, json=data if data else {}) as response:
+                        server_timing(response)
                         if response.status == 200:
                             result = await response.json()
-                            return result.get('message', 'Success')
+                            if 'frame_seq' in result:
+                                # 擷取的畫面序號，執行紀錄以此對應步驟與畫面
+                                http_span['frame_seq'] = result['frame_seq']
+                            return result if full else result.get('message', 'Success')
                         else:
                             error_text = await response.text()
                             raise Exception(f"API call failed: {response.status} - {error_text}")
                 elif method.upper() == 'GET':
                     async with session.get(url) as response:
+                        server_timing(response)
                         if response.status == 200:
                             result = await response.json()
-                            return result.get('message', 'Success')
+                            if 'frame_seq' in result:
+                                # 擷取的畫面序號，執行紀錄以此對應步驟與畫面
+                                http_span['frame_seq'] = result['frame_seq']
+                            return result if full else result.get('message', 'Success')
                         else:
                             error_text = await response.text()
                             raise Exception(f"API call failed: {response.status} - {error_text}")
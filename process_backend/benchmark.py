@@ -0,0 +1,384 @@
+"""
+無頭視覺基準測試：在固定的畫面語料上量測模板比對與 OCR 的延遲、記憶體與準確度
+
+語料描述於 benchmark_corpus/scenes.json：每個場景是一張畫面（合成背景加上
+放在已知位置的模板/文字，或既有的截圖檔）以及 ground-truth 方框。每個模板都
+會在每個場景上比對一次；場景中沒有放置的模板視為負樣本。
+
+用法:
+    python benchmark.py                                  # 全部比對器與 OCR
+    python benchmark.py --matchers mixed --no-ocr --repeat 5 -o results.json
+    python benchmark.py -o new.json --compare old.json   # 與先前結果比較
+    python benchmark.py --matchers --ocr-engines paddle onnx  # 並列比較 OCR 引擎 (ocr_engines.py)
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional
+
+import cv2
+import numpy as np
+
+from template_match import mixed_template_match, preprocess_image, refined_template_matching
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CORPUS_PATH = os.path.join(BASE_DIR, 'benchmark_corpus', 'scenes.json')
+TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
+
+# 與 mixed_template_match 相同的信心門檻
+REFINED_THRESHOLD = 0.75
+
+
+# ----------------------------------------------------------------------
+# 語料
+# ----------------------------------------------------------------------
+def load_corpus(path: str = CORPUS_PATH) -> Dict[str, Any]:
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def render_scene(scene: Dict[str, Any], corpus_dir: str) -> np.ndarray:
+    """
+    依場景描述產生 BGR 畫面（同一描述每次產生的畫面完全相同）
+    """
+    if scene.get('source'):
+        frame = cv2.imread(os.path.normpath(os.path.join(corpus_dir, scene['source'])))
+        if frame is None:
+            raise FileNotFoundError(scene['source'])
+        return frame
+
+    width, height = scene['size']
+    background = scene.get('background', {})
+    frame = np.full((height, width, 3), background.get('color', [235, 235, 235]), dtype=np.uint8)
+    # 以固定種子畫出干擾用的方塊，讓 SIFT 有背景特徵可誤配
+    rng = np.random.default_rng(background.get('seed', 0))
+    for _ in range(background.get('distractors', 0)):
+        x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+        w, h = int(rng.integers(20, 240)), int(rng.integers(20, 240))
+        color = tuple(int(c) for c in rng.integers(150, 250, size=3))
+        cv2.rectangle(frame, (x, y), (x + w, y + h), color, -1)
+
+    for item in scene.get('templates', []):
+        template = cv2.imread(os.path.join(TEMPLATES_DIR, item['template']))
+        if template is None:
+            raise FileNotFoundError(item['template'])
+        x, y, w, h = item['box']
+        if (w, h) != (template.shape[1], template.shape[0]):
+            template = cv2.resize(template, (w, h), interpolation=cv2.INTER_AREA)
+        frame[y:y + h, x:x + w] = template
+
+    for item in scene.get('texts', []):
+        x, y, w, h = item['box']
+        cv2.putText(frame, item['text'], (x, y + h - item['baseline']), cv2.FONT_HERSHEY_SIMPLEX,
+                    item['scale'], item.get('color', [30, 30, 30]), item['thickness'], cv2.LINE_AA)
+    return frame
+
+
+def expected_boxes(scene: Dict[str, Any]) -> Dict[str, List[int]]:
+    return {item['template']: item['box'] for item in scene.get('templates', [])}
+
+
+def center_in_box(center, box, tolerance: int = 0) -> bool:
+    x, y, w, h = box
+    return (x - tolerance <= center[0] <= x + w + tolerance
+            and y - tolerance <= center[1] <= y + h + tolerance)
+
+
+# ----------------------------------------------------------------------
+# 比對器
+# ----------------------------------------------------------------------
+def match_mixed(template_path: str, frame: np.ndarray, timings: Dict[str, float]):
+    return mixed_template_match(template_path, frame=frame, timings=timings)
+
+
+def match_refined(template_path: str, frame: np.ndarray, timings: Dict[str, float]):
+    """只用 matchTemplate 搜尋整張畫面（不經過 SIFT 縮小範圍）"""
+    start = time.perf_counter()
+    template = cv2.imread(template_path)
+    searched = preprocess_image(frame)
+    timings['preprocess'] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    top_left, bottom_right, confidence = refined_template_matching(preprocess_image(template), searched)
+    timings['match'] = (time.perf_counter() - start) * 1000
+    if top_left is None or confidence < REFINED_THRESHOLD:
+        return None
+    return (int((top_left[0] + bottom_right[0]) / 2), int((top_left[1] + bottom_right[1]) / 2))
+
+
+MATCHERS: Dict[str, Callable] = {
+    'mixed': match_mixed,
+    'refined': match_refined,
+}
+
+
+# ----------------------------------------------------------------------
+# 統計
+# ----------------------------------------------------------------------
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {}
+    values = np.asarray(samples)
+    return {
+        'p50': round(float(np.percentile(values, 50)), 3),
+        'p90': round(float(np.percentile(values, 90)), 3),
+        'p99': round(float(np.percentile(values, 99)), 3),
+        'mean': round(float(values.mean()), 3),
+        'max': round(float(values.max()), 3),
+    }
+
+
+def accuracy_summary(counts: Dict[str, int]) -> Dict[str, Any]:
+    tp, fp, fn, wrong = counts['tp'], counts['fp'], counts['fn'], counts['wrong']
+    predicted = tp + fp + wrong
+    actual = tp + fn + wrong
+    total = sum(counts.values())
+    return {
+        **counts,
+        'precision': round(tp / predicted, 4) if predicted else None,
+        'recall': round(tp / actual, 4) if actual else None,
+        'accuracy': round((tp + counts['tn']) / total, 4) if total else None,
+    }
+
+
+class Measurement:
+    """收集單一比對器/OCR 設定的延遲、各階段耗時、記憶體與命中情況"""
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.stages: Dict[str, List[float]] = {}
+        self.counts = {'tp': 0, 'fp': 0, 'fn': 0, 'tn': 0, 'wrong': 0}
+        self.misses: List[Dict[str, Any]] = []
+        self.elapsed = 0.0
+        self.memory_peak = 0
+
+    def add(self, latency_ms: float, timings: Dict[str, float]) -> None:
+        self.latencies.append(latency_ms)
+        for name, value in timings.items():
+            self.stages.setdefault(name, []).append(value)
+
+    def score(self, scene: str, target: str, predicted, box: Optional[List[int]], tolerance: int) -> None:
+        if box is None:
+            outcome = 'tn' if predicted is None else 'fp'
+        elif predicted is None:
+            outcome = 'fn'
+        else:
+            outcome = 'tp' if center_in_box(predicted, box, tolerance) else 'wrong'
+        self.counts[outcome] += 1
+        if outcome in ('fp', 'fn', 'wrong'):
+            self.misses.append({
+                'scene': scene, 'target': target, 'outcome': outcome,
+                'predicted': [int(v) for v in predicted] if predicted is not None else None,
+                'expected': box,
+            })
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            'calls': len(self.latencies),
+            'latency_ms': percentiles(self.latencies),
+            'stages_ms': {name: percentiles(values) for name, values in self.stages.items()},
+            'throughput_per_s': round(len(self.latencies) / self.elapsed, 2) if self.elapsed else None,
+            'memory_peak_kb': round(self.memory_peak / 1024, 1),
+            'accuracy': accuracy_summary(self.counts),
+            'misses': self.misses,
+        }
+
+
+def measured(run: Callable[[Measurement], None]) -> Measurement:
+    """執行一組量測，記錄總耗時與 tracemalloc 記憶體峰值"""
+    measurement = Measurement()
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        run(measurement)
+    finally:
+        measurement.elapsed = time.perf_counter() - start
+        measurement.memory_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return measurement
+
+
+# ----------------------------------------------------------------------
+# 執行
+# ----------------------------------------------------------------------
+def bench_matcher(name: str, scenes: List[Dict[str, Any]], frames: Dict[str, np.ndarray],
+                  templates: List[str], repeat: int, tolerance: int) -> Dict[str, Any]:
+    matcher = MATCHERS[name]
+
+    # 預熱：填入模板特徵快取，不列入統計
+    for template in templates:
+        matcher(os.path.join(TEMPLATES_DIR, template), next(iter(frames.values())), {})
+
+    def run(measurement: Measurement) -> None:
+        for round_index in range(repeat):
+            for scene in scenes:
+                boxes = expected_boxes(scene)
+                for template in templates:
+                    timings: Dict[str, float] = {}
+                    start = time.perf_counter()
+                    predicted = matcher(os.path.join(TEMPLATES_DIR, template), frames[scene['name']], timings)
+                    measurement.add((time.perf_counter() - start) * 1000, timings)
+                    if round_index == 0:
+                        measurement.score(scene['name'], template, predicted, boxes.get(template), tolerance)
+
+    return measured(run).report()
+
+
+def bench_ocr(fx: float, scenes: List[Dict[str, Any]], frames: Dict[str, np.ndarray],
+              repeat: int, tolerance: int, engine: Optional[str] = None) -> Dict[str, Any]:
+    from ocr import OCRProcessor
+    processor = OCRProcessor(lang='ch', fx=fx, threshold=0.7, engine=engine)
+
+    def run(measurement: Measurement) -> None:
+        for round_index in range(repeat):
+            for scene in scenes:
+                texts = scene.get('texts', [])
+                if not texts:
+                    continue
+                for item in texts:
+                    timings: Dict[str, float] = {}
+                    start = time.perf_counter()
+                    result = processor.mask_ocr(image=frames[scene['name']])
+                    timings['ocr'] = (time.perf_counter() - start) * 1000
+                    found = time.perf_counter()
+                    predicted = processor.re_ocr(result, item['text'])
+                    timings['search'] = (time.perf_counter() - found) * 1000
+                    measurement.add((time.perf_counter() - start) * 1000, timings)
+                    if round_index == 0:
+                        measurement.score(scene['name'], item['text'], predicted, item['box'], tolerance)
+
+    return measured(run).report()
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR,
+                              capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def run_benchmark(matchers: List[str], ocr_fx: List[float], repeat: int = 3, tolerance: int = 10,
+                  corpus_path: str = CORPUS_PATH, scene_names: Optional[List[str]] = None,
+                  ocr_engines: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    執行基準測試
+
+    Args:
+        matchers: 要量測的比對器名稱 (MATCHERS)
+        ocr_fx: 要量測的 OCR 縮放倍率，空列表表示略過 OCR
+        repeat: 每個組合重複次數（準確度只計第一輪）
+        tolerance: 判定命中時方框向外放寬的像素
+        corpus_path: 語料描述檔
+        scene_names: 只跑指定場景
+        ocr_engines: 要量測的 OCR 引擎 (ocr_engines.ENGINES)，預設只有 paddle
+
+    Returns:
+        可寫成 JSON 的結果
+    """
+    corpus = load_corpus(corpus_path)
+    corpus_dir = os.path.dirname(os.path.abspath(corpus_path))
+    scenes = [s for s in corpus['scenes'] if not scene_names or s['name'] in scene_names]
+    frames = {scene['name']: render_scene(scene, corpus_dir) for scene in scenes}
+    templates = corpus.get('templates') or sorted(
+        f for f in os.listdir(TEMPLATES_DIR) if f.lower().endswith('.png'))
+
+    results: Dict[str, Any] = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'opencv': cv2.__version__,
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+            'cv2_threads': cv2.getNumThreads(),
+            'scenes': [scene['name'] for scene in scenes],
+            'templates': templates,
+            'repeat': repeat,
+            'tolerance': tolerance,
+        },
+        'matchers': {},
+        'ocr': {},
+    }
+
+    for name in matchers:
+        print(f"[matcher] {name} ...", flush=True)
+        results['matchers'][name] = bench_matcher(name, scenes, frames, templates, repeat, tolerance)
+
+    for engine in ocr_engines or ['paddle']:
+        for fx in ocr_fx:
+            # paddle 沿用原本的名稱，才能與舊的結果比較
+            key = f'fx={fx}' if engine == 'paddle' else f'{engine} fx={fx}'
+            print(f"[ocr] {key} ...", flush=True)
+            try:
+                results['ocr'][key] = bench_ocr(fx, scenes, frames, repeat, tolerance, engine)
+            except (ImportError, FileNotFoundError) as e:
+                results['ocr'][key] = {'skipped': f'OCR unavailable: {e}'}
+
+    results['meta']['max_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return results
+
+
+# ----------------------------------------------------------------------
+# 輸出
+# ----------------------------------------------------------------------
+def print_summary(results: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> None:
+    for group in ('matchers', 'ocr'):
+        for name, report in results[group].items():
+            if 'skipped' in report:
+                print(f"{group[:-1] if group == 'matchers' else group} {name}: {report['skipped']}")
+                continue
+            latency, accuracy = report['latency_ms'], report['accuracy']
+            line = (f"{name:>10}  p50 {latency['p50']:8.1f}ms  p90 {latency['p90']:8.1f}ms  "
+                    f"p99 {latency['p99']:8.1f}ms  {report['throughput_per_s']:7.1f}/s  "
+                    f"peak {report['memory_peak_kb']:9.1f}KB  "
+                    f"P {accuracy['precision']}  R {accuracy['recall']}")
+            previous = (baseline or {}).get(group, {}).get(name)
+            if previous and 'latency_ms' in previous:
+                change = (latency['p50'] - previous['latency_ms']['p50']) / max(previous['latency_ms']['p50'], 1e-9)
+                line += f"  (p50 {change:+.1%} vs {baseline['meta'].get('commit')}"
+                if previous['accuracy']['recall'] != accuracy['recall']:
+                    line += f", recall {previous['accuracy']['recall']} -> {accuracy['recall']}"
+                line += ")"
+            print(line)
+            for stage, values in report['stages_ms'].items():
+                print(f"{'':>12}{stage:<12} p50 {values['p50']:8.2f}ms  p90 {values['p90']:8.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Headless benchmark of template matching and OCR')
+    parser.add_argument('--matchers', nargs='*', default=list(MATCHERS), choices=list(MATCHERS))
+    parser.add_argument('--ocr-fx', nargs='*', type=float, default=[0.5, 1.0], help='OCR scale factors to test')
+    parser.add_argument('--no-ocr', action='store_true', help='skip OCR configurations')
+    parser.add_argument('--ocr-engines', nargs='*', default=['paddle'], help='OCR engines to compare (ocr_engines.py)')
+    parser.add_argument('--scenes', nargs='*', help='only run these scenes')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--tolerance', type=int, default=10, help='pixels a hit may fall outside its box')
+    parser.add_argument('--corpus', default=CORPUS_PATH)
+    parser.add_argument('-o', '--output', help='write results as JSON')
+    parser.add_argument('--compare', help='previous results JSON to compare against')
+    args = parser.parse_args()
+
+    results = run_benchmark(args.matchers, [] if args.no_ocr else args.ocr_fx, args.repeat,
+                            args.tolerance, args.corpus, args.scenes, args.ocr_engines)
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_summary(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+"""
+一次腳本執行的狀態：裝置、畫面來源、視覺快取與結果槽
+
+BlocklyScriptExecutor 本身不保存執行中的狀態，每次 execute 建立一個 ExecutionContext
+並傳給每個步驟，同一個行程中可同時執行多個腳本（/execute 與工作佇列），彼此不共用
+結果也不會讀到對方擷取的畫面：
+
+- 畫面：refresh_frame 擷取後立即以 pin_frame 固定這次的畫面（只讀位元組，數毫秒），
+  之後這個步驟的模板比對與 OCR 都使用這張畫面，不再重讀共用的截圖檔
+- 視覺快取：畫面的衍生結果（SIFT 特徵、OCR）掛在 Frame 上（frame_cache），
+  內容相同的畫面在各腳本之間共用；模板特徵、裝置縮放、文字位置等全域快取本身是執行緒安全的
+- 結果槽：find_* 的結果供之後的 click_object / click_nth 使用
+
+熱路徑上不需要鎖：context 只由所屬腳本的協程存取，視覺計算在執行緒池中只讀取固定的畫面。
+"""
+import asyncio
+from typing import Any, Dict, List, Optional, Set
+
+from frame_cache import Frame, FrameCache, screen_frames
+
+# ADB API 寫入的截圖檔（以 process_backend 為工作目錄）
+SCREENSHOT_PATH = '../adb_backend/screenshots/screenshot.png'
+
+
+class ScreenshotSource:
+    """從 ADB API 寫入的截圖檔讀取畫面（依內容快取，見 frame_cache）"""
+
+    def __init__(self, path: str = SCREENSHOT_PATH, cache: FrameCache = screen_frames):
+        self.path = path
+        self.cache = cache
+
+    def load(self) -> Optional[Frame]:
+        return self.cache.load(self.path)
+
+
+class ExecutionContext:
+    """一次執行的裝置、畫面與結果"""
+
+    def __init__(self, device: str = 'default', frames: Optional[ScreenshotSource] = None):
+        """
+        Args:
+            device: 裝置名稱（執行紀錄與工作佇列使用）
+            frames: 畫面來源，預設為 ADB API 的截圖檔
+        """
+        self.device = device
+        self.frames = frames or ScreenshotSource()
+        # 目前步驟使用的畫面（pin_frame 固定）
+        self.frame: Optional[Frame] = None
+        # 目前裝置的 /screen/info，每次執行查詢一次
+        self.screen_info: Optional[Dict[str, Any]] = None
+
+        # 結果槽
+        self.results: List[Dict[str, Any]] = []
+        self.errors: List[str] = []
+        self.template_pos = [0, 0]
+        # find_all_template 找到的所有位置（閱讀順序），供 click_nth 使用
+        self.template_matches: List[Dict[str, Any]] = []
+        self.ocr_pos = [0, 0]
+        self.element_pos = [0, 0]
+
+        # 預取中的背景工作與已預取的模板
+        self.prefetch_tasks: Set[asyncio.Task] = set()
+        self.prefetched: Set[str] = set()
+
+    def pin_frame(self) -> Frame:
+        """
+        固定目前的截圖作為之後視覺步驟的畫面（擷取後立即呼叫）
+
+        讀不到截圖檔時拋出 FileNotFoundError，不改用舊的畫面
+        """
+        frame = self.frames.load()
+        if frame is None:
+            raise FileNotFoundError(f"Screenshot unavailable: {self.frames.path}")
+        self.frame = frame
+        return frame
+
+    def current_frame(self) -> Frame:
+        """目前固定的畫面；還沒擷取過時讀取現有的截圖"""
+        if self.frame is None:
+            self.pin_frame()
+        return self.frame
+
+    def spawn(self, coro) -> asyncio.Task:
+        """建立屬於這次執行的背景工作，執行結束時由 cancel_tasks 取消"""
+        task = asyncio.create_task(coro)
+        self.prefetch_tasks.add(task)
+        task.add_done_callback(self.prefetch_tasks.discard)
+        return task
+
+    def cancel_tasks(self) -> None:
+        for task in list(self.prefetch_tasks):
+            task.cancel()
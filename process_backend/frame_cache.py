@@ -0,0 +1,118 @@
+"""
+截圖依內容識別，同一張畫面只解碼一次，衍生結果（SIFT 特徵、OCR 結果）也只算一次
+
+ADB API 每次擷取都會重寫截圖檔，畫面沒變時內容（PNG 位元組）相同。以 crc32 + 長度
+識別畫面：check_* 輪詢靜止的畫面、或預取（見 api.py 的 prefetch）已處理過這張畫面時，
+直接取用之前的結果；同一張畫面的同一種結果正在計算時，其他呼叫端等待而不重算。
+
+用法:
+    frame = screen_frames.load(path)
+    features = frame.derive('sift', compute_frame_features)
+"""
+import threading
+import zlib
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+
+
+class Frame:
+    """一張畫面（截圖檔的內容）與其衍生結果；第一次取用 image 時才解碼"""
+
+    def __init__(self, key: Tuple[int, int], data: bytes):
+        self.key = key
+        self._data: Optional[bytes] = data
+        self._derived: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def image(self) -> Optional[np.ndarray]:
+        """BGR 畫面，無法解碼時為 None"""
+        return self._once('image', self._decode)
+
+    def _decode(self) -> Optional[np.ndarray]:
+        image = cv2.imdecode(np.frombuffer(self._data, np.uint8), cv2.IMREAD_COLOR)
+        self._data = None
+        return image
+
+    def derive(self, name: str, compute: Callable[[np.ndarray], Any]) -> Any:
+        """
+        取得這張畫面的衍生結果，沒有時以 compute(image) 計算並保存
+
+        同一個 name 只計算一次；計算中的結果其他執行緒等待取用，計算失敗時不保存
+        """
+        return self._once(name, lambda: compute(self.image))
+
+    def _once(self, name: str, compute: Callable[[], Any]) -> Any:
+        with self._lock:
+            future = self._derived.get(name)
+            owner = future is None
+            if owner:
+                future = self._derived[name] = Future()
+        if not owner:
+            return future.result()
+        try:
+            value = compute()
+        except BaseException as e:
+            with self._lock:
+                self._derived.pop(name, None)
+            future.set_exception(e)
+            raise
+        future.set_result(value)
+        return value
+
+    def peek(self, name: str) -> Any:
+        """已算好的衍生結果，沒有或仍在計算時回傳 None（不等待）"""
+        with self._lock:
+            future = self._derived.get(name)
+        if future is None or not future.done() or future.exception() is not None:
+            return None
+        return future.result()
+
+
+class FrameCache:
+    """最近幾張畫面（依內容），讀檔與 crc32 約數毫秒，解碼與衍生結果只算一次"""
+
+    def __init__(self, max_frames: int = 3):
+        self.max_frames = max_frames
+        self._frames: 'OrderedDict[Tuple[int, int], Frame]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0}
+
+    def load(self, path: str) -> Optional[Frame]:
+        """
+        讀取截圖檔（只讀位元組，不解碼）；讀不到或是空檔時回傳 None
+
+        在事件迴圈中呼叫也只需數毫秒，擷取後立即呼叫即可固定這次擷取的畫面
+        """
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        return self._lookup(data) if data else None
+
+    def _lookup(self, data: bytes) -> Frame:
+        key = (zlib.crc32(data), len(data))
+        with self._lock:
+            frame = self._frames.get(key)
+            if frame is not None:
+                self.stats['hits'] += 1
+            else:
+                self.stats['misses'] += 1
+                frame = self._frames[key] = Frame(key, data)
+            self._frames.move_to_end(key)
+            while len(self._frames) > self.max_frames:
+                self._frames.popitem(last=False)
+        return frame
+
+    def clear(self) -> None:
+        with self._lock:
+            self._frames.clear()
+
+
+# 截圖檔共用的快取（模板比對與 OCR 讀同一個檔案）
+screen_frames = FrameCache()
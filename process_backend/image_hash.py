@@ -0,0 +1,127 @@
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+HASH_SIZE = 8
+_DCT_SIZE = 32
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+_DCT = _dct_matrix(_DCT_SIZE)
+
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    value = 0
+    for bit in bits.ravel():
+        value = (value << 1) | int(bit)
+    return value
+
+
+def perceptual_hash(img: Image.Image) -> int:
+    """
+    64 位元 pHash：32x32 灰階圖的 DCT 低頻 8x8 係數與中位數比較
+
+    對縮放、輕微壓縮與亮度變化不敏感。
+    """
+    gray = np.asarray(img.convert('L').resize((_DCT_SIZE, _DCT_SIZE), Image.BILINEAR), dtype=np.float64)
+    coefficients = (_DCT @ gray @ _DCT.T)[:HASH_SIZE, :HASH_SIZE]
+    median = np.median(coefficients.ravel()[1:])  # 不含直流分量
+    return _bits_to_int(coefficients > median)
+
+
+def difference_hash(img: Image.Image) -> int:
+    """64 位元 dHash：相鄰像素亮度梯度的方向，補足 pHash 對結構的描述"""
+    gray = np.asarray(img.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR), dtype=np.int16)
+    return _bits_to_int(gray[:, 1:] > gray[:, :-1])
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+def to_hex(value: int) -> str:
+    return f"{value:016x}"
+
+
+def from_hex(value: str) -> int:
+    return int(value, 16)
+
+
+class BKTree:
+    """
+    以漢明距離建立的 BK-tree，用來找出距離 <= radius 的雜湊
+
+    查詢只走訪距離在 [d - radius, d + radius] 的子樹，模板數量上千時
+    仍只需比較一小部分節點。
+    """
+
+    def __init__(self):
+        # node: [hash, [ids], {distance: child}]
+        self._root: Optional[list] = None
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, value: int, item: str) -> None:
+        self._size += 1
+        if self._root is None:
+            self._root = [value, [item], {}]
+            return
+        node = self._root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [item], {}]
+                return
+            node = child
+
+    def remove(self, value: int, item: str) -> None:
+        """移除項目（節點保留，作為其他雜湊的路徑）"""
+        node = self._root
+        while node is not None:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                if item in node[1]:
+                    node[1].remove(item)
+                    self._size -= 1
+                return
+            node = node[2].get(distance)
+
+    def search(self, value: int, radius: int) -> List[Tuple[int, str]]:
+        """
+        Returns:
+            [(距離, 項目)]，依距離排序
+        """
+        results = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= radius:
+                results.extend((distance, item) for item in node[1])
+            for child_distance, child in node[2].items():
+                if distance - radius <= child_distance <= distance + radius:
+                    stack.append(child)
+        return sorted(results)
+
+
+def image_fingerprint(path: str) -> Dict[str, str]:
+    """計算圖片的 pHash 與 dHash（十六進位字串，方便存入 SQLite）"""
+    with Image.open(path) as img:
+        return {
+            'phash': to_hex(perceptual_hash(img)),
+            'dhash': to_hex(difference_hash(img)),
+        }
@@ -0,0 +1,234 @@
+"""
+非同步腳本工作：送出後立即回傳 job id，進度以事件串流（SSE）推送
+
+每台裝置一個佇列，同一台裝置上的腳本依序執行，不同裝置可同時進行
+（總數受 max_concurrent 限制）。工作可在排隊或執行中取消。
+
+用法:
+    manager = JobManager(run_job)          # run_job(job) -> 結果 dict，過程中呼叫 job.step(...)
+    job = manager.submit(code, device='emulator-5554')
+    async for event in manager.events(job):
+        ...
+"""
+import asyncio
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class QueueFullError(Exception):
+    """排隊中的工作已達上限"""
+
+
+class Job:
+    """一次腳本執行；events 保留完整事件，晚到的訂閱者也能從頭讀取"""
+
+    def __init__(self, code: str, device: str, record: bool = False):
+        self.job_id = uuid.uuid4().hex[:12]
+        self.code = code
+        self.device = device
+        self.record = record
+        self.status = QUEUED
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.total_steps: Optional[int] = None
+        self.steps: List[Dict[str, Any]] = []
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.events: List[Dict[str, Any]] = []
+        self._changed = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATES
+
+    def publish(self, event_type: str, **data) -> None:
+        self.events.append({'type': event_type, 'job_id': self.job_id, 'time': time.time(), **data})
+        # 換一個新的 Event 再喚醒等待者，等待者醒來後讀取新事件
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def step(self, index: int, total: int, entry: Dict[str, Any], duration_ms: float) -> None:
+        """執行器每完成一個函數呼叫一次"""
+        self.total_steps = total
+        step = {'step': index, 'total': total, 'duration_ms': round(duration_ms, 1), **entry}
+        self.steps.append(step)
+        self.publish('step', **step)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            'job_id': self.job_id,
+            'device': self.device,
+            'status': self.status,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'completed_steps': len(self.steps),
+            'total_steps': self.total_steps,
+            'error': self.error,
+        }
+
+    def detail(self) -> Dict[str, Any]:
+        return {**self.summary(), 'code': self.code, 'steps': self.steps, 'result': self.result}
+
+
+class JobManager:
+    """每台裝置一個佇列與一個 worker；工作結束後保留最近 keep_finished 筆供查詢"""
+
+    def __init__(self, run_job: Callable[[Job], Awaitable[Dict[str, Any]]],
+                 max_queued: int = 100, max_concurrent: int = 4, keep_finished: int = 200):
+        """
+        Args:
+            run_job: 執行一個工作並回傳結果 dict（例如 ExecutionResult 的內容）
+            max_queued: 所有裝置合計的排隊上限，超過時 submit 丟出 QueueFullError
+            max_concurrent: 同時執行的工作數上限（跨裝置）
+            keep_finished: 保留多少已結束的工作
+        """
+        self.run_job = run_job
+        self.max_queued = max_queued
+        self.max_concurrent = max_concurrent
+        self.keep_finished = keep_finished
+        self._jobs: 'OrderedDict[str, Job]' = OrderedDict()
+        self._queues: Dict[str, Deque[Job]] = {}
+        self._wakeups: Dict[str, asyncio.Event] = {}
+        self._workers: Dict[str, asyncio.Task] = {}
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    def queued_count(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    def submit(self, code: str, device: str = 'default', record: bool = False) -> Job:
+        """排入工作並回傳；需在事件迴圈中呼叫"""
+        if self.queued_count() >= self.max_queued:
+            raise QueueFullError(f"{self.max_queued} jobs already queued")
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrent)
+
+        job = Job(code, device, record)
+        self._jobs[job.job_id] = job
+        queue = self._queues.setdefault(device, deque())
+        queue.append(job)
+        job.publish(QUEUED, device=device, position=len(queue))
+
+        worker = self._workers.get(device)
+        if worker is None or worker.done():
+            self._wakeups[device] = asyncio.Event()
+            self._workers[device] = asyncio.get_running_loop().create_task(
+                self._worker(device), name=f"jobs-{device}")
+        self._wakeups[device].set()
+        self._prune()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def list_jobs(self, status: Optional[str] = None, device: Optional[str] = None) -> List[Dict[str, Any]]:
+        return [job.summary() for job in reversed(self._jobs.values())
+                if (status is None or job.status == status) and (device is None or job.device == device)]
+
+    def position(self, job: Job) -> Optional[int]:
+        """排隊中的順位（1 起算），不在佇列中回傳 None"""
+        queue = self._queues.get(job.device, ())
+        for position, queued in enumerate(queue, start=1):
+            if queued is job:
+                return position
+        return None
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """取消工作；排隊中直接移除，執行中則取消其 task（於下一個 await 生效）"""
+        job = self._jobs.get(job_id)
+        if job is None or job.finished:
+            return job
+        if job.status == QUEUED:
+            self._queues[job.device].remove(job)
+            self._finish(job, CANCELLED)
+        elif job._task:
+            job._task.cancel()
+        return job
+
+    async def events(self, job: Job, keepalive: float = 15.0) -> AsyncIterator[Optional[Dict[str, Any]]]:
+        """
+        依序產生工作的事件，從第一個事件開始，工作結束後停止
+
+        超過 keepalive 秒沒有事件時產生 None，讓串流端送出心跳
+        """
+        index = 0
+        while True:
+            changed = job._changed
+            while index < len(job.events):
+                yield job.events[index]
+                index += 1
+            if job.finished:
+                return
+            try:
+                await asyncio.wait_for(changed.wait(), timeout=keepalive)
+            except asyncio.TimeoutError:
+                yield None
+
+    async def shutdown(self) -> None:
+        """取消所有排隊與執行中的工作"""
+        for job in list(self._jobs.values()):
+            self.cancel(job.job_id)
+        workers = list(self._workers.values())
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        self._workers.clear()
+
+    async def _worker(self, device: str) -> None:
+        queue = self._queues[device]
+        wakeup = self._wakeups[device]
+        while True:
+            if not queue:
+                wakeup.clear()
+                await wakeup.wait()
+                continue
+            async with self._slots:
+                if not queue:
+                    continue
+                job = queue.popleft()
+                # 離開佇列的同時標記為執行中，cancel 不會再到佇列中找它
+                job.status = RUNNING
+                job.started_at = time.time()
+                job.publish(RUNNING)
+                for position, queued in enumerate(queue, start=1):
+                    queued.publish('position', position=position)
+                # 工作在自己的 task 中執行；asyncio.wait 不因工作被取消而拋出，worker 繼續處理下一個
+                job._task = asyncio.create_task(self._run(job), name=f"job-{job.job_id}")
+                await asyncio.wait([job._task])
+                if not job.finished:
+                    # task 在開始執行前就被取消，_run 沒有機會收尾
+                    self._finish(job, CANCELLED)
+
+    async def _run(self, job: Job) -> None:
+        try:
+            job.result = await self.run_job(job)
+        except asyncio.CancelledError:
+            self._finish(job, CANCELLED)
+            return
+        except Exception as e:
+            job.error = str(e)
+            self._finish(job, FAILED)
+            return
+        self._finish(job, SUCCEEDED if job.result.get('success', True) else FAILED)
+
+    def _finish(self, job: Job, status: str) -> None:
+        job.status = status
+        job.finished_at = time.time()
+        job.publish('finished', status=status, error=job.error,
+                     success=job.result.get('success') if job.result else False)
+
+    def _prune(self) -> None:
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(len(finished) - self.keep_finished, 0)]:
+            del self._jobs[job_id]
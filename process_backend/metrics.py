@@ -0,0 +1,110 @@
+"""
+Process backend 的 Prometheus 指標，提供給 `/metrics`
+
+腳本、步驟、ADB API 往返與視覺階段的延遲直接取自每次執行的 profiler Trace
+（observe_trace），不必在各處重複量測。
+"""
+from typing import Any, Dict
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+import template_match
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+SCRIPTS = Counter('mqa_scripts_total', 'Executed Blockly scripts', ['result'])
+SCRIPTS_IN_FLIGHT = Gauge('mqa_scripts_in_flight', 'Scripts currently executing')
+SCRIPT_SECONDS = Histogram('mqa_script_seconds', 'Script execution time',
+                           buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0))
+STEP_SECONDS = Histogram('mqa_step_seconds', 'Blockly function execution time', ['function', 'result'],
+                         buckets=LATENCY_BUCKETS)
+ADB_API_SECONDS = Histogram('mqa_adb_api_request_seconds', 'ADB API round trip', ['endpoint'],
+                            buckets=LATENCY_BUCKETS)
+VISION_SECONDS = Histogram('mqa_vision_seconds', 'Template matching / OCR time by stage', ['stage'],
+                           buckets=LATENCY_BUCKETS)
+VISION_RESULTS = Counter('mqa_vision_results_total', 'Template/text/UI element searches by outcome', ['kind', 'result'])
+LOOP_LAG_SECONDS = Histogram(
+    'mqa_event_loop_lag_seconds', 'How late a periodic asyncio.sleep woke up',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+LOOP_BLOCKS = Counter('mqa_event_loop_blocks_total', 'Times the event loop was blocked past the threshold',
+                      ['function'])
+LOOP_BLOCK_SECONDS = Histogram(
+    'mqa_event_loop_block_seconds', 'Duration of event-loop blocks',
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0))
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+
+def observe_trace(trace, success: bool) -> None:
+    """把一次執行的 span 轉成直方圖觀測值"""
+    SCRIPTS.labels('success' if success else 'failure').inc()
+    summary = trace.summary()
+    SCRIPT_SECONDS.observe(summary['total_ms'] / 1000)
+
+    for s in trace.spans:
+        seconds = s['dur_ms'] / 1000
+        attrs: Dict[str, Any] = s.get('attrs', {})
+        if s['cat'] == 'step':
+            STEP_SECONDS.labels(s['name'], 'error' if 'error' in attrs else 'ok').observe(seconds)
+        elif s['cat'] == 'http':
+            # 名稱為 "POST /input/click"，路徑中沒有變數，標籤數量有限
+            ADB_API_SECONDS.labels(s['name']).observe(seconds)
+        elif s['cat'] == 'vision':
+            VISION_SECONDS.labels(s['name']).observe(seconds)
+            if 'found' in attrs:
+                kind = {'text_search': 'text', 'ui_find': 'element'}.get(s['name'], 'template')
+                VISION_RESULTS.labels(kind, 'found' if attrs['found'] else 'missing').inc()
+
+
+def observe_block(block: Dict[str, Any]) -> None:
+    """BlockDetector 的阻塞事件；以 Blockly 函數為標籤（端點路徑含模板名稱，數量不固定）"""
+    LOOP_BLOCKS.labels(block['tags'].get('function', 'none')).inc()
+    LOOP_BLOCK_SECONDS.observe(block['duration_ms'] / 1000)
+
+
+class CacheCollector:
+    """模板特徵快取命中率，於抓取時讀取"""
+
+    def collect(self):
+        stats = template_match.cache_stats
+        cache = CounterMetricFamily('mqa_template_feature_cache_requests', 'Template feature cache lookups',
+                                    labels=['result'])
+        cache.add_metric(['hit'], stats['hits'])
+        cache.add_metric(['miss'], stats['misses'])
+        yield cache
+        yield GaugeMetricFamily('mqa_template_feature_cache_entries', 'Templates with cached features',
+                                value=len(template_match._template_cache))
+
+
+REGISTRY.register(CacheCollector())
+
+
+class ThreadBudgetCollector:
+    """視覺 / OCR 執行緒池的排隊與執行中數量、累計等待與執行時間"""
+
+    def __init__(self, budget):
+        self.budget = budget
+
+    def collect(self):
+        pools = self.budget.status()['pools']
+        waiting = GaugeMetricFamily('mqa_thread_pool_waiting', 'Calls queued for a compute pool', labels=['pool'])
+        running = GaugeMetricFamily('mqa_thread_pool_running', 'Calls running in a compute pool', labels=['pool'])
+        completed = CounterMetricFamily('mqa_thread_pool_calls', 'Calls finished by a compute pool', labels=['pool'])
+        wait = CounterMetricFamily('mqa_thread_pool_wait_seconds', 'Time calls spent queued', labels=['pool'])
+        busy = CounterMetricFamily('mqa_thread_pool_busy_seconds', 'Time calls spent running', labels=['pool'])
+        for name, stats in pools.items():
+            waiting.add_metric([name], stats['waiting'])
+            running.add_metric([name], stats['running'])
+            completed.add_metric([name], stats['completed'])
+            wait.add_metric([name], stats['wait_seconds'])
+            busy.add_metric([name], stats['busy_seconds'])
+        yield from (waiting, running, completed, wait, busy)
+
+
+def register_thread_budget(budget) -> None:
+    REGISTRY.register(ThreadBudgetCollector(budget))
+
+
+def render() -> bytes:
+    return generate_latest(REGISTRY)
@@ -1,36 +1,38 @@
 import cv2
-from paddleocr import PaddleOCR
+from ocr_engines import OCREngine, create_engine
 import numpy as np
-import re
+import threading
 import time
+from collections import OrderedDict
 from typing import List, Optional, Tuple
+from text_query import TextIndex
 
 
 class OCRProcessor:
-    def __init__(self, lang='en', fx = 0.5, threshold=0.7, use_angle_cls=False):
+    # 只辨識已知位置時，框向外多取的像素（縮放後的畫面），容許文字稍微移動或變長
+    BOX_PADDING = 4
+
+    def __init__(self, lang='en', fx = 0.5, threshold=0.7, use_angle_cls=False, cpu_threads=None, engine=None):
         """
         初始化 OCR 處理器 - 預加載模型以提升性能
         :param lang: 語言模型 (默認 'en')
         :param threshold: OCR 結果的可信度閾值 (默認 0.7)
         :param use_angle_cls: 是否使用角度分類器 (默認 True)
         :param use_gpu: 是否使用 GPU 加速 (默認 False)
+        :param cpu_threads: 推論使用的 CPU 執行緒數 (默認由引擎決定，見 thread_budget.py)
+        :param engine: 引擎名稱 ('paddle' / 'onnx') 或 OCREngine 實例 (默認取 MQA_OCR_ENGINE，見 ocr_engines.py)
         """
         self.lang = lang
         self.threshold = threshold
         self.use_angle_cls = use_angle_cls
+        # 建立後只讀：畫面由呼叫端傳入（見 execution_context.py），多個腳本可同時使用同一個實例
         self.fx = fx
-        self.path = '../adb_backend/screenshots/screenshot.png'
-        self.path1 = '../adb_backend/screenshots/screenshot1.png'
         
         # 預加載 OCR 模型
         print("Loading OCR model...")
         start_time = time.time()
-        self.ocr = PaddleOCR(
-            lang=self.lang,
-            use_doc_orientation_classify=False,
-            use_doc_unwarping=False,
-            use_textline_orientation=False
-        )
+        self.engine = engine if isinstance(engine, OCREngine) else create_engine(engine, lang=self.lang,
+                                                                                  cpu_threads=cpu_threads)
         load_time = time.time() - start_time
         print(f"OCR model loaded in {load_time:.2f} seconds")
         
@@ -45,7 +47,7 @@ class OCRProcessor:
         # 創建一個小的測試圖像
         dummy_image = np.ones((100, 100, 3), dtype=np.uint8) * 255
         try:
-            self.ocr.ocr(dummy_image)
+            self.engine.ocr(dummy_image)
             print("OCR model warmed up successfully")
         except Exception as e:
             print(f"Warmup failed: {e}")
@@ -54,13 +56,13 @@ class OCRProcessor:
         """
         析構函數 - 清理資源
         """
-        if hasattr(self, 'ocr'):
-            del self.ocr
+        if hasattr(self, 'engine'):
+            del self.engine
 
     def preprocess_image(self, image):
         # 轉為灰階圖像 (保持原始邏輯)
         #gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        if self.fx is not 1:
+        if self.fx != 1:
             image = cv2.resize(image, None, fx=self.fx, fy=self.fx, interpolation=cv2.INTER_AREA)
         return image
     
@@ -74,34 +76,81 @@ class OCRProcessor:
 
         return [int(avg_x), int(avg_y)]
         
-    def mask_ocr(self, mask=None):
-        image = cv2.imread(self.path)
+    def mask_ocr(self, image, mask=None):
+        """
+        完整的文字偵測 + 辨識
+
+        :param image: BGR 畫面（例如 ExecutionContext 固定的畫面、錄影回放）
+        :param mask: {'x0', 'y0', 'x1', 'y1'} 範圍內塗黑後再辨識（不修改呼叫端的畫面）
+        """
         if image is None:
-            image = cv2.imread(self.path1)
-        
+            return None
         if mask is not None:
+            image = image.copy()
             try:
                 image[mask['y0']:mask['y1'], mask['x0']:mask['x1']] = [0, 0, 0]
             except:
                 print("illegal mask")
         image = self.preprocess_image(image)
-        result = self.ocr.ocr(image)
-        if result[0] is not None:
-            line = result[0]
+        line = self.engine.ocr(image)
+        if line is not None:
             print('ok')
             return line
         else:
             return None
         
-    def re_ocr(self, result, goal):
-        if result is None:
+    def recognize_boxes(self, boxes, image):
+        """
+        只辨識已知位置的文字，不做文字偵測
+
+        :param boxes: 先前 mask_ocr 結果中的 rec_boxes（縮放後畫面的座標）
+        :param image: BGR 畫面
+        :return: 與 mask_ocr 相同格式的結果，沒有可辨識的框時回傳 None
+        """
+        if image is None:
+            return None
+        image = self.preprocess_image(image)
+        h, w = image.shape[:2]
+        crops, kept = [], []
+        for box in boxes:
+            x1, y1, x2, y2 = (int(v) for v in box)
+            x1, y1 = max(x1 - self.BOX_PADDING, 0), max(y1 - self.BOX_PADDING, 0)
+            x2, y2 = min(x2 + self.BOX_PADDING, w), min(y2 + self.BOX_PADDING, h)
+            if x2 - x1 < 2 or y2 - y1 < 2:
+                continue
+            crops.append(image[y1:y2, x1:x2])
+            kept.append([x1, y1, x2, y2])
+        if not crops:
+            return None
+        texts, scores = self.engine.recognize(crops)
+        return {'rec_texts': texts, 'rec_scores': scores, 'rec_boxes': np.array(kept, dtype=np.int32)}
+
+    def re_ocr(self, result, goal, fuzzy=False):
+        """
+        在 OCR 結果中找 goal（正則），回傳最佳結果的中心點（原圖座標）
+
+        沒有完全相符時比對正規化後的文字；fuzzy 時再容許增刪改字（見 text_query）
+        """
+        hit = TextIndex.of(result).best(goal, fuzzy)
+        if hit is None:
             return None
-        for text, coords in zip(result['rec_texts'], result['rec_boxes']):
-            if re.search(goal, text):
-                print(f"table: {text}")
-                goal_pt = self.interpot(coords)
-                return [pt / self.fx for pt in goal_pt]
-        return None
+        print(f"table: {hit.text}")
+        return [pt / self.fx for pt in hit.center]
+
+    def query_ocr(self, result, goals, fuzzy=False):
+        """
+        一次查詢多個目標，每個目標回傳所有結果（最好的在前）
+
+        Returns:
+            {goal: [{'text', 'x', 'y', 'box', 'score', 'similarity', 'exact'}, ...]}
+        """
+        found = TextIndex.of(result).search_many(goals, fuzzy)
+        return {goal: [{'text': hit.text,
+                        'x': int(hit.center[0] / self.fx), 'y': int(hit.center[1] / self.fx),
+                        'box': [int(v / self.fx) for v in hit.box],
+                        'score': round(hit.ocr_score, 4), 'similarity': hit.similarity, 'exact': hit.exact}
+                       for hit in hits]
+                for goal, hits in found.items()}
    
     def get_model_info(self):
         """
@@ -111,10 +160,63 @@ class OCRProcessor:
             'language': self.lang,
             'threshold': self.threshold,
             'use_angle_cls': self.use_angle_cls,
-            'model_loaded': hasattr(self, 'ocr')
+            'model_loaded': hasattr(self, 'engine'),
+            **(self.engine.info() if hasattr(self, 'engine') else {})
         }
 
 
+class TextLayoutCache:
+    """
+    各畫面上一次完整 OCR 讀到的文字與位置，以 (裝置, app, activity) 為鍵
+
+    同一個畫面上的文字多半在固定位置：找文字時先只辨識之前讀到相符文字的框
+    （一批送入辨識模型），找不到再做完整的偵測 + 辨識並更新這裡的位置。
+    """
+
+    def __init__(self, max_screens=200):
+        self.max_screens = max_screens
+        self._layouts = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'full': 0}
+
+    def store(self, key, result):
+        """記住一次完整 OCR 的結果（mask_ocr 的回傳值）"""
+        if result is None:
+            return
+        layout = (TextIndex(result), np.asarray(result['rec_boxes']).reshape(-1, 4))
+        with self._lock:
+            self._layouts[key] = layout
+            self._layouts.move_to_end(key)
+            while len(self._layouts) > self.max_screens:
+                self._layouts.popitem(last=False)
+
+    def candidates(self, key, goal, fuzzy=False):
+        """這個畫面上之前讀到的文字符合 goal 的框"""
+        with self._lock:
+            layout = self._layouts.get(key)
+        if layout is None:
+            return []
+        index, boxes = layout
+        return [boxes[hit.index] for hit in index.search(goal, fuzzy)]
+
+    def record(self, outcome):
+        """outcome: 'hits'（只辨識就找到）、'misses'（只辨識沒找到）或 'full'（沒有可用的位置）"""
+        with self._lock:
+            self.stats[outcome] += 1
+
+    def clear(self):
+        with self._lock:
+            self._layouts.clear()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'stats': dict(self.stats),
+                'screens': [{'device': key[0], 'app': key[1], 'activity': key[2], 'texts': len(index)}
+                            for key, (index, _) in self._layouts.items()],
+            }
+
+
 if __name__ == "__main__":
     # 創建 OCR 處理器實例 - 模型會在初始化時預加載
     fx = 0.5
@@ -0,0 +1,483 @@
+"""
+OCR 推論引擎：OCRProcessor 透過這裡的介面呼叫模型，不直接依賴 PaddleOCR
+
+引擎的 ocr(image) 回傳與 PaddleOCR 相同格式的結果（rec_texts、rec_scores、
+rec_boxes、rec_polys），re_ocr 與呼叫端不必知道用的是哪一個引擎。
+
+引擎:
+    paddle  PaddleOCR 預設的 Paddle 推論（預設）
+    onnx    匯出成 ONNX 的 PP-OCR 偵測/辨識模型，以 ONNX Runtime 執行
+            （可用 INT8 量化權重；裝有 onnxruntime-openvino 時可用 OpenVINO）
+
+MQA_OCR_ENGINE 選擇引擎，MQA_OCR_ONNX_DIR 為 ONNX 模型目錄（預設 models/ocr_onnx），
+MQA_OCR_PROVIDER 選擇 ONNX Runtime 的執行裝置（cpu / openvino）。
+
+匯出 ONNX 模型（需要 paddlex 的 paddle2onnx 外掛與 onnxruntime）:
+    python ocr_engines.py export -o models/ocr_onnx
+    python ocr_engines.py export --det ~/.paddlex/official_models/PP-OCRv5_server_det \\
+        --rec ~/.paddlex/official_models/PP-OCRv5_server_rec --quantize rec
+
+並列比較引擎:
+    python benchmark.py --matchers --ocr-engines paddle onnx
+"""
+import argparse
+import json
+import math
+import os
+import shutil
+import subprocess
+import tempfile
+from typing import Any, Dict, List, Optional
+
+import cv2
+import numpy as np
+
+ENGINE_ENV = 'MQA_OCR_ENGINE'
+ONNX_DIR_ENV = 'MQA_OCR_ONNX_DIR'
+PROVIDER_ENV = 'MQA_OCR_PROVIDER'
+DEFAULT_ONNX_DIR = os.path.join('models', 'ocr_onnx')
+MANIFEST = 'manifest.json'
+
+# PaddleOCR 3.x lang='ch' 預設下載的模型
+PADDLEX_MODELS_DIR = os.path.join(os.path.expanduser('~'), '.paddlex', 'official_models')
+DEFAULT_DET_MODEL = 'PP-OCRv5_server_det'
+DEFAULT_REC_MODEL = 'PP-OCRv5_server_rec'
+
+ONNX_PROVIDERS = {
+    'cpu': ['CPUExecutionProvider'],
+    'openvino': ['OpenVINOExecutionProvider', 'CPUExecutionProvider'],
+}
+
+
+class OCREngine:
+    """OCR 引擎介面"""
+
+    name = 'base'
+
+    def ocr(self, image: np.ndarray) -> Optional[Dict[str, Any]]:
+        """
+        辨識 BGR 畫面中的文字
+
+        Returns:
+            {'rec_texts': [...], 'rec_scores': [...], 'rec_boxes': (N, 4) 的 x1, y1, x2, y2,
+             'rec_polys': [(4, 2), ...]}；沒有結果時可回傳 None
+        """
+        raise NotImplementedError
+
+    def recognize(self, crops: List[np.ndarray]):
+        """
+        只跑辨識模型：文字列圖片（BGR）-> (文字列表, 信心值列表)，一次送入整批
+
+        位置已知時（見 ocr.TextLayoutCache）不必再做整張畫面的文字偵測。
+        """
+        raise NotImplementedError
+
+    def info(self) -> Dict[str, Any]:
+        return {'engine': self.name}
+
+
+class PaddleEngine(OCREngine):
+    """PaddleOCR（Paddle 推論）"""
+
+    name = 'paddle'
+
+    def __init__(self, lang: str = 'ch', cpu_threads: Optional[int] = None,
+                 rec_model: str = DEFAULT_REC_MODEL):
+        from paddleocr import PaddleOCR
+
+        self.lang = lang
+        self.rec_model = rec_model
+        self._recognizer = None
+        options = {'cpu_threads': cpu_threads} if cpu_threads else {}
+        self._options = options
+        self.model = PaddleOCR(
+            lang=lang,
+            use_doc_orientation_classify=False,
+            use_doc_unwarping=False,
+            use_textline_orientation=False,
+            **options
+        )
+
+    def ocr(self, image):
+        result = self.model.ocr(image)
+        return result[0] if result else None
+
+    def recognize(self, crops):
+        if not crops:
+            return [], []
+        if self._recognizer is None:
+            # 預設為 lang='ch' 時 PaddleOCR 產線使用的辨識模型；第一次只辨識時才載入
+            from paddleocr import TextRecognition
+
+            self._recognizer = TextRecognition(model_name=self.rec_model, **self._options)
+        results = list(self._recognizer.predict(input=list(crops), batch_size=len(crops)))
+        return [r['rec_text'] for r in results], [float(r['rec_score']) for r in results]
+
+    def info(self):
+        return {'engine': self.name, 'lang': self.lang}
+
+
+class OnnxEngine(OCREngine):
+    """
+    PP-OCR 偵測 (DB) + 辨識 (CTC) 模型的 ONNX Runtime 版本
+
+    前後處理照 PaddleOCR 的預設值實作：偵測圖長邊限制、DB 二值化與框外擴、
+    依閱讀順序排序、透視裁切文字列、辨識結果以 CTC 貪婪解碼。
+    模型目錄由 `python ocr_engines.py export` 產生（manifest.json 記錄檔名與參數）。
+    """
+
+    name = 'onnx'
+
+    def __init__(self, model_dir: str = DEFAULT_ONNX_DIR, cpu_threads: Optional[int] = None,
+                 provider: str = 'cpu'):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise ImportError("The onnx OCR engine needs onnxruntime (pip install onnxruntime)") from e
+
+        manifest_path = os.path.join(model_dir, MANIFEST)
+        if not os.path.exists(manifest_path):
+            raise FileNotFoundError(f"{manifest_path} not found, run `python ocr_engines.py export` first")
+        with open(manifest_path, encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        self.model_dir = model_dir
+        self.det_params = self.manifest['det']
+        self.rec_params = self.manifest['rec']
+        with open(os.path.join(model_dir, self.rec_params['dict']), encoding='utf-8') as f:
+            characters = [line.rstrip('\n') for line in f]
+        # CTC：索引 0 為空白，PP-OCR 的字典最後另有一個空格
+        self.characters = ['', *characters, ' ']
+
+        if provider not in ONNX_PROVIDERS:
+            raise ValueError(f"Unknown ONNX provider '{provider}', expected one of {list(ONNX_PROVIDERS)}")
+        available = ort.get_available_providers()
+        self.providers = [p for p in ONNX_PROVIDERS[provider] if p in available] or ['CPUExecutionProvider']
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.inter_op_num_threads = 1
+        if cpu_threads:
+            options.intra_op_num_threads = cpu_threads
+        self.det = ort.InferenceSession(os.path.join(model_dir, self.det_params['model']), options,
+                                        providers=self.providers)
+        self.rec = ort.InferenceSession(os.path.join(model_dir, self.rec_params['model']), options,
+                                        providers=self.providers)
+
+    def info(self):
+        return {'engine': self.name, 'model_dir': self.model_dir, 'providers': self.providers,
+                'quantized': self.manifest.get('quantized', [])}
+
+    def ocr(self, image):
+        polys = self.detect(image)
+        if not polys:
+            return None
+        crops = [crop_text_line(image, poly) for poly in polys]
+        texts, scores = self.recognize(crops)
+        threshold = self.rec_params.get('score_thresh', 0.0)
+        keep = [i for i, score in enumerate(scores) if texts[i] and score >= threshold]
+        if not keep:
+            return None
+        kept_polys = [polys[i] for i in keep]
+        return {
+            'rec_texts': [texts[i] for i in keep],
+            'rec_scores': [scores[i] for i in keep],
+            'rec_polys': kept_polys,
+            'rec_boxes': np.array([[p[:, 0].min(), p[:, 1].min(), p[:, 0].max(), p[:, 1].max()]
+                                   for p in kept_polys], dtype=np.int16),
+        }
+
+    # ------------------------------------------------------------------
+    # 偵測
+    # ------------------------------------------------------------------
+    def detect(self, image: np.ndarray) -> List[np.ndarray]:
+        """文字區域的四邊形 (4, 2)，依閱讀順序"""
+        h, w = image.shape[:2]
+        resized, ratio_h, ratio_w = resize_for_detection(image, self.det_params.get('limit_side_len', 960),
+                                                         self.det_params.get('limit_type', 'max'))
+        blob = normalize(resized, mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225))
+        prob = self.det.run(None, {self.det.get_inputs()[0].name: blob})[0][0, 0]
+        polys = db_postprocess(prob, thresh=self.det_params.get('thresh', 0.3),
+                               box_thresh=self.det_params.get('box_thresh', 0.6),
+                               unclip_ratio=self.det_params.get('unclip_ratio', 1.5),
+                               max_candidates=self.det_params.get('max_candidates', 1000))
+        scaled = []
+        for poly in polys:
+            poly = poly / np.float32([ratio_w, ratio_h])
+            poly[:, 0] = np.clip(poly[:, 0], 0, w - 1)
+            poly[:, 1] = np.clip(poly[:, 1], 0, h - 1)
+            if np.linalg.norm(poly[0] - poly[1]) > 3 and np.linalg.norm(poly[0] - poly[3]) > 3:
+                scaled.append(poly)
+        return sort_reading_order(scaled)
+
+    # ------------------------------------------------------------------
+    # 辨識
+    # ------------------------------------------------------------------
+    def recognize(self, crops: List[np.ndarray]):
+        """文字列圖片 -> (文字, 信心值)；依寬高比排序後分批，減少補白"""
+        _, rec_h, rec_w = self.rec_params.get('image_shape', [3, 48, 320])
+        batch_size = self.rec_params.get('batch_size', 6)
+        texts: List[str] = [''] * len(crops)
+        scores: List[float] = [0.0] * len(crops)
+        order = np.argsort([c.shape[1] / max(c.shape[0], 1) for c in crops])
+        for start in range(0, len(crops), batch_size):
+            batch = order[start:start + batch_size]
+            max_ratio = max(max(crops[i].shape[1] / max(crops[i].shape[0], 1) for i in batch), rec_w / rec_h)
+            width = int(math.ceil(rec_h * max_ratio))
+            blob = np.stack([resize_for_recognition(crops[i], rec_h, width) for i in batch])
+            probs = self.rec.run(None, {self.rec.get_inputs()[0].name: blob})[0]
+            for i, (text, score) in zip(batch, ctc_decode(probs, self.characters)):
+                texts[i], scores[i] = text, score
+        return texts, scores
+
+
+# ----------------------------------------------------------------------
+# 前後處理（PP-OCR 的預設做法）
+# ----------------------------------------------------------------------
+def normalize(image: np.ndarray, mean, std) -> np.ndarray:
+    """HWC BGR uint8 -> NCHW float32"""
+    blob = (image.astype(np.float32) / 255.0 - np.float32(mean)) / np.float32(std)
+    return blob.transpose(2, 0, 1)[None]
+
+
+def resize_for_detection(image: np.ndarray, limit_side_len: int = 960, limit_type: str = 'max'):
+    """長邊（max）不超過 / 短邊（min）不小於 limit_side_len，邊長取 32 的倍數"""
+    h, w = image.shape[:2]
+    if limit_type == 'max':
+        ratio = min(limit_side_len / max(h, w), 1.0)
+    else:
+        ratio = max(limit_side_len / min(h, w), 1.0)
+    new_h = max(int(round(h * ratio / 32)) * 32, 32)
+    new_w = max(int(round(w * ratio / 32)) * 32, 32)
+    return cv2.resize(image, (new_w, new_h)), new_h / h, new_w / w
+
+
+def db_postprocess(prob: np.ndarray, thresh: float = 0.3, box_thresh: float = 0.6,
+                   unclip_ratio: float = 1.5, max_candidates: int = 1000) -> List[np.ndarray]:
+    """
+    DB 機率圖 -> 文字框
+
+    二值化後取輪廓的最小外接矩形，以框內平均機率過濾，再依
+    面積 * unclip_ratio / 周長 的距離向外擴（與 pyclipper 對矩形的外擴相同，只差圓角）
+    """
+    bitmap = (prob > thresh).astype(np.uint8)
+    contours, _ = cv2.findContours(bitmap, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+    polys = []
+    for contour in contours[:max_candidates]:
+        (cx, cy), (rw, rh), angle = cv2.minAreaRect(contour)
+        if min(rw, rh) < 3:
+            continue
+        if box_score(prob, cv2.boxPoints(((cx, cy), (rw, rh), angle))) < box_thresh:
+            continue
+        distance = rw * rh * unclip_ratio / (2 * (rw + rh))
+        expanded = ((cx, cy), (rw + 2 * distance, rh + 2 * distance), angle)
+        if min(expanded[1]) < 5:
+            continue
+        polys.append(order_points(cv2.boxPoints(expanded)))
+    return polys
+
+
+def box_score(prob: np.ndarray, points: np.ndarray) -> float:
+    """四邊形內的平均機率（只在外接矩形範圍內計算）"""
+    h, w = prob.shape
+    x_min = int(np.clip(np.floor(points[:, 0].min()), 0, w - 1))
+    x_max = int(np.clip(np.ceil(points[:, 0].max()), 0, w - 1))
+    y_min = int(np.clip(np.floor(points[:, 1].min()), 0, h - 1))
+    y_max = int(np.clip(np.ceil(points[:, 1].max()), 0, h - 1))
+    mask = np.zeros((y_max - y_min + 1, x_max - x_min + 1), np.uint8)
+    cv2.fillPoly(mask, [(points - np.float32([x_min, y_min])).astype(np.int32)], 1)
+    return float(cv2.mean(prob[y_min:y_max + 1, x_min:x_max + 1], mask)[0])
+
+
+def order_points(points: np.ndarray) -> np.ndarray:
+    """四個頂點排成 左上、右上、右下、左下"""
+    points = points[np.argsort(points[:, 0])]
+    left = points[:2][np.argsort(points[:2, 1])]
+    right = points[2:][np.argsort(points[2:, 1])]
+    return np.float32([left[0], right[0], right[1], left[1]])
+
+
+def sort_reading_order(polys: List[np.ndarray], row_tolerance: float = 10) -> List[np.ndarray]:
+    """由上而下、同一列（左上角 y 相差小於 row_tolerance）由左而右"""
+    polys = sorted(polys, key=lambda p: (p[0][1], p[0][0]))
+    for i in range(len(polys) - 1):
+        for j in range(i, -1, -1):
+            if abs(polys[j + 1][0][1] - polys[j][0][1]) < row_tolerance and polys[j + 1][0][0] < polys[j][0][0]:
+                polys[j], polys[j + 1] = polys[j + 1], polys[j]
+            else:
+                break
+    return polys
+
+
+def crop_text_line(image: np.ndarray, poly: np.ndarray) -> np.ndarray:
+    """透視變換裁出文字列；直書（高 >= 1.5 倍寬）轉成橫向"""
+    width = int(max(np.linalg.norm(poly[0] - poly[1]), np.linalg.norm(poly[2] - poly[3])))
+    height = int(max(np.linalg.norm(poly[0] - poly[3]), np.linalg.norm(poly[1] - poly[2])))
+    target = np.float32([[0, 0], [width, 0], [width, height], [0, height]])
+    crop = cv2.warpPerspective(image, cv2.getPerspectiveTransform(poly.astype(np.float32), target),
+                               (max(width, 1), max(height, 1)),
+                               borderMode=cv2.BORDER_REPLICATE, flags=cv2.INTER_CUBIC)
+    if crop.shape[0] / max(crop.shape[1], 1) >= 1.5:
+        crop = np.rot90(crop)
+    return crop
+
+
+def resize_for_recognition(crop: np.ndarray, height: int, width: int) -> np.ndarray:
+    """等比縮放到固定高度，右側補 0 到 width，正規化到 [-1, 1]，回傳 CHW"""
+    h, w = crop.shape[:2]
+    resized_w = min(width, int(math.ceil(height * w / max(h, 1))))
+    resized = cv2.resize(np.ascontiguousarray(crop), (max(resized_w, 1), height)).astype(np.float32)
+    padded = np.zeros((3, height, width), np.float32)
+    padded[:, :, :resized.shape[1]] = ((resized / 255.0 - 0.5) / 0.5).transpose(2, 0, 1)
+    return padded
+
+
+def ctc_decode(probs: np.ndarray, characters: List[str]):
+    """(N, T, C) 機率 -> [(文字, 平均信心值)]；合併重複並去掉空白（索引 0）"""
+    indices = probs.argmax(axis=2)
+    confidences = probs.max(axis=2)
+    results = []
+    for seq, conf in zip(indices, confidences):
+        keep = seq != 0
+        keep[1:] &= seq[1:] != seq[:-1]
+        chars = [characters[i] if i < len(characters) else '' for i in seq[keep]]
+        results.append((''.join(chars), float(conf[keep].mean()) if keep.any() else 0.0))
+    return results
+
+
+# ----------------------------------------------------------------------
+# 建立引擎
+# ----------------------------------------------------------------------
+ENGINES = {
+    PaddleEngine.name: PaddleEngine,
+    OnnxEngine.name: OnnxEngine,
+}
+
+
+def create_engine(name: Optional[str] = None, lang: str = 'ch', cpu_threads: Optional[int] = None) -> OCREngine:
+    """依名稱（預設取 MQA_OCR_ENGINE，未設定時為 paddle）建立引擎"""
+    name = name or os.environ.get(ENGINE_ENV, PaddleEngine.name)
+    if name == PaddleEngine.name:
+        return PaddleEngine(lang=lang, cpu_threads=cpu_threads)
+    if name == OnnxEngine.name:
+        return OnnxEngine(model_dir=os.environ.get(ONNX_DIR_ENV, DEFAULT_ONNX_DIR), cpu_threads=cpu_threads,
+                          provider=os.environ.get(PROVIDER_ENV, 'cpu'))
+    raise ValueError(f"Unknown OCR engine '{name}', expected one of {list(ENGINES)}")
+
+
+# ----------------------------------------------------------------------
+# 匯出
+# ----------------------------------------------------------------------
+def read_inference_config(model_dir: str) -> Dict[str, Any]:
+    """PaddleX 模型目錄中的 inference.yml（前處理參數、辨識字典）"""
+    import yaml
+
+    path = os.path.join(model_dir, 'inference.yml')
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return yaml.safe_load(f) or {}
+
+
+def _transform_op(config: Dict[str, Any], name: str) -> Dict[str, Any]:
+    for op in (config.get('PreProcess') or {}).get('transform_ops') or []:
+        if name in op:
+            return op[name] or {}
+    return {}
+
+
+def paddle_to_onnx(paddle_model_dir: str, onnx_path: str, opset: int = 14) -> None:
+    """以 paddlex 的 paddle2onnx 外掛轉換模型（paddlex --install paddle2onnx）"""
+    with tempfile.TemporaryDirectory() as out_dir:
+        subprocess.run(['paddlex', '--paddle2onnx', '--paddle_model_dir', paddle_model_dir,
+                        '--onnx_model_dir', out_dir, '--opset_version', str(opset)], check=True)
+        shutil.move(os.path.join(out_dir, 'inference.onnx'), onnx_path)
+
+
+def quantize_int8(src: str, dst: str) -> None:
+    """動態量化：權重存成 INT8，啟動值在推論時量化"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(src, dst, weight_type=QuantType.QInt8)
+
+
+def export_models(out_dir: str, det_dir: str, rec_dir: str, quantize: str = 'all') -> Dict[str, Any]:
+    """
+    把 PaddleX 的偵測/辨識模型轉成 ONNX，寫出字典與 manifest.json
+
+    Args:
+        out_dir: 輸出目錄（OnnxEngine 的 model_dir）
+        det_dir / rec_dir: PaddleX 模型目錄（含 inference.json / inference.pdiparams / inference.yml）
+        quantize: 'all'、'rec'（只量化辨識模型）或 'none'
+
+    Returns:
+        manifest 內容
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    det_config = read_inference_config(det_dir)
+    rec_config = read_inference_config(rec_dir)
+
+    character_dict = (rec_config.get('PostProcess') or {}).get('character_dict')
+    if not character_dict:
+        raise ValueError(f"No character_dict in {rec_dir}/inference.yml")
+    with open(os.path.join(out_dir, 'rec_dict.txt'), 'w', encoding='utf-8') as f:
+        f.write('\n'.join(character_dict) + '\n')
+
+    quantized = {'all': ['det', 'rec'], 'rec': ['rec'], 'none': []}[quantize]
+    models = {}
+    for kind, model_dir in (('det', det_dir), ('rec', rec_dir)):
+        onnx_path = os.path.join(out_dir, f'{kind}.onnx')
+        print(f"Converting {model_dir} -> {onnx_path}")
+        paddle_to_onnx(model_dir, onnx_path)
+        models[kind] = f'{kind}.onnx'
+        if kind in quantized:
+            int8_path = os.path.join(out_dir, f'{kind}.int8.onnx')
+            print(f"Quantizing {onnx_path} -> {int8_path}")
+            quantize_int8(onnx_path, int8_path)
+            models[kind] = f'{kind}.int8.onnx'
+
+    resize = _transform_op(det_config, 'DetResizeForTest')
+    rec_resize = _transform_op(rec_config, 'RecResizeImg')
+    manifest = {
+        'source': {'det': os.path.basename(os.path.normpath(det_dir)),
+                   'rec': os.path.basename(os.path.normpath(rec_dir))},
+        'quantized': quantized,
+        'det': {
+            'model': models['det'],
+            'limit_side_len': resize.get('limit_side_len') or resize.get('resize_long') or 960,
+            'limit_type': resize.get('limit_type', 'max'),
+            'thresh': 0.3,
+            'box_thresh': 0.6,
+            'unclip_ratio': 1.5,
+        },
+        'rec': {
+            'model': models['rec'],
+            'dict': 'rec_dict.txt',
+            'image_shape': rec_resize.get('image_shape', [3, 48, 320]),
+            'batch_size': 6,
+            'score_thresh': 0.0,
+        },
+    }
+    with open(os.path.join(out_dir, MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    print(f"Wrote {os.path.join(out_dir, MANIFEST)}")
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description='OCR engine tools')
+    commands = parser.add_subparsers(dest='command', required=True)
+    export = commands.add_parser('export', help='convert the PaddleOCR models to ONNX')
+    export.add_argument('--det', default=os.path.join(PADDLEX_MODELS_DIR, DEFAULT_DET_MODEL),
+                        help='PaddleX detection model directory')
+    export.add_argument('--rec', default=os.path.join(PADDLEX_MODELS_DIR, DEFAULT_REC_MODEL),
+                        help='PaddleX recognition model directory')
+    export.add_argument('-o', '--output', default=DEFAULT_ONNX_DIR, help='output model directory')
+    export.add_argument('--quantize', choices=['all', 'rec', 'none'], default='all',
+                        help='store weights as INT8 (dynamic quantization)')
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        export_models(args.output, os.path.expanduser(args.det), os.path.expanduser(args.rec), args.quantize)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+"""
+腳本執行的延遲剖析：每個步驟的 span（解析、派送、ADB API 往返、取得畫面、視覺運算）
+
+用法:
+    trace = Trace()
+    with trace.activate():
+        with span('parse', 'executor'):
+            ...
+    trace.spans            # 附在 ExecutionResult 中回傳
+    trace.chrome_trace()   # chrome://tracing / Perfetto 可開啟的 JSON
+
+span() 透過 contextvar 找到目前的 Trace，沒有啟用時不做任何事，
+所以深層的函數（call_adb_api、模板比對）不必一路傳遞 Trace。
+"""
+import contextvars
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+import numpy as np
+
+_current_trace: contextvars.ContextVar[Optional['Trace']] = contextvars.ContextVar('trace', default=None)
+_current_span: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar('span', default=None)
+
+
+class Trace:
+    """一次腳本執行的所有 span；時間以毫秒、相對於 Trace 建立時間記錄"""
+
+    def __init__(self, name: str = 'execute'):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.started_at = time.time()
+        self._origin = time.perf_counter()
+        self.spans: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def now_ms(self) -> float:
+        return (time.perf_counter() - self._origin) * 1000
+
+    @contextmanager
+    def activate(self) -> Iterator['Trace']:
+        token = _current_trace.set(self)
+        try:
+            yield self
+        finally:
+            _current_trace.reset(token)
+
+    def add(self, name: str, category: str, start_ms: float, duration_ms: float,
+            parent: Optional[int] = None, **attrs) -> int:
+        """加入一個已結束的 span，回傳其 id"""
+        with self._lock:
+            span_id = len(self.spans)
+            self.spans.append({
+                'id': span_id,
+                'name': name,
+                'cat': category,
+                'start_ms': round(start_ms, 3),
+                'dur_ms': round(duration_ms, 3),
+                'parent': parent,
+                'thread': threading.current_thread().name,
+                **({'attrs': attrs} if attrs else {}),
+            })
+        return span_id
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        各類別的自身耗時（span 耗時扣掉子 span），加總即為整次執行的時間分配
+        """
+        child_ms: Dict[int, float] = {}
+        for s in self.spans:
+            if s['parent'] is not None:
+                child_ms[s['parent']] = child_ms.get(s['parent'], 0.0) + s['dur_ms']
+        totals: Dict[str, float] = {}
+        for s in self.spans:
+            own = max(s['dur_ms'] - child_ms.get(s['id'], 0.0), 0.0)
+            totals[s['cat']] = totals.get(s['cat'], 0.0) + own
+        total = max((s['start_ms'] + s['dur_ms'] for s in self.spans), default=0.0)
+        return {
+            'trace_id': self.trace_id,
+            'total_ms': round(total, 3),
+            'by_category_ms': {k: round(v, 3) for k, v in sorted(totals.items(), key=lambda kv: -kv[1])},
+        }
+
+    def chrome_trace(self) -> Dict[str, Any]:
+        """Chrome trace event 格式（'X' complete events，時間單位為微秒）"""
+        threads = {name: i for i, name in enumerate(dict.fromkeys(s['thread'] for s in self.spans))}
+        events = [{
+            'name': s['name'],
+            'cat': s['cat'],
+            'ph': 'X',
+            'ts': round(s['start_ms'] * 1000 + self.started_at * 1e6),
+            'dur': round(s['dur_ms'] * 1000),
+            'pid': os.getpid(),
+            'tid': threads[s['thread']],
+            'args': s.get('attrs', {}),
+        } for s in self.spans]
+        events += [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid, 'args': {'name': name}}
+                   for name, tid in threads.items()]
+        return {'traceEvents': events, 'displayTimeUnit': 'ms',
+                'otherData': {'trace_id': self.trace_id, 'name': self.name}}
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name: str, category: str, **attrs) -> Iterator[Dict[str, Any]]:
+    """
+    量測一段程式碼；沒有啟用的 Trace 時只回傳一個空 dict
+
+    yield 出的 dict 可在區塊內補上屬性；放入 'stages' ({階段: 毫秒}) 時，
+    這些依序執行的階段會成為子 span（類別可用 'stage_category' 指定）。
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield {}
+        return
+    extra: Dict[str, Any] = {}
+    parent = _current_span.get()
+    start = trace.now_ms()
+    # 先佔位取得 id，子 span 才能指向它
+    span_id = trace.add(name, category, start, 0.0, parent)
+    token = _current_span.set(span_id)
+    try:
+        yield extra
+    except Exception as e:
+        extra['error'] = str(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        entry = trace.spans[span_id]
+        entry['dur_ms'] = round(trace.now_ms() - start, 3)
+        stages = extra.pop('stages', None)
+        stage_category = extra.pop('stage_category', category)
+        if attrs or extra:
+            entry['attrs'] = {**attrs, **extra}
+        if stages:
+            add_stages(stages, start, stage_category, span_id)
+
+
+def add_stages(timings: Dict[str, float], start_ms: float, category: str, parent: Optional[int]) -> None:
+    """
+    把依序執行的階段耗時（例如 mixed_template_match 的 timings）轉成子 span
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return
+    offset = start_ms
+    for name, duration in timings.items():
+        trace.add(name, category, offset, duration, parent)
+        offset += duration
+
+
+def parse_server_timing(header: Optional[str]) -> Dict[str, float]:
+    """解析 Server-Timing 標頭: 'app;dur=12.3, adb;dur=8.1;desc="2"' -> {'app': 12.3, 'adb': 8.1}"""
+    timings: Dict[str, float] = {}
+    if not header:
+        return timings
+    for metric in header.split(','):
+        parts = [p.strip() for p in metric.split(';')]
+        for part in parts[1:]:
+            if part.startswith('dur='):
+                try:
+                    timings[parts[0]] = float(part[4:])
+                except ValueError:
+                    pass
+    return timings
+
+
+class ProfileStats:
+    """
+    跨執行彙整 span 耗時，提供百分位數；同時保留最近幾次的完整 Trace 供匯出
+    """
+
+    def __init__(self, samples_per_span: int = 2000, keep_traces: int = 50):
+        self.samples_per_span = samples_per_span
+        self.keep_traces = keep_traces
+        self._samples: Dict[str, Deque[float]] = {}
+        self._traces: 'OrderedDict[str, Trace]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add_trace(self, trace: Trace) -> None:
+        with self._lock:
+            for s in trace.spans:
+                key = f"{s['cat']}:{s['name']}"
+                samples = self._samples.get(key)
+                if samples is None:
+                    samples = self._samples[key] = deque(maxlen=self.samples_per_span)
+                samples.append(s['dur_ms'])
+            self._traces[trace.trace_id] = trace
+            while len(self._traces) > self.keep_traces:
+                self._traces.popitem(last=False)
+
+    def get_trace(self, trace_id: str) -> Optional[Trace]:
+        with self._lock:
+            return self._traces.get(trace_id)
+
+    def recent(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            traces = list(self._traces.values())
+        return [{'name': t.name, 'started_at': t.started_at, **t.summary()} for t in reversed(traces)]
+
+    def percentiles(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            snapshot = {key: np.asarray(values) for key, values in self._samples.items() if values}
+        return {
+            key: {
+                'count': int(values.size),
+                'p50': round(float(np.percentile(values, 50)), 3),
+                'p90': round(float(np.percentile(values, 90)), 3),
+                'p99': round(float(np.percentile(values, 99)), 3),
+                'max': round(float(values.max()), 3),
+            }
+            for key, values in sorted(snapshot.items())
+        }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._samples.clear()
+            self._traces.clear()
+
+
+def export_otel(trace: Trace) -> bool:
+    """
+    把 Trace 以 OpenTelemetry span 送出（需安裝 opentelemetry-sdk 並設定好 exporter）
+
+    Returns:
+        False 表示未安裝 OpenTelemetry
+    """
+    try:
+        from opentelemetry import trace as otel_trace
+    except ImportError:
+        return False
+
+    tracer = otel_trace.get_tracer('mqa.process_backend')
+    origin_ns = int(trace.started_at * 1e9)
+    opened: Dict[int, Any] = {}
+    for s in trace.spans:
+        parent = opened.get(s['parent'])
+        context = otel_trace.set_span_in_context(parent) if parent is not None else None
+        otel_span = tracer.start_span(s['name'], context=context,
+                                      start_time=origin_ns + int(s['start_ms'] * 1e6),
+                                      attributes={'category': s['cat'],
+                                                  **{k: str(v) for k, v in s.get('attrs', {}).items()}})
+        opened[s['id']] = otel_span
+    # 子 span 先結束
+    for s in reversed(trace.spans):
+        opened[s['id']].end(end_time=origin_ns + int((s['start_ms'] + s['dur_ms']) * 1e6))
+    return True
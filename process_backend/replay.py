@@ -0,0 +1,85 @@
+"""
+離線回放錄影：把錄下的畫面送進 mixed_template_match / OCRProcessor，不需要手機
+
+用法:
+    python replay.py ../adb_backend/recordings/<run_id> --template templates/google.png
+    python replay.py ../adb_backend/recordings/<run_id> --text "Google" --step 3
+"""
+import argparse
+import os
+import sys
+import time
+
+import cv2
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'adb_backend'))
+from frame_recorder import FrameReader  # noqa: E402
+
+from template_match import mixed_template_match  # noqa: E402
+
+
+def replay(run_dir, template_path=None, goal=None, step=None, ocr=None):
+    """
+    逐張回放錄影並執行視覺比對
+
+    Args:
+        run_dir: 錄影目錄
+        template_path: 模板路徑 (選填)
+        goal: OCR 要找的文字/正則 (選填)
+        step: 只回放某個腳本步驟期間的畫面 (選填)
+        ocr: 已初始化的 OCRProcessor，goal 有值時使用
+
+    Returns:
+        每張畫面的結果列表
+    """
+    results = []
+    with FrameReader(run_dir) as reader:
+        indices = reader.frames_for_step(step) if step is not None else range(len(reader))
+        for i in indices:
+            i = int(i)
+            # 錄影為 RGB，OpenCV 使用 BGR
+            frame = cv2.cvtColor(reader.frame(i), cv2.COLOR_RGB2BGR)
+            entry = {
+                'frame': i,
+                'ts': float(reader.timestamps[i]),
+                'step': int(reader.index['step'][i]),
+            }
+            if template_path:
+                start = time.perf_counter()
+                entry['template_pos'] = mixed_template_match(template_path, frame=frame)
+                entry['template_ms'] = (time.perf_counter() - start) * 1000
+            if goal and ocr:
+                start = time.perf_counter()
+                entry['text_pos'] = ocr.re_ocr(ocr.mask_ocr(image=frame), goal)
+                entry['ocr_ms'] = (time.perf_counter() - start) * 1000
+            results.append(entry)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a recorded run through the vision pipeline')
+    parser.add_argument('run_dir', help='recording directory')
+    parser.add_argument('--template', help='template image path')
+    parser.add_argument('--text', help='text / regex to search with OCR')
+    parser.add_argument('--step', type=int, help='only frames captured during this script step')
+    args = parser.parse_args()
+
+    ocr = None
+    if args.text:
+        from ocr import OCRProcessor
+        ocr = OCRProcessor(lang='ch', fx=0.5, threshold=0.7)
+
+    with FrameReader(args.run_dir) as reader:
+        steps = {s['step']: s for s in reader.steps}
+    for entry in replay(args.run_dir, args.template, args.text, args.step, ocr):
+        step = steps.get(entry['step'], {})
+        line = f"#{entry['frame']:05d} step={entry['step']} {step.get('function', '-')}"
+        if 'template_pos' in entry:
+            line += f" template={entry['template_pos']} ({entry['template_ms']:.0f}ms)"
+        if 'text_pos' in entry:
+            line += f" text={entry['text_pos']} ({entry['ocr_ms']:.0f}ms)"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
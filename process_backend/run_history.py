@@ -0,0 +1,409 @@
+import hashlib
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scripts (
+    script_hash TEXT PRIMARY KEY,
+    code        TEXT NOT NULL,
+    first_seen  REAL NOT NULL,
+    last_seen   REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS runs (
+    run_id       TEXT PRIMARY KEY,
+    script_hash  TEXT NOT NULL,
+    device       TEXT NOT NULL,
+    source       TEXT NOT NULL,
+    job_id       TEXT,
+    started_at   REAL NOT NULL,
+    duration_ms  REAL,
+    success      INTEGER NOT NULL,
+    total_steps  INTEGER NOT NULL,
+    failed_steps INTEGER NOT NULL,
+    recording_id TEXT,
+    error        TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_runs_script ON runs(script_hash, started_at);
+CREATE INDEX IF NOT EXISTS idx_runs_device ON runs(device, started_at);
+CREATE INDEX IF NOT EXISTS idx_runs_started ON runs(started_at);
+CREATE TABLE IF NOT EXISTS steps (
+    run_id      TEXT NOT NULL,
+    step        INTEGER NOT NULL,
+    function    TEXT NOT NULL,
+    args        TEXT,
+    success     INTEGER NOT NULL,
+    result      TEXT,
+    error       TEXT,
+    start_ms    REAL,
+    duration_ms REAL,
+    template    TEXT,
+    x           INTEGER,
+    y           INTEGER,
+    confidence  REAL,
+    frame_seq   INTEGER,
+    PRIMARY KEY (run_id, step)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS step_daily (
+    script_hash    TEXT NOT NULL,
+    device         TEXT NOT NULL,
+    step           INTEGER NOT NULL,
+    day            INTEGER NOT NULL,
+    function       TEXT NOT NULL,
+    runs           INTEGER NOT NULL,
+    failures       INTEGER NOT NULL,
+    flips          INTEGER NOT NULL,
+    total_ms       REAL NOT NULL,
+    max_ms         REAL,
+    confidence_sum REAL NOT NULL,
+    confidence_n   INTEGER NOT NULL,
+    last_failure   REAL,
+    PRIMARY KEY (script_hash, device, step, day)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_step_daily_day ON step_daily(day);
+CREATE TABLE IF NOT EXISTS step_last (
+    script_hash TEXT NOT NULL,
+    device      TEXT NOT NULL,
+    step        INTEGER NOT NULL,
+    success     INTEGER NOT NULL,
+    started_at  REAL NOT NULL,
+    PRIMARY KEY (script_hash, device, step)
+) WITHOUT ROWID;
+"""
+
+# step_daily 的日期單位 (UTC 日)
+DAY_SECONDS = 86400
+
+RUN_COLUMNS = ('run_id', 'script_hash', 'device', 'source', 'job_id', 'started_at', 'duration_ms',
+               'success', 'total_steps', 'failed_steps', 'recording_id', 'error')
+STEP_COLUMNS = ('run_id', 'step', 'function', 'args', 'success', 'result', 'error', 'start_ms',
+                'duration_ms', 'template', 'x', 'y', 'confidence', 'frame_seq')
+
+
+def script_hash(code: str) -> str:
+    """同一腳本（忽略前後空白）得到相同的雜湊，用來比較多次執行"""
+    return hashlib.sha256(code.strip().encode('utf-8')).hexdigest()[:16]
+
+
+def step_rows(run_id: str, results: List[Dict[str, Any]], spans: List[Dict[str, Any]]) -> List[Tuple]:
+    """
+    由執行結果與 profiler span 組出每個步驟的紀錄
+
+    步驟 span（類別 'step'）底下的子 span 提供比對到的位置、信心值、
+    模板名稱與擷取的畫面序號 (frame_seq)
+    """
+    children: Dict[int, List[Dict[str, Any]]] = {}
+    step_spans: Dict[int, Dict[str, Any]] = {}
+    for s in spans:
+        if s['parent'] is not None:
+            children.setdefault(s['parent'], []).append(s)
+        if s['cat'] == 'step' and 'step' in s.get('attrs', {}):
+            step_spans[s['attrs']['step']] = s
+
+    def descendants(span_id: int):
+        for child in children.get(span_id, ()):
+            yield child
+            yield from descendants(child['id'])
+
+    rows = []
+    for index, entry in enumerate(results):
+        span = step_spans.get(index)
+        found: Dict[str, Any] = {}
+        if span is not None:
+            # 取最後一次比對/擷取，check_* 會重試多輪
+            for child in descendants(span['id']):
+                attrs = child.get('attrs', {})
+                for key in ('pos', 'confidence', 'template', 'frame_seq'):
+                    if key in attrs:
+                        found[key] = attrs[key]
+        pos = found.get('pos') or (None, None)
+        rows.append((
+            run_id, index, entry['function'],
+            json.dumps(entry.get('args', []), ensure_ascii=False, default=str),
+            1 if entry.get('success') else 0,
+            None if entry.get('result') is None else str(entry['result']),
+            entry.get('error'),
+            span['start_ms'] if span else None,
+            span['dur_ms'] if span else None,
+            os.path.basename(found['template']) if 'template' in found else None,
+            pos[0], pos[1],
+            found.get('confidence'),
+            found.get('frame_seq'),
+        ))
+    return rows
+
+
+class RunHistory:
+    """
+    執行紀錄：每次腳本執行與每個步驟寫入 SQLite，依腳本雜湊、裝置與時間建立索引
+
+    record() 只把資料放入佇列，由背景執行緒批次寫入（一個交易寫入多筆），
+    執行腳本的路徑上沒有磁碟 I/O。查詢使用另一個連線（WAL 模式下讀寫互不阻塞）。
+
+    寫入時同時累計每日的步驟統計 (step_daily)，不穩定步驟與函數統計只讀這張
+    小表，查詢數週的資料也不必掃描所有步驟。
+    """
+
+    def __init__(self, db_path: str, batch_size: int = 200, flush_interval: float = 0.5):
+        """
+        初始化執行紀錄
+
+        Args:
+            db_path: SQLite 檔案路徑
+            batch_size: 單一交易最多寫入的執行筆數
+            flush_interval: 佇列有資料時最多等待多久就寫入 (秒)
+        """
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+
+        self._lock = threading.RLock()
+        self._conn = self._connect()
+        self._conn.executescript(SCHEMA)
+
+        self._queue: 'queue.Queue[Optional[Tuple[str, Dict[str, Any], List[Tuple]]]]' = queue.Queue()
+        self.written = 0
+        self.write_errors = 0
+        self._writer = threading.Thread(target=self._write_loop, name='run-history-writer', daemon=True)
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    # ------------------------------------------------------------------
+    # 寫入
+    # ------------------------------------------------------------------
+    def record(self, code: str, run: Dict[str, Any], steps: List[Tuple]) -> None:
+        """
+        排入一次執行（不等待寫入）
+
+        Args:
+            code: 腳本原文
+            run: RUN_COLUMNS 中的欄位（script_hash 未給時由 code 計算）
+            steps: step_rows() 的結果
+        """
+        run.setdefault('script_hash', script_hash(code))
+        self._queue.put((code, run, steps))
+
+    def flush(self) -> None:
+        """等待佇列中的紀錄寫入完成"""
+        self._queue.join()
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._writer.join(timeout=5)
+        self._conn.close()
+
+    def _write_loop(self) -> None:
+        conn = self._connect()
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            stop = False
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    self._queue.task_done()
+                    break
+                batch.append(item)
+            try:
+                self._write_batch(conn, batch)
+                self.written += len(batch)
+            except sqlite3.Error as e:
+                self.write_errors += len(batch)
+                print(f"Run history write failed ({len(batch)} runs): {e}")
+            for _ in batch:
+                self._queue.task_done()
+            if stop:
+                break
+        conn.close()
+
+    @classmethod
+    def _write_batch(cls, conn: sqlite3.Connection, batch) -> None:
+        conn.execute('BEGIN')
+        try:
+            for code, run, steps in batch:
+                started_at = run['started_at']
+                conn.execute(
+                    'INSERT INTO scripts(script_hash, code, first_seen, last_seen) VALUES (?, ?, ?, ?) '
+                    'ON CONFLICT(script_hash) DO UPDATE SET last_seen = MAX(last_seen, excluded.last_seen)',
+                    (run['script_hash'], code, started_at, started_at))
+                conn.execute(
+                    f"INSERT OR REPLACE INTO runs({', '.join(RUN_COLUMNS)}) "
+                    f"VALUES ({', '.join('?' for _ in RUN_COLUMNS)})",
+                    tuple(run.get(column) for column in RUN_COLUMNS))
+                conn.executemany(
+                    f"INSERT OR REPLACE INTO steps({', '.join(STEP_COLUMNS)}) "
+                    f"VALUES ({', '.join('?' for _ in STEP_COLUMNS)})",
+                    steps)
+                cls._roll_up(conn, run, steps)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    @staticmethod
+    def _roll_up(conn: sqlite3.Connection, run: Dict[str, Any], steps: List[Tuple]) -> None:
+        """把一次執行的步驟累計到 step_daily；與上一次結果不同時計為一次翻轉 (flip)"""
+        key = (run['script_hash'], run['device'])
+        started_at = run['started_at']
+        day = int(started_at // DAY_SECONDS)
+        previous = {row[0]: (row[1], row[2]) for row in conn.execute(
+            'SELECT step, success, started_at FROM step_last WHERE script_hash = ? AND device = ?', key)}
+        daily, last = [], []
+        for row in steps:
+            step, function, success, duration_ms, confidence = row[1], row[2], row[4], row[8], row[12]
+            before = previous.get(step)
+            # 只有比上次新的執行才比較（批次中偶爾會有較舊的紀錄）
+            flip = 1 if before is not None and before[1] <= started_at and before[0] != success else 0
+            daily.append((*key, step, day, function, 1 - success, flip, duration_ms or 0.0, duration_ms,
+                          confidence or 0.0, 0 if confidence is None else 1,
+                          None if success else started_at))
+            if before is None or before[1] <= started_at:
+                last.append((*key, step, success, started_at))
+        conn.executemany(
+            'INSERT INTO step_daily(script_hash, device, step, day, function, runs, failures, flips, total_ms, '
+            'max_ms, confidence_sum, confidence_n, last_failure) VALUES (?, ?, ?, ?, ?, 1, ?, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT(script_hash, device, step, day) DO UPDATE SET '
+            'function = excluded.function, runs = runs + 1, failures = failures + excluded.failures, '
+            'flips = flips + excluded.flips, total_ms = total_ms + excluded.total_ms, '
+            'max_ms = MAX(COALESCE(max_ms, 0), COALESCE(excluded.max_ms, 0)), '
+            'confidence_sum = confidence_sum + excluded.confidence_sum, '
+            'confidence_n = confidence_n + excluded.confidence_n, '
+            'last_failure = MAX(COALESCE(last_failure, 0), COALESCE(excluded.last_failure, 0))',
+            daily)
+        conn.executemany('INSERT OR REPLACE INTO step_last(script_hash, device, step, success, started_at) '
+                         'VALUES (?, ?, ?, ?, ?)', last)
+
+    # ------------------------------------------------------------------
+    # 查詢
+    # ------------------------------------------------------------------
+    def _query(self, sql: str, params: tuple = ()) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(sql, params).fetchall()]
+
+    @staticmethod
+    def _filters(script: Optional[str] = None, device: Optional[str] = None,
+                 since: Optional[float] = None, until: Optional[float] = None,
+                 success: Optional[bool] = None, prefix: str = '', by_day: bool = False) -> Tuple[str, list]:
+        clauses, params = [], []
+        if by_day:
+            # step_daily 以日為單位，since/until 所在的那一天都包含在內
+            since = None if since is None else int(since // DAY_SECONDS)
+            until = None if until is None else int(until // DAY_SECONDS) + 1
+        if script:
+            clauses.append(f'{prefix}script_hash = ?')
+            params.append(script)
+        if device:
+            clauses.append(f'{prefix}device = ?')
+            params.append(device)
+        time_column = 'day' if by_day else 'started_at'
+        if since is not None:
+            clauses.append(f'{prefix}{time_column} >= ?')
+            params.append(since)
+        if until is not None:
+            clauses.append(f'{prefix}{time_column} < ?')
+            params.append(until)
+        if success is not None:
+            clauses.append(f'{prefix}success = ?')
+            params.append(1 if success else 0)
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+    def runs(self, script: Optional[str] = None, device: Optional[str] = None,
+             since: Optional[float] = None, until: Optional[float] = None,
+             success: Optional[bool] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        """最近的執行，新的在前"""
+        where, params = self._filters(script, device, since, until, success)
+        return self._query(f'SELECT * FROM runs{where} ORDER BY started_at DESC LIMIT ?', (*params, limit))
+
+    def run(self, run_id: str) -> Optional[Dict[str, Any]]:
+        rows = self._query('SELECT * FROM runs WHERE run_id = ?', (run_id,))
+        if not rows:
+            return None
+        run = rows[0]
+        run['steps'] = self._query('SELECT * FROM steps WHERE run_id = ? ORDER BY step', (run_id,))
+        for step in run['steps']:
+            step.pop('run_id')
+            step['args'] = json.loads(step['args']) if step['args'] else []
+        return run
+
+    def script(self, script_hash: str) -> Optional[Dict[str, Any]]:
+        rows = self._query('SELECT * FROM scripts WHERE script_hash = ?', (script_hash,))
+        return rows[0] if rows else None
+
+    def script_stats(self, device: Optional[str] = None, since: Optional[float] = None,
+                     until: Optional[float] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        """每個腳本的執行次數、成功率與耗時"""
+        where, params = self._filters(device=device, since=since, until=until, prefix='r.')
+        return self._query(
+            'SELECT r.script_hash, COUNT(*) AS runs, SUM(r.success) AS passed, '
+            'ROUND(AVG(r.success), 4) AS pass_rate, ROUND(AVG(r.duration_ms), 1) AS avg_ms, '
+            'MAX(r.duration_ms) AS max_ms, MAX(r.started_at) AS last_run, '
+            "SUBSTR(s.code, 1, 200) AS code "
+            f'FROM runs r JOIN scripts s ON s.script_hash = r.script_hash{where} '
+            'GROUP BY r.script_hash ORDER BY last_run DESC LIMIT ?', (*params, limit))
+
+    def flaky_steps(self, script: Optional[str] = None, device: Optional[str] = None,
+                    since: Optional[float] = None, until: Optional[float] = None,
+                    min_runs: int = 5, limit: int = 50) -> List[Dict[str, Any]]:
+        """
+        時好時壞的步驟：同一腳本的同一步驟有成功也有失敗，依失敗率接近一半排序
+
+        flips 為相鄰兩次執行（同一裝置）結果改變的次數，比單純的失敗率更能區分
+        「一直壞掉」與「不穩定」。時間範圍以 UTC 日為單位。
+        """
+        where, params = self._filters(script, device, since, until, by_day=True)
+        return self._query(
+            'SELECT script_hash, step, MAX(function) AS function, SUM(runs) AS runs, SUM(failures) AS failures, '
+            '       ROUND(SUM(failures) * 1.0 / SUM(runs), 4) AS failure_rate, SUM(flips) AS flips, '
+            '       NULLIF(MAX(last_failure), 0) AS last_failure '
+            f'FROM step_daily{where} GROUP BY script_hash, step '
+            'HAVING runs >= ? AND failures > 0 AND failures < runs '
+            'ORDER BY ABS(0.5 - failure_rate), flips DESC LIMIT ?', (*params, min_runs, limit))
+
+    def function_stats(self, device: Optional[str] = None, since: Optional[float] = None,
+                       until: Optional[float] = None) -> List[Dict[str, Any]]:
+        """每個 Blockly 函數的次數、失敗數、耗時與平均比對信心值（時間範圍以 UTC 日為單位）"""
+        where, params = self._filters(device=device, since=since, until=until, by_day=True)
+        return self._query(
+            'SELECT function, SUM(runs) AS calls, SUM(failures) AS failures, '
+            'ROUND(SUM(total_ms) / SUM(runs), 1) AS avg_ms, MAX(max_ms) AS max_ms, '
+            'ROUND(SUM(confidence_sum) / NULLIF(SUM(confidence_n), 0), 4) AS avg_confidence '
+            f'FROM step_daily{where} GROUP BY function ORDER BY calls DESC', tuple(params))
+
+    def prune(self, older_than: float) -> int:
+        """刪除 older_than (epoch 秒) 以前的執行與步驟，回傳刪除的執行數"""
+        with self._lock:
+            self._conn.execute('BEGIN')
+            try:
+                self._conn.execute(
+                    'DELETE FROM steps WHERE run_id IN (SELECT run_id FROM runs WHERE started_at < ?)',
+                    (older_than,))
+                deleted = self._conn.execute('DELETE FROM runs WHERE started_at < ?', (older_than,)).rowcount
+                self._conn.execute('DELETE FROM step_daily WHERE day < ?', (int(older_than // DAY_SECONDS),))
+                self._conn.execute(
+                    'DELETE FROM scripts WHERE script_hash NOT IN (SELECT DISTINCT script_hash FROM runs)')
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+            # 讓查詢規劃器依目前的資料量選擇索引
+            self._conn.execute('PRAGMA optimize')
+        return deleted
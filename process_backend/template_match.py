@@ -1,6 +1,18 @@
+import io
+import os
 import random
+import threading
+import time
 import cv2
 import numpy as np
+from frame_cache import screen_frames
+
+# 模板特徵快取：path -> (mtime, 模板, 預處理後的模板, keypoints, descriptors, 特徵點座標 (N, 2))
+_template_cache = {}
+_template_cache_lock = threading.Lock()
+# 特徵快取命中/未命中次數（metrics.py 匯出）
+cache_stats = {'hits': 0, 'misses': 0}
+
 
 def preprocess_image(image):
     gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
@@ -15,6 +27,117 @@ def preprocess_image(image):
     blurred = cv2.GaussianBlur(bright_only, (3, 3), 0)
     return blurred
 
+
+def keypoint_array(keypoints):
+    """KeyPoint 座標轉成 (N, 2) float32 陣列"""
+    if not keypoints:
+        return np.zeros((0, 2), np.float32)
+    return cv2.KeyPoint_convert(keypoints).reshape(-1, 2)
+
+
+def serialize_features(keypoints, descriptors):
+    """把 SIFT 特徵轉成可存入模板庫的位元組"""
+    buffer = io.BytesIO()
+    np.savez_compressed(
+        buffer,
+        pt=np.float32([kp.pt for kp in keypoints]).reshape(-1, 2),
+        size=np.float32([kp.size for kp in keypoints]),
+        angle=np.float32([kp.angle for kp in keypoints]),
+        response=np.float32([kp.response for kp in keypoints]),
+        octave=np.int32([kp.octave for kp in keypoints]),
+        descriptors=descriptors if descriptors is not None else np.zeros((0, 128), np.float32),
+    )
+    return buffer.getvalue()
+
+
+def deserialize_features(blob):
+    """serialize_features 的反向操作，回傳 (keypoints, descriptors)"""
+    data = np.load(io.BytesIO(blob))
+    keypoints = [
+        cv2.KeyPoint(float(x), float(y), float(size), float(angle), float(response), int(octave))
+        for (x, y), size, angle, response, octave
+        in zip(data['pt'], data['size'], data['angle'], data['response'], data['octave'])
+    ]
+    descriptors = data['descriptors']
+    return keypoints, (descriptors if len(descriptors) else None)
+
+
+def get_template_features(template_path):
+    """
+    讀取模板並計算特徵，依檔案修改時間快取（輪詢時不必每次重算）
+
+    Returns:
+        (template, template_preprocessed, keypoints, descriptors, points)，讀不到檔案時回傳 None；
+        points 為 keypoints 座標的 float32 陣列，比對時不必再逐一讀取 KeyPoint
+    """
+    try:
+        mtime = os.path.getmtime(template_path)
+    except OSError:
+        return None
+    with _template_cache_lock:
+        cached = _template_cache.get(template_path)
+    if cached and cached[0] == mtime:
+        cache_stats['hits'] += 1
+        return cached[1:]
+    cache_stats['misses'] += 1
+
+    template = cv2.imread(template_path)
+    if template is None:
+        return None
+    template_preprocessed = preprocess_image(template)
+    if cached and cached[0] is None:
+        # 由模板庫預先載入的特徵（seed_template_features），只補上圖片
+        keypoints, descriptors = cached[3], cached[4]
+    else:
+        keypoints, descriptors = cv2.SIFT_create().detectAndCompute(template_preprocessed, None)
+    entry = (mtime, template, template_preprocessed, keypoints, descriptors, keypoint_array(keypoints))
+    with _template_cache_lock:
+        _template_cache[template_path] = entry
+    return entry[1:]
+
+
+def precompute_template_features(template_path):
+    """
+    預先計算模板特徵並放入快取
+
+    Returns:
+        序列化後的特徵（可存入模板庫），讀不到模板時回傳 None
+    """
+    features = get_template_features(template_path)
+    if features is None:
+        return None
+    return serialize_features(features[2], features[3])
+
+
+def seed_template_features(template_path, blob):
+    """用模板庫中已存的特徵預先填入快取，省去重新計算 SIFT"""
+    keypoints, descriptors = deserialize_features(blob)
+    with _template_cache_lock:
+        if template_path not in _template_cache:
+            _template_cache[template_path] = (None, None, None, keypoints, descriptors, None)
+
+
+def forget_template_features(template_path):
+    """模板刪除或以同名重新加入時丟棄快取（預先載入的特徵沒有修改時間，不會因檔案改變而失效）"""
+    with _template_cache_lock:
+        _template_cache.pop(template_path, None)
+
+
+class _StageTimer:
+    """依序記錄各階段耗時；未傳入 dict 時不做任何事"""
+
+    def __init__(self, timings):
+        self.timings = timings
+        self.last = time.perf_counter()
+
+    def __call__(self, name):
+        if self.timings is None:
+            return
+        now = time.perf_counter()
+        self.timings[name] = self.timings.get(name, 0.0) + (now - self.last) * 1000
+        self.last = now
+
+
 # 精確匹配函數
 def refined_template_matching(template, search_area):
     if template.shape[0] > search_area.shape[0] or template.shape[1] > search_area.shape[1]:
@@ -28,70 +151,461 @@ def refined_template_matching(template, search_area):
     return (top_left, bottom_right, max_val)
 
 
-def mixed_template_match(template_path, frame_path='../adb_backend/screenshots/screenshot.png'):
-    frame = cv2.imread(frame_path)
+# 縮放估計：RANSAC 內點數下限、可接受的縮放範圍，以及視為不需縮放的誤差
+MIN_SCALE_INLIERS = 5
+SCALE_RANGE = (0.25, 4.0)
+SCALE_TOLERANCE = 0.05
+
+# 多目標比對：回應圖上的峰值門檻、峰值框重疊上限 (IoU) 與最多回傳數量
+MULTI_MATCH_THRESHOLD = 0.8
+MULTI_MATCH_OVERLAP = 0.3
+MULTI_MATCH_LIMIT = 100
+
+
+def suppress_overlaps(boxes, scores, max_overlap=MULTI_MATCH_OVERLAP):
+    """
+    非極大值抑制：依分數由高到低保留，與已保留框的 IoU 超過 max_overlap 的框丟棄
+
+    boxes: (N, 4) 的 x1, y1, x2, y2；一次計算所有框兩兩的 IoU 矩陣
+    Returns:
+        保留下來的索引（分數由高到低）
+    """
+    order = np.argsort(-scores)
+    boxes = boxes[order].astype(np.float32)
+    x1, y1, x2, y2 = boxes.T
+    areas = (x2 - x1) * (y2 - y1)
+    iw = np.clip(np.minimum(x2[:, None], x2[None, :]) - np.maximum(x1[:, None], x1[None, :]), 0, None)
+    ih = np.clip(np.minimum(y2[:, None], y2[None, :]) - np.maximum(y1[:, None], y1[None, :]), 0, None)
+    inter = iw * ih
+    iou = inter / (areas[:, None] + areas[None, :] - inter + 1e-6)
+    # 只看分數更高的框 (上三角)；被抑制的框不再抑制別人，依序掃過即可
+    overlaps = np.triu(iou > max_overlap, k=1)
+    keep = np.ones(len(order), dtype=bool)
+    for i in range(len(order)):
+        if keep[i]:
+            keep[i + 1:] &= ~overlaps[i, i + 1:]
+    return order[keep]
+
+
+def reading_order(matches, row_tolerance):
+    """由上而下、同一列由左而右排序；中心 y 相差不到 row_tolerance 視為同一列"""
+    matches = sorted(matches, key=lambda m: m['y'])
+    rows, row_y = [], None
+    for match in matches:
+        if row_y is None or match['y'] - row_y > row_tolerance:
+            rows.append([])
+            row_y = match['y']
+        rows[-1].append(match)
+    return [match for row in rows for match in sorted(row, key=lambda m: m['x'])]
+
+
+def find_all_matches(template_path, frame_path='../adb_backend/screenshots/screenshot.png', frame=None,
+                     threshold=MULTI_MATCH_THRESHOLD, max_overlap=MULTI_MATCH_OVERLAP,
+                     limit=MULTI_MATCH_LIMIT, timings=None, scale=None, screen=None):
+    """
+    找出畫面上模板的所有出現位置（例如列表中每一列的同一個圖示）
+
+    整張畫面只做一次 matchTemplate；回應圖以 dilate 找出局部最大值
+    （鄰域為模板大小的一半），高於門檻的峰值再做一次向量化 NMS。
+    scale 為模板在這台裝置上的縮放（見 DeviceScaleCache）。
+    screen 為 frame_cache.Frame（例如執行中固定的畫面），前處理結果與其他呼叫端共用。
+
+    Returns:
+        [{'x', 'y', 'box': [x1, y1, x2, y2], 'score'}, ...]，依閱讀順序排列；
+        讀不到畫面或模板時回傳 None
+    """
+    stage = _StageTimer(timings)
     if frame is None:
-        frame = cv2.imread('../adb_backend/screenshots/screenshot1.png')
-    template = cv2.imread(template_path)
-    if frame is None or template is None:
+        # 截圖檔依內容快取，同一張畫面只解碼、前處理一次
+        if screen is None:
+            screen = screen_frames.load(frame_path)
+        frame = screen.image if screen else None
+    else:
+        screen = None
+    features = get_template_features(template_path)
+    stage('load')
+    if frame is None or features is None:
         return None
-    # 預處理圖片
-    top_left_global, bottom_right_global = None, None
-    template_preprocessed = preprocess_image(template)
+    template_preprocessed = rescale(features[1], scale)
+    frame_preprocessed = screen.derive('preprocessed', preprocess_image) if screen else preprocess_image(frame)
+    stage('preprocess')
+
+    h, w = template_preprocessed.shape[:2]
+    if h > frame_preprocessed.shape[0] or w > frame_preprocessed.shape[1]:
+        return []
+    response = cv2.matchTemplate(frame_preprocessed, template_preprocessed, cv2.TM_CCOEFF_NORMED)
+    stage('match')
+
+    # 峰值：等於鄰域最大值且高於門檻
+    kernel = np.ones((max(h // 2, 1) | 1, max(w // 2, 1) | 1), np.uint8)
+    peaks = (response >= threshold) & (response >= cv2.dilate(response, kernel))
+    ys, xs = np.nonzero(peaks)
+    if len(xs) == 0:
+        stage('nms')
+        return []
+    scores = response[ys, xs]
+    if len(scores) > limit * 4:
+        # 峰值過多時（例如重複的紋理）只留分數最高的一部分做 NMS
+        top = np.argpartition(-scores, limit * 4)[:limit * 4]
+        xs, ys, scores = xs[top], ys[top], scores[top]
+    boxes = np.stack([xs, ys, xs + w, ys + h], axis=1)
+    keep = suppress_overlaps(boxes, scores, max_overlap)[:limit]
+    stage('nms')
+
+    matches = [{
+        'x': int(boxes[i, 0] + w // 2),
+        'y': int(boxes[i, 1] + h // 2),
+        'box': [int(v) for v in boxes[i]],
+        'score': round(float(scores[i]), 4),
+    } for i in keep]
+    return reading_order(matches, row_tolerance=h / 2)
+
+
+def estimate_similarity(template_pts, frame_pts):
+    """
+    以 RANSAC 從 SIFT 對應點估計模板到畫面的相似變換（平移、旋轉、等比縮放）
+
+    Returns:
+        (scale, 2x3 矩陣, 內點數)；對應點不足或估計失敗時回傳 None
+    """
+    if len(template_pts) < MIN_SCALE_INLIERS:
+        return None
+    matrix, inliers = cv2.estimateAffinePartial2D(template_pts, frame_pts, method=cv2.RANSAC,
+                                                  ransacReprojThreshold=5.0)
+    if matrix is None:
+        return None
+    inlier_count = int(inliers.sum())
+    scale = float(np.hypot(matrix[0, 0], matrix[1, 0]))
+    if inlier_count < MIN_SCALE_INLIERS or not SCALE_RANGE[0] <= scale <= SCALE_RANGE[1]:
+        return None
+    return scale, matrix, inlier_count
+
+
+# SIFT 比對：Lowe 比率檢定門檻，以及每次計算的距離矩陣元素數（控制記憶體）
+SIFT_RATIO = 0.75
+MATCH_CHUNK_ELEMENTS = 1 << 17
+# 找聚集處時最多使用的匹配點數（距離最近的優先），大模板的匹配點多半是雜訊
+CLUSTER_MAX_POINTS = 300
+
+
+def compute_frame_features(frame, stage=None):
+    """
+    畫面的 SIFT 特徵
+
+    Returns:
+        (特徵點座標 (N, 2) float32, descriptors)
+    """
     frame_preprocessed = preprocess_image(frame)
+    if stage:
+        stage('preprocess')
+    keypoints, descriptors = cv2.SIFT_create().detectAndCompute(frame_preprocessed, None)
+    if stage:
+        stage('sift')
+    return keypoint_array(keypoints), descriptors
+
+
+def match_descriptors(des1, des2, ratio=SIFT_RATIO):
+    """
+    模板與畫面描述子的暴力比對 (L2)，以矩陣運算求距離
+
+    保留互為最近鄰的配對（同 BFMatcher crossCheck）；另標記通過比率檢定
+    （最近距離 < ratio * 次近距離）的配對，這些配對較不會落在重複的紋理上。
+
+    Returns:
+        (模板索引, 畫面索引, 距離, 通過比率檢定的 bool 陣列)
+    """
+    # SIFT 描述子為 0~255 的整數，float64 下距離是精確值；float32 的 |a|^2 + |b|^2 - 2ab
+    # 會因相消而誤差，最近鄰幾乎相同時選到與 crossCheck 不同的點
+    des1 = np.asarray(des1, np.float64)
+    des2 = np.asarray(des2, np.float64)
+    n1, n2 = len(des1), len(des2)
+    train_sq = np.einsum('ij,ij->i', des2, des2)
+    best = np.empty(n1, np.int64)
+    best_d = np.empty(n1)
+    second_d = np.full(n1, np.inf)
+    col_best = np.zeros(n2, np.int64)
+    col_best_d = np.full(n2, np.inf)
+    chunk_rows = max(MATCH_CHUNK_ELEMENTS // max(n2, 1), 1)
+    for start in range(0, n1, chunk_rows):
+        block = des1[start:start + chunk_rows]
+        # 平方距離 |a|^2 + |b|^2 - 2ab
+        d = np.einsum('ij,ij->i', block, block)[:, None] + train_sq[None, :] - 2 * block @ des2.T
+        rows = np.arange(len(block))
+        # argmin 取第一個最小值，距離相同時與 BFMatcher 一樣選索引小的點
+        nearest = d.argmin(axis=1)
+        best[start:start + len(block)] = nearest
+        best_d[start:start + len(block)] = d[rows, nearest]
+        block_col = d.argmin(axis=0)
+        block_col_d = d[block_col, np.arange(n2)]
+        if n2 >= 2:
+            d[rows, nearest] = np.inf
+            second_d[start:start + len(block)] = d.min(axis=1)
+        better = block_col_d < col_best_d
+        col_best[better] = block_col[better] + start
+        col_best_d[better] = block_col_d[better]
+
+    query_idx = np.nonzero(col_best[best] == np.arange(n1))[0]
+    train_idx = best[query_idx]
+    # 平方距離，比率取平方
+    distinctive = best_d[query_idx] < (ratio * ratio) * second_d[query_idx]
+    return query_idx, train_idx, np.sqrt(np.maximum(best_d[query_idx], 0)), distinctive
+
+
+def match_clusters(points, extent, weights=None, limit=3):
+    """
+    匹配點的聚集處，作為精確比對的搜尋範圍
+
+    每次取鄰域（中心距離在 extent (寬, 高) 之內）權重最大的點，以其鄰域的
+    邊界框為一個候選，移除後重複（第一個之後只剩單點時停止）。零星的誤配不會把搜尋範圍撐到整個畫面，
+    畫面上有相似圖示時，真正的目標仍會是其中一個候選。
+
+    Returns:
+        [(x_min, y_min, x_max, y_max), ...]，依權重由大到小，最多 limit 個
+    """
+    points = np.asarray(points, np.float32)
+    weights = np.ones(len(points), np.float32) if weights is None else np.asarray(weights, np.float32)
+    extent = np.asarray(extent, np.float32)
+    near = ((np.abs(points[:, None, 0] - points[None, :, 0]) <= extent[0])
+            & (np.abs(points[:, None, 1] - points[None, :, 1]) <= extent[1]))
+    remaining = np.ones(len(points), dtype=bool)
+    boxes = []
+    while remaining.any() and len(boxes) < limit:
+        support = (near & remaining[None, :]) @ weights
+        support[~remaining] = -1
+        members = near[int(np.argmax(support))] & remaining
+        if boxes and members.sum() < 2:
+            # 之後只剩零星的單點，不值得再做一次比對
+            break
+        cluster = points[members]
+        boxes.append((*np.floor(cluster.min(axis=0)).astype(int), *np.ceil(cluster.max(axis=0)).astype(int)))
+        remaining &= ~members
+    return boxes
+
+
+def rescale(image, scale):
+    """依比例縮放模板；與 1 相差不到 SCALE_TOLERANCE 時不處理"""
+    if scale is None or abs(scale - 1.0) <= SCALE_TOLERANCE:
+        return image
+    interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+    h, w = image.shape[:2]
+    return cv2.resize(image, (max(int(round(w * scale)), 1), max(int(round(h * scale)), 1)),
+                      interpolation=interpolation)
 
-    # 初始化 SIFT 檢測器
-    sift = cv2.SIFT_create()
 
-    # 提取模板和場景的特徵點和描述子
-    kp1, des1 = sift.detectAndCompute(template_preprocessed, None)
-    kp2, des2 = sift.detectAndCompute(frame_preprocessed, None)
+class DeviceScaleCache:
+    """
+    各裝置上模板的實際縮放比例（SIFT 估計值的中位數）
 
-    # 匹配特徵點
-    bf = cv2.BFMatcher(cv2.NORM_L2, crossCheck=True)
+    以 (裝置, 模板來源密度) 為鍵：同一台裝置上，來自同一密度手機的模板縮放相同。
+    SIFT 對應點太少、無法估計時，以這裡學到的比例放大/縮小模板。
+    """
+
+    def __init__(self, history=20, min_samples=3):
+        self.history = history
+        self.min_samples = min_samples
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def observe(self, key, scale):
+        with self._lock:
+            samples = self._samples.setdefault(key, [])
+            samples.append(scale)
+            del samples[:-self.history]
+
+    def get(self, key):
+        with self._lock:
+            samples = self._samples.get(key)
+            if not samples or len(samples) < self.min_samples:
+                return None
+            return float(np.median(samples))
+
+    def snapshot(self):
+        with self._lock:
+            return {f"{key[0]}@{key[1]}": {'scale': round(float(np.median(v)), 4), 'samples': len(v)}
+                    for key, v in self._samples.items()}
+
+
+def mixed_template_match(template_path, frame_path='../adb_backend/screenshots/screenshot.png', frame=None,
+                         timings=None, info=None, scale=None, frame_features=None, screen=None):
+    # frame: 直接傳入 BGR 畫面（例如錄影回放），不讀取截圖檔
+    # screen: frame_cache.Frame（例如執行中固定的畫面），SIFT 特徵與其他呼叫端共用
+    # frame_features: compute_frame_features(frame) 的結果；同一張畫面比對多個模板時共用
+    # timings: 傳入 dict 時記錄各階段耗時 (ms)，供 benchmark.py 使用
+    # info: 傳入 dict 時填入精確比對的信心值與框 (confidence, box)、採用的縮放 (scale, scale_source)
+    # scale: 預期的模板縮放（裝置密度不同時），SIFT 無法估計縮放時使用
+    stage = _StageTimer(timings)
+    if frame is None:
+        # 截圖檔依內容快取：同一張畫面（輪詢靜止畫面、預取過的畫面）的 SIFT 特徵只算一次
+        if screen is None:
+            screen = screen_frames.load(frame_path)
+        frame = screen.image if screen else None
+    else:
+        screen = None
+    features = get_template_features(template_path)
+    stage('load')
+    if frame is None or features is None:
+        return None
+    template, template_preprocessed, _, des1, template_kp = features
+    if frame_features is None:
+        if screen is not None:
+            frame_features = screen.derive('sift', lambda image: compute_frame_features(image, stage))
+        else:
+            frame_features = compute_frame_features(frame, stage)
+    frame_kp, des2 = frame_features
     if des1 is None or des2 is None:
         return None
-    matches = bf.match(des1, des2)
 
-    # 按距離排序匹配結果
-    matches = sorted(matches, key=lambda x: x.distance)
+    # 匹配特徵點（互為最近鄰，等同 crossCheck）
+    query_idx, train_idx, distances, distinctive = match_descriptors(des1, des2)
+    stage('match')
 
     # 獲取匹配點的位置
-    if len(matches) > 1:
-        matched_pts = np.float32([kp2[m.trainIdx].pt for m in matches[:]])  # 匹配點的場景位置
-
-        # 計算匹配點的邊界框
-        x_min, y_min = np.min(matched_pts, axis=0).astype(int)
-        x_max, y_max = np.max(matched_pts, axis=0).astype(int)
-
-        # 確保邊界框比模板大
-        h, w = template_preprocessed.shape
-        margin_x = int(w/2)  # 增加一定邊距
-        margin_y = int(h/2)  # 增加一定邊距
-        x_min = max(x_min - margin_x, 0)
-        y_min = max(y_min - margin_y, 0)
-        x_max = min(x_max + margin_x, frame.shape[1])
-        y_max = min(y_max + margin_y, frame.shape[0])
-
-        # 裁剪出搜索區域
-        search_area = frame[y_min:y_max, x_min:x_max]
-
-        # 在搜索區域內進行模板匹配
-        top_left, bottom_right, confidence = refined_template_matching(template_preprocessed, preprocess_image(search_area))
-        if top_left is None:
-            return None
-        # 調整坐標到全局範圍
-        top_left_global = (top_left[0] + x_min, top_left[1] + y_min)
-        bottom_right_global = (bottom_right[0] + x_min, bottom_right[1] + y_min)
-
-        center = (int((top_left_global[0]+bottom_right_global[0])/2), int((top_left_global[1]+bottom_right_global[1])/2))
-        
-        if confidence < 0.75:
-            # print("not found")
-            return None
-        #print(f"精確匹配信心值: {confidence}")
-    else:
+    if len(query_idx) <= 1:
         print("沒有匹配到足夠的特徵點。")
         return None
-    #print("found!")
-    return center
\ No newline at end of file
+    matched_pts = frame_kp[train_idx]  # 匹配點的場景位置
+    template_pts = template_kp[query_idx]
+    h, w = template_preprocessed.shape
+
+    # 由對應點估計模板在畫面上的縮放與位置（不同密度的裝置上模板大小不同）
+    estimate = estimate_similarity(template_pts, matched_pts)
+    if estimate is not None:
+        used_scale, matrix, _ = estimate
+        scale_source = 'sift'
+    else:
+        used_scale = scale if scale else 1.0
+        scale_source = 'hint' if scale else 'none'
+    # 匹配點的聚集處；通過比率檢定的點較可靠，權重加倍
+    nearest = np.argsort(distances)[:CLUSTER_MAX_POINTS]
+    search_boxes = match_clusters(matched_pts[nearest], (w * used_scale, h * used_scale),
+                                  weights=1 + distinctive[nearest])
+    if estimate is not None:
+        corners = np.float32([[0, 0], [w, 0], [w, h], [0, h]])
+        projected = corners @ matrix[:, :2].T + matrix[:, 2]
+        ransac_box = (*np.floor(projected.min(axis=0)).astype(int), *np.ceil(projected.max(axis=0)).astype(int))
+        # 內點可能落在相似的其他圖示上，找不到時再搜尋其他聚集處
+        search_boxes.insert(0, ransac_box)
+    template_scaled = rescale(template_preprocessed, used_scale)
+    stage('scale')
+
+    for search_box in search_boxes:
+        result = refine_in_box(frame, template_scaled, search_box)
+        if result is None:
+            continue
+        top_left_global, bottom_right_global, confidence = result
+        if confidence >= 0.75:
+            break
+    stage('refine')
+    if result is None:
+        return None
+
+    center = (int((top_left_global[0]+bottom_right_global[0])/2), int((top_left_global[1]+bottom_right_global[1])/2))
+    if info is not None:
+        info['confidence'] = round(float(confidence), 4)
+        info['box'] = [int(v) for v in (*top_left_global, *bottom_right_global)]
+        info['scale'] = round(float(used_scale), 4)
+        info['scale_source'] = scale_source
+
+    if confidence < 0.75:
+        # print("not found")
+        return None
+    #print(f"精確匹配信心值: {confidence}")
+    return center
+
+
+def refine_in_box(frame, template_preprocessed, box):
+    """
+    在 box (x_min, y_min, x_max, y_max) 周圍以模板做精確比對
+
+    Returns:
+        (全域左上, 全域右下, 信心值)；模板比畫面大時回傳 None
+    """
+    x_min, y_min, x_max, y_max = box
+    # 確保邊界框比模板大
+    h, w = template_preprocessed.shape
+    if h > frame.shape[0] or w > frame.shape[1]:
+        return None
+    margin_x = int(w/2)  # 增加一定邊距
+    margin_y = int(h/2)  # 增加一定邊距
+    x_min = max(x_min - margin_x, 0)
+    y_min = max(y_min - margin_y, 0)
+    x_max = min(x_max + margin_x, frame.shape[1])
+    y_max = min(y_max + margin_y, frame.shape[0])
+    # 搜索區域比模板小時（對應點集中在模板一角）向外擴大，而不是放棄比對
+    if x_max - x_min < w:
+        x_min = max(min(x_min, frame.shape[1] - w), 0)
+        x_max = x_min + w
+    if y_max - y_min < h:
+        y_min = max(min(y_min, frame.shape[0] - h), 0)
+        y_max = y_min + h
+
+    # 裁剪出搜索區域
+    search_area = frame[y_min:y_max, x_min:x_max]
+
+    # 在搜索區域內進行模板匹配
+    top_left, bottom_right, confidence = refined_template_matching(template_preprocessed, preprocess_image(search_area))
+    if top_left is None:
+        return None
+    # 調整坐標到全局範圍
+    return ((top_left[0] + x_min, top_left[1] + y_min),
+            (bottom_right[0] + x_min, bottom_right[1] + y_min),
+            confidence)
+
+
+def prefetch_frame(frame_path='../adb_backend/screenshots/screenshot.png', sift=True, screen=None):
+    """
+    預先解碼畫面並計算 SIFT 特徵（sift=False 時只做前處理，供 find_all_matches）
+
+    結果掛在畫面上（frame_cache），之後比對同一張畫面時直接取用；screen 未指定時讀取截圖檔
+
+    Returns:
+        是否讀到畫面
+    """
+    if screen is None:
+        screen = screen_frames.load(frame_path)
+    if screen is None or screen.image is None:
+        return False
+    if sift:
+        screen.derive('sift', compute_frame_features)
+    else:
+        screen.derive('preprocessed', preprocess_image)
+    return True
+
+
+def batch_template_match(template_paths, frame_path='../adb_backend/screenshots/screenshot.png', frame=None,
+                         screen=None):
+    """
+    在同一張畫面上比對多個模板，畫面只讀取一次、SIFT 特徵只計算一次，重複的路徑只比對一次
+
+    screen 為 frame_cache.Frame 時比對這張畫面，否則讀取截圖檔
+
+    Returns:
+        {template_path: center 或 None}
+    """
+    if frame is None:
+        if screen is None:
+            screen = screen_frames.load(frame_path)
+        if screen is None or screen.image is None:
+            return {path: None for path in template_paths}
+        frame, features = screen.image, screen.derive('sift', compute_frame_features)
+    else:
+        features = compute_frame_features(frame)
+    return {path: mixed_template_match(path, frame=frame, frame_features=features)
+            for path in dict.fromkeys(template_paths)}
+
+
+def batch_find_all_matches(template_paths, frame_path='../adb_backend/screenshots/screenshot.png', frame=None,
+                           screen=None):
+    """
+    batch_template_match 的多目標版本
+
+    Returns:
+        {template_path: [match, ...] 或 None}
+    """
+    if frame is None:
+        if screen is None:
+            screen = screen_frames.load(frame_path)
+        if screen is None or screen.image is None:
+            return {path: None for path in template_paths}
+        return {path: find_all_matches(path, screen=screen) for path in dict.fromkeys(template_paths)}
+    return {path: find_all_matches(path, frame=frame) for path in dict.fromkeys(template_paths)}
@@ -0,0 +1,552 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from PIL import Image
+
+from image_hash import BKTree, from_hex, hamming, image_fingerprint
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS templates (
+    id          TEXT PRIMARY KEY,
+    name        TEXT NOT NULL,
+    width       INTEGER,
+    height      INTEGER,
+    size_bytes  INTEGER,
+    sha256      TEXT,
+    matcher     TEXT NOT NULL DEFAULT 'mixed',
+    last_roi    TEXT,
+    features    BLOB,
+    phash       TEXT,
+    dhash       TEXT,
+    alias_of    TEXT,
+    density     INTEGER,
+    created_at  REAL NOT NULL,
+    updated_at  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_templates_sha256 ON templates(sha256);
+CREATE INDEX IF NOT EXISTS idx_templates_created ON templates(created_at);
+CREATE TABLE IF NOT EXISTS store_meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# 只回傳給前端/API 的欄位（features 可能很大，不放進列表）
+PUBLIC_COLUMNS = ("id, name, width, height, size_bytes, sha256, matcher, last_roi, phash, alias_of, density, "
+                  "created_at, updated_at")
+
+# 舊版資料庫缺少的欄位，啟動時以 ALTER TABLE 補上
+MIGRATIONS = {
+    'phash': 'ALTER TABLE templates ADD COLUMN phash TEXT',
+    'dhash': 'ALTER TABLE templates ADD COLUMN dhash TEXT',
+    'alias_of': 'ALTER TABLE templates ADD COLUMN alias_of TEXT',
+    'density': 'ALTER TABLE templates ADD COLUMN density INTEGER',
+}
+
+# 儲存時遇到近似重複模板的處理方式
+#   alias: 新增為別名，比對時直接使用原模板
+#   merge: 不新增，回傳原模板
+#   keep:  照常新增為獨立模板
+DEDUP_MODES = ('alias', 'merge', 'keep')
+
+# 視為近似重複的最大漢明距離 (64 位元 pHash / dHash)
+DUPLICATE_DISTANCE = 6
+DHASH_DISTANCE = 12
+# 長寬比差異上限，避免形狀不同但縮圖相似的模板被合併
+ASPECT_TOLERANCE = 0.15
+
+
+class TemplateStore:
+    """
+    模板庫：SQLite 索引 + templates/ 目錄中的圖片檔
+
+    - 每次儲存在單一交易中完成檔名分配與寫入，並發儲存不會互相覆蓋
+    - 前端用的 templates.json 只在內容變動後才重新產生（export_json）
+    - 以 pHash 建立 BK-tree 偵測近似重複的模板；別名 (alias_of) 在比對時
+      解析回原模板，比對成本只隨不同的 UI 元素增加
+    """
+
+    def __init__(self, templates_dir: str, db_path: Optional[str] = None,
+                 json_path: Optional[str] = None):
+        """
+        初始化模板庫
+
+        Args:
+            templates_dir: 模板圖片目錄
+            db_path: SQLite 檔案路徑 (預設 templates_dir/templates.db)
+            json_path: 前端 templates.json 路徑 (選填)
+        """
+        self.templates_dir = templates_dir
+        self.json_path = json_path
+        os.makedirs(templates_dir, exist_ok=True)
+        self.db_path = db_path or os.path.join(templates_dir, 'templates.db')
+
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+        self._migrate()
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_templates_alias ON templates(alias_of)')
+        self._exported_generation = None
+
+        if self.count() == 0:
+            self._import_existing()
+        self._backfill_fingerprints()
+        self._hash_index = BKTree()
+        self._build_hash_index()
+
+    # ------------------------------------------------------------------
+    # 內部工具
+    # ------------------------------------------------------------------
+    def _generation(self) -> int:
+        row = self._conn.execute("SELECT value FROM store_meta WHERE key = 'generation'").fetchone()
+        return int(row['value']) if row else 0
+
+    def _bump_generation(self) -> None:
+        self._conn.execute(
+            "INSERT INTO store_meta(key, value) VALUES('generation', '1') "
+            "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"
+        )
+
+    def _migrate(self) -> None:
+        columns = {row['name'] for row in self._conn.execute('PRAGMA table_info(templates)')}
+        for column, statement in MIGRATIONS.items():
+            if column not in columns:
+                self._conn.execute(statement)
+
+    def _backfill_fingerprints(self) -> None:
+        """補算舊資料沒有的感知雜湊"""
+        for row in self._query('SELECT id FROM templates WHERE phash IS NULL'):
+            path = self.path_of(row['id'])
+            if not os.path.exists(path):
+                continue
+            try:
+                fingerprint = image_fingerprint(path)
+            except Exception as e:
+                print(f"Skip fingerprint of {row['id']}: {e}")
+                continue
+            with self._lock:
+                self._conn.execute('UPDATE templates SET phash = ?, dhash = ? WHERE id = ?',
+                                   (fingerprint['phash'], fingerprint['dhash'], row['id']))
+
+    def _build_hash_index(self) -> None:
+        """只索引原模板；別名與原模板共用同一組雜湊"""
+        with self._lock:
+            self._hash_index = BKTree()
+            for row in self._conn.execute(
+                    'SELECT id, phash FROM templates WHERE phash IS NOT NULL AND alias_of IS NULL '
+                    'ORDER BY created_at'):
+                self._hash_index.add(from_hex(row['phash']), row['id'])
+
+    @staticmethod
+    def _row(row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+        if row is None:
+            return None
+        item = dict(row)
+        if item.get('last_roi'):
+            item['last_roi'] = json.loads(item['last_roi'])
+        return item
+
+    @staticmethod
+    def _describe(path: str) -> Dict[str, Any]:
+        """讀取圖片尺寸、大小與雜湊"""
+        with open(path, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        with Image.open(path) as img:
+            width, height = img.size
+        return {
+            'width': width,
+            'height': height,
+            'size_bytes': os.path.getsize(path),
+            'sha256': digest,
+            **image_fingerprint(path),
+        }
+
+    def _import_existing(self) -> None:
+        """第一次使用時匯入既有的 templates.json 與 templates/ 中的圖片"""
+        names = {}
+        if self.json_path and Path(self.json_path).exists():
+            try:
+                with open(self.json_path, 'r', encoding='utf-8') as f:
+                    for entry in json.load(f):
+                        if isinstance(entry, dict) and entry.get('id'):
+                            names[entry['id']] = entry.get('name') or entry['id'].rsplit('.', 1)[0]
+            except (json.JSONDecodeError, TypeError):
+                pass
+
+        for filename in sorted(os.listdir(self.templates_dir)):
+            if filename.lower().endswith('.png') and filename not in names:
+                names[filename] = filename.rsplit('.', 1)[0]
+
+        with self._lock:
+            now = time.time()
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                for template_id, name in names.items():
+                    path = os.path.join(self.templates_dir, template_id)
+                    if not os.path.exists(path):
+                        continue
+                    try:
+                        info = self._describe(path)
+                    except Exception as e:
+                        print(f"Skip template {template_id}: {e}")
+                        continue
+                    self._conn.execute(
+                        "INSERT OR IGNORE INTO templates(id, name, width, height, size_bytes, sha256, "
+                        "phash, dhash, created_at, updated_at) VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (template_id, name, info['width'], info['height'], info['size_bytes'],
+                         info['sha256'], info['phash'], info['dhash'], now, now)
+                    )
+                    now += 1e-6  # 保持匯入順序
+                self._bump_generation()
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        print(f"Imported {len(names)} templates into {self.db_path}")
+
+    # ------------------------------------------------------------------
+    # 查詢
+    # ------------------------------------------------------------------
+    def _query(self, sql: str, params: tuple = ()) -> List[sqlite3.Row]:
+        # 同一個連線由多個執行緒共用，查詢也在鎖內進行
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def count(self) -> int:
+        return self._query('SELECT COUNT(*) FROM templates')[0][0]
+
+    def get(self, template_id: str) -> Optional[Dict[str, Any]]:
+        rows = self._query(f'SELECT {PUBLIC_COLUMNS} FROM templates WHERE id = ?', (template_id,))
+        return self._row(rows[0]) if rows else None
+
+    def list(self) -> List[Dict[str, Any]]:
+        rows = self._query(f'SELECT {PUBLIC_COLUMNS} FROM templates ORDER BY created_at')
+        return [self._row(row) for row in rows]
+
+    def find_by_hash(self, sha256: str) -> List[Dict[str, Any]]:
+        rows = self._query(f'SELECT {PUBLIC_COLUMNS} FROM templates WHERE sha256 = ?', (sha256,))
+        return [self._row(row) for row in rows]
+
+    def iter_features(self):
+        """逐筆回傳已預先計算的 (id, features)"""
+        for row in self._query('SELECT id, features FROM templates WHERE features IS NOT NULL'):
+            yield row['id'], row['features']
+
+    def path_of(self, template_id: str) -> str:
+        return os.path.join(self.templates_dir, template_id)
+
+    # ------------------------------------------------------------------
+    # 近似重複與別名
+    # ------------------------------------------------------------------
+    def _near_duplicates(self, fingerprint: Dict[str, Any], max_distance: int,
+                         exclude: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        以 BK-tree 找出 pHash 距離在範圍內的原模板，再用 dHash 與長寬比過濾
+
+        Returns:
+            [{'id', 'distance', 'dhash_distance'}]，依距離排序
+        """
+        if not fingerprint.get('phash'):
+            return []
+        phash, dhash = from_hex(fingerprint['phash']), from_hex(fingerprint['dhash'])
+        aspect = fingerprint['width'] / max(fingerprint['height'], 1)
+        dhash_limit = DHASH_DISTANCE + max(max_distance - DUPLICATE_DISTANCE, 0)
+
+        with self._lock:
+            candidates = self._hash_index.search(phash, max_distance)
+        results = []
+        for distance, candidate_id in candidates:
+            if candidate_id == exclude:
+                continue
+            rows = self._query('SELECT width, height, dhash FROM templates WHERE id = ?', (candidate_id,))
+            if not rows or not rows[0]['dhash']:
+                continue
+            row = rows[0]
+            dhash_distance = hamming(dhash, from_hex(row['dhash']))
+            other_aspect = row['width'] / max(row['height'], 1)
+            if dhash_distance > dhash_limit or abs(aspect - other_aspect) > ASPECT_TOLERANCE * other_aspect:
+                continue
+            results.append({'id': candidate_id, 'distance': distance, 'dhash_distance': dhash_distance})
+        return results
+
+    def find_duplicates(self, template_id: str, max_distance: int = DUPLICATE_DISTANCE) -> List[Dict[str, Any]]:
+        """
+        列出與模板近似的原模板，以及同一組的別名
+        """
+        rows = self._query('SELECT id, width, height, phash, dhash, alias_of FROM templates WHERE id = ?',
+                           (template_id,))
+        if not rows:
+            return []
+        row = dict(rows[0])
+        canonical = row['alias_of'] or template_id
+        duplicates = self._near_duplicates(row, max_distance, exclude=canonical)
+        if canonical != template_id:
+            duplicates.insert(0, {'id': canonical, 'distance': 0, 'dhash_distance': 0, 'canonical': True})
+        for alias in self.aliases_of(canonical):
+            if alias != template_id:
+                duplicates.append({'id': alias, 'alias_of': canonical})
+        return duplicates
+
+    def aliases_of(self, template_id: str) -> List[str]:
+        rows = self._query('SELECT id FROM templates WHERE alias_of = ? ORDER BY created_at', (template_id,))
+        return [row['id'] for row in rows]
+
+    def resolve(self, template_id: str) -> str:
+        """回傳實際用來比對的原模板 id（不是別名時回傳自己）"""
+        rows = self._query('SELECT alias_of FROM templates WHERE id = ?', (template_id,))
+        if rows and rows[0]['alias_of']:
+            return rows[0]['alias_of']
+        return template_id
+
+    def resolve_many(self, template_ids: List[str]) -> Dict[str, str]:
+        """批次解析別名: {id: 原模板 id}"""
+        resolved = {template_id: template_id for template_id in template_ids}
+        if not template_ids:
+            return resolved
+        placeholders = ', '.join('?' for _ in template_ids)
+        rows = self._query(
+            f'SELECT id, alias_of FROM templates WHERE alias_of IS NOT NULL AND id IN ({placeholders})',
+            tuple(template_ids)
+        )
+        for row in rows:
+            resolved[row['id']] = row['alias_of']
+        return resolved
+
+    def set_alias(self, template_id: str, canonical_id: Optional[str]) -> None:
+        """
+        把模板設為另一個模板的別名；canonical_id 為 None 時恢復為獨立模板
+
+        模板圖片檔會保留，取消別名後可直接再使用。
+        """
+        with self._lock:
+            rows = self._conn.execute('SELECT phash, alias_of FROM templates WHERE id = ?',
+                                      (template_id,)).fetchone()
+            if rows is None:
+                raise KeyError(template_id)
+            if canonical_id is not None:
+                canonical_id = self.resolve(canonical_id)
+                if canonical_id == template_id:
+                    raise ValueError("Template cannot alias itself")
+                if not self._conn.execute('SELECT 1 FROM templates WHERE id = ?', (canonical_id,)).fetchone():
+                    raise KeyError(canonical_id)
+
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._conn.execute('UPDATE templates SET alias_of = ?, updated_at = ? WHERE id = ?',
+                                   (canonical_id, time.time(), template_id))
+                if canonical_id is not None:
+                    # 原本指向此模板的別名一併改指向新的原模板
+                    self._conn.execute('UPDATE templates SET alias_of = ? WHERE alias_of = ?',
+                                       (canonical_id, template_id))
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+
+            if rows['phash']:
+                if canonical_id is None and rows['alias_of'] is not None:
+                    self._hash_index.add(from_hex(rows['phash']), template_id)
+                elif canonical_id is not None and rows['alias_of'] is None:
+                    self._hash_index.remove(from_hex(rows['phash']), template_id)
+
+    def dedup(self, max_distance: int = DUPLICATE_DISTANCE, dry_run: bool = False) -> List[Dict[str, Any]]:
+        """
+        掃描整個模板庫，把近似重複的模板設為最早建立者的別名
+
+        Returns:
+            [{'canonical': id, 'aliases': [id, ...]}]
+        """
+        rows = self._query('SELECT id, width, height, phash, dhash FROM templates '
+                           'WHERE alias_of IS NULL AND phash IS NOT NULL ORDER BY created_at')
+        merged = set()
+        groups = []
+        for row in rows:
+            if row['id'] in merged:
+                continue
+            aliases = [dup['id'] for dup in self._near_duplicates(dict(row), max_distance, exclude=row['id'])
+                       if dup['id'] not in merged]
+            if not aliases:
+                continue
+            merged.update(aliases)
+            merged.add(row['id'])
+            groups.append({'canonical': row['id'], 'aliases': aliases})
+
+        if not dry_run:
+            for group in groups:
+                for alias in group['aliases']:
+                    self.set_alias(alias, group['canonical'])
+        return groups
+
+    # ------------------------------------------------------------------
+    # 寫入
+    # ------------------------------------------------------------------
+    def add_file(self, filename: str, source_path: str, name: Optional[str] = None,
+                 dedup: str = 'keep') -> Dict[str, Any]:
+        """
+        把已驗證的暫存圖片檔加入模板庫
+
+        同名時在檔名後加 `_`（與原本的行為相同），檔名分配與搬移在同一把鎖內完成。
+
+        Args:
+            filename: 想要的檔名 (不含 .png 會自動補上)
+            source_path: 暫存圖片路徑，成功後會被搬走
+            name: 顯示名稱 (預設為檔名去掉副檔名)
+            dedup: 遇到近似重複時的處理方式 (DEDUP_MODES)
+
+        Returns:
+            模板資料；merge 時為既有的原模板，並附上 'merged': True；
+            keep 時若有近似的原模板，附上 'duplicates': [{'id', 'distance', 'dhash_distance'}]
+        """
+        if dedup not in DEDUP_MODES:
+            raise ValueError(f"Unknown dedup mode: {dedup}")
+        if not filename.lower().endswith('.png'):
+            filename += '.png'
+        filename = os.path.basename(filename)
+        info = self._describe(source_path)
+
+        with self._lock:
+            matches = self._near_duplicates(info, DUPLICATE_DISTANCE)
+            duplicate = matches[0]['id'] if matches and dedup != 'keep' else None
+            if duplicate and dedup == 'merge':
+                os.remove(source_path)
+                return {**self.get(duplicate), 'merged': True}
+
+            template_id = filename
+            while (os.path.exists(self.path_of(template_id))
+                   or self._conn.execute('SELECT 1 FROM templates WHERE id = ?', (template_id,)).fetchone()):
+                template_id = f"{template_id.rsplit('.', 1)[0]}_.png"
+
+            now = time.time()
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._conn.execute(
+                    "INSERT INTO templates(id, name, width, height, size_bytes, sha256, phash, dhash, alias_of, "
+                    "created_at, updated_at) VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (template_id, name or template_id.rsplit('.', 1)[0], info['width'], info['height'],
+                     info['size_bytes'], info['sha256'], info['phash'], info['dhash'], duplicate, now, now)
+                )
+                self._bump_generation()
+                os.replace(source_path, self.path_of(template_id))
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+            if duplicate is None:
+                self._hash_index.add(from_hex(info['phash']), template_id)
+
+        template = self.get(template_id)
+        if dedup == 'keep' and matches:
+            template['duplicates'] = matches
+        return template
+
+    def add_bytes(self, filename: str, image_bytes: bytes, name: Optional[str] = None,
+                  dedup: str = 'keep') -> Dict[str, Any]:
+        """
+        以圖片位元組加入模板庫（先寫暫存檔再搬移，不會留下寫一半的檔案）
+        """
+        tmp_path = os.path.join(self.templates_dir, f".upload_{os.getpid()}_{threading.get_ident()}.tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(image_bytes)
+        try:
+            return self.add_file(filename, tmp_path, name, dedup)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def update(self, template_id: str, **fields) -> None:
+        """
+        更新模板中繼資料（matcher、last_roi、features、density）
+
+        density 為截取模板時裝置的螢幕密度 (dpi)，用來推算模板在其他裝置上的縮放
+        """
+        allowed = {'name', 'matcher', 'last_roi', 'features', 'density'}
+        unknown = set(fields) - allowed
+        if unknown:
+            raise ValueError(f"Unknown template fields: {sorted(unknown)}")
+        if 'last_roi' in fields and fields['last_roi'] is not None:
+            fields['last_roi'] = json.dumps(fields['last_roi'])
+
+        assignments = ', '.join(f'{key} = ?' for key in fields)
+        with self._lock:
+            self._conn.execute(
+                f'UPDATE templates SET {assignments}, updated_at = ? WHERE id = ?',
+                (*fields.values(), time.time(), template_id)
+            )
+            if 'name' in fields:
+                self._bump_generation()
+
+    def record_match(self, template_id: str, center: List[int]) -> None:
+        """
+        記錄最近一次比對成功的位置 (x, y, w, h)
+        """
+        template = self.get(template_id)
+        if template is None or center is None:
+            return
+        w, h = template['width'], template['height']
+        self.update(template_id, last_roi=[int(center[0] - w / 2), int(center[1] - h / 2), w, h])
+
+    def remove(self, template_id: str) -> bool:
+        """
+        刪除模板；刪除的是原模板時，最早的別名升格為新的原模板
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT phash, alias_of FROM templates WHERE id = ?',
+                                     (template_id,)).fetchone()
+            if row is None:
+                return False
+            aliases = self.aliases_of(template_id) if row['alias_of'] is None else []
+            if aliases:
+                self.set_alias(aliases[0], None)
+                for alias in aliases[1:]:
+                    self.set_alias(alias, aliases[0])
+
+            self._conn.execute('DELETE FROM templates WHERE id = ?', (template_id,))
+            self._bump_generation()
+            if row['phash'] and row['alias_of'] is None:
+                self._hash_index.remove(from_hex(row['phash']), template_id)
+            path = self.path_of(template_id)
+            if os.path.exists(path):
+                os.remove(path)
+        return True
+
+    # ------------------------------------------------------------------
+    # 前端 JSON
+    # ------------------------------------------------------------------
+    def frontend_entries(self) -> List[Dict[str, str]]:
+        rows = self._query('SELECT id, name FROM templates ORDER BY created_at')
+        return [{'id': row['id'], 'name': row['name']} for row in rows]
+
+    def export_json(self, path: Optional[str] = None) -> bool:
+        """
+        模板有變動時才重新產生前端用的 templates.json
+
+        Returns:
+            True 表示有重新寫入
+        """
+        path = path or self.json_path
+        if not path:
+            return False
+        with self._lock:
+            generation = self._generation()
+            if generation == self._exported_generation and Path(path).exists():
+                return False
+
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.frontend_entries(), f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, path)
+            self._exported_generation = generation
+        return True
+
+    def close(self) -> None:
+        self._conn.close()
@@ -0,0 +1,166 @@
+import os
+import tempfile
+import zipfile
+from typing import AsyncIterator, Dict, Iterable, List, Optional
+
+from PIL import Image
+
+# 單一模板與整個壓縮包的大小上限
+MAX_TEMPLATE_BYTES = 20 * 1024 * 1024
+MAX_ARCHIVE_BYTES = 500 * 1024 * 1024
+
+IMAGE_SIGNATURES = {
+    'png': lambda head: head.startswith(b'\x89PNG\r\n\x1a\n'),
+    'jpeg': lambda head: head.startswith(b'\xff\xd8\xff'),
+    'webp': lambda head: head[:4] == b'RIFF' and head[8:12] == b'WEBP',
+}
+ZIP_SIGNATURE = {'zip': lambda head: head.startswith(b'PK\x03\x04')}
+
+
+class UploadError(ValueError):
+    """上傳內容無效（格式錯誤或超過大小限制）"""
+
+
+class TempUpload:
+    """
+    把上傳串流逐塊寫入暫存檔，並在收到前幾個位元組時就檢查檔頭
+
+    不會把整個檔案留在記憶體中；格式不符或超過大小時立刻中止。
+    """
+
+    HEADER_BYTES = 12
+
+    def __init__(self, directory: str, signatures: Dict, max_bytes: int):
+        self.directory = directory
+        self.signatures = signatures
+        self.max_bytes = max_bytes
+        self.kind: Optional[str] = None
+        self.size = 0
+        os.makedirs(directory, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(dir=directory, prefix='.upload_', suffix='.tmp')
+        self._file = os.fdopen(fd, 'wb')
+        self._head = b''
+
+    def write(self, chunk: bytes) -> None:
+        if not chunk:
+            return
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise UploadError(f"檔案超過 {self.max_bytes // (1024 * 1024)} MB 上限")
+
+        if self.kind is None:
+            self._head += chunk[:self.HEADER_BYTES]
+            if len(self._head) >= self.HEADER_BYTES:
+                self._check_header()
+        self._file.write(chunk)
+
+    def _check_header(self) -> None:
+        for kind, matches in self.signatures.items():
+            if matches(self._head):
+                self.kind = kind
+                return
+        raise UploadError(f"不支援的檔案格式: {', '.join(self.signatures)} only")
+
+    def finish(self) -> str:
+        """關閉暫存檔並回傳路徑"""
+        self._file.close()
+        if self.kind is None:
+            if self.size == 0:
+                raise UploadError("上傳內容為空")
+            self._check_header()
+        return self.path
+
+    def discard(self) -> None:
+        if not self._file.closed:
+            self._file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    async def consume(self, chunks: AsyncIterator[bytes]) -> str:
+        """寫入整個非同步串流"""
+        try:
+            async for chunk in chunks:
+                self.write(chunk)
+            return self.finish()
+        except Exception:
+            self.discard()
+            raise
+
+    def consume_sync(self, chunks: Iterable[bytes]) -> str:
+        """寫入整個同步串流（例如 zip 成員）"""
+        try:
+            for chunk in chunks:
+                self.write(chunk)
+            return self.finish()
+        except Exception:
+            self.discard()
+            raise
+
+
+def finalize_image(upload: TempUpload) -> str:
+    """
+    驗證暫存圖片，非 PNG 時轉成 PNG（模板一律以 .png 儲存）
+
+    Returns:
+        可交給 TemplateStore.add_file 的 PNG 暫存檔路徑
+    """
+    try:
+        with Image.open(upload.path) as img:
+            img.verify()
+    except Exception as e:
+        upload.discard()
+        raise UploadError(f"無效的圖片數據: {e}")
+
+    if upload.kind == 'png':
+        return upload.path
+
+    png_path = upload.path + '.png'
+    try:
+        with Image.open(upload.path) as img:
+            img.convert('RGB').save(png_path, format='PNG')
+    finally:
+        upload.discard()
+    return png_path
+
+
+def iter_file(fileobj, chunk_size: int = 1024 * 1024) -> Iterable[bytes]:
+    while True:
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def extract_template_pack(archive_path: str, directory: str) -> List[Dict[str, str]]:
+    """
+    逐一驗證壓縮包中的圖片，寫成 PNG 暫存檔
+
+    Returns:
+        [{'filename': 原始檔名, 'path': 暫存檔}] 或 [{'filename', 'error'}]
+    """
+    entries = []
+    with zipfile.ZipFile(archive_path) as archive:
+        for member in archive.infolist():
+            name = os.path.basename(member.filename)
+            if member.is_dir() or not name or name.startswith('.'):
+                continue
+            if not name.lower().endswith(('.png', '.jpg', '.jpeg', '.webp')):
+                continue
+            if member.file_size > MAX_TEMPLATE_BYTES:
+                entries.append({'filename': name, 'error': '檔案過大'})
+                continue
+
+            upload = TempUpload(directory, IMAGE_SIGNATURES, MAX_TEMPLATE_BYTES)
+            try:
+                with archive.open(member) as source:
+                    upload.consume_sync(iter_file(source))
+                path = finalize_image(upload)
+                entries.append({'filename': name.rsplit('.', 1)[0] + '.png', 'path': path})
+            except UploadError as e:
+                entries.append({'filename': name, 'error': str(e)})
+    return entries
+
+
+def discard_path(path: Optional[str]) -> None:
+    if path and os.path.exists(path):
+        os.remove(path)
@@ -0,0 +1,197 @@
+"""
+OCR 結果的文字查詢：正則比對、容錯比對（編輯距離 + 常見誤認字）與多筆結果
+
+OCR 常把 0/O、1/l、己/已 認錯，或多認/少認一個字，完全相符的正則會失敗，
+check_text 只好再截圖、再 OCR。TextIndex 對一次 OCR 結果建立一次索引，
+同一個結果可查詢多個目標；完全相符的結果優先（保持閱讀順序），否則比對
+正規化（大小寫、全半形、空白、誤認字）後的文字。容錯比對（增刪改字）需明確
+指定 fuzzy=True：QA 腳本裡 'Stop' 不該因為畫面上有 'Top' 就算找到。
+
+用法:
+    index = TextIndex.of(result)           # mask_ocr 的結果，同一個結果只建立一次
+    hits = index.search('登入')             # [Hit, ...]，最好的在前
+    found = index.search_many(['登入', r'\\d+ 分'])
+    hits = index.search('Settings', fuzzy=True)  # 容許編輯距離
+"""
+import functools
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+
+# 常見的 OCR 誤認：同一組內的字視為相同（比對前都換成該組第一個字）
+CONFUSABLE_GROUPS = (
+    '0oO', '1lI|!', '5sS', '8B', '2zZ',
+    '己已巳', '未末', '土士', '日曰', '人入', '戊戌戍', '千干', '天夭', '王壬', '刀力',
+)
+# 多字元的誤認（先於單字元替換）
+CONFUSABLE_SEQUENCES = (('rn', 'm'), ('vv', 'w'), ('cl', 'd'))
+
+# 容錯比對：目標長度低於此值時只容許誤認字，不容許增刪字
+MIN_FUZZY_LENGTH = 4
+# 每幾個字容許一個編輯
+CHARS_PER_EDIT = 4
+
+_REGEX_META = re.compile(r'[.^$*+?{}\[\]\\|()]')
+
+_FOLD = {}
+for _group in CONFUSABLE_GROUPS:
+    for _char in _group:
+        _FOLD[ord(_char.casefold())] = _group[0].casefold()
+
+
+class Hit(NamedTuple):
+    text: str
+    box: List[int]            # x1, y1, x2, y2（OCR 結果的座標）
+    center: List[int]
+    ocr_score: float
+    similarity: float         # 1.0 為完全相符
+    exact: bool
+    rank: float               # similarity * ocr_score，容錯結果依此排序
+    index: int                # 在 OCR 結果中的位置（閱讀順序）
+
+
+def normalize(text: str) -> str:
+    """全形轉半形、忽略大小寫與空白、誤認字換成同一個字"""
+    text = unicodedata.normalize('NFKC', text).casefold()
+    text = ''.join(text.split())
+    for sequence, replacement in CONFUSABLE_SEQUENCES:
+        text = text.replace(sequence, replacement)
+    return text.translate(_FOLD)
+
+
+def is_literal(goal: str) -> bool:
+    return _REGEX_META.search(goal) is None
+
+
+@functools.lru_cache(maxsize=512)
+def compile_goal(goal: str) -> 're.Pattern':
+    """編譯並快取目標；不是合法正則時當作一般文字"""
+    try:
+        return re.compile(goal)
+    except re.error:
+        return re.compile(re.escape(goal))
+
+
+@functools.lru_cache(maxsize=512)
+def _normalized_goal(goal: str) -> str:
+    return normalize(goal)
+
+
+def allowed_edits(length: int) -> int:
+    if length < MIN_FUZZY_LENGTH:
+        return 0
+    return max(length // CHARS_PER_EDIT, 1)
+
+
+def substring_distance(goal: str, text: str, limit: int) -> Optional[int]:
+    """
+    goal 與 text 中任一子字串的最小編輯距離（Sellers 演算法），超過 limit 時回傳 None
+
+    text 可以比 goal 長（例如目標是整行文字的一部分），多出的字不計。
+    """
+    previous = [0] * (len(text) + 1)
+    for i, goal_char in enumerate(goal, start=1):
+        current = [i] + [0] * len(text)
+        for j, text_char in enumerate(text, start=1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1,
+                             previous[j - 1] + (goal_char != text_char))
+        if min(current) > limit:
+            return None
+        previous = current
+    distance = min(previous)
+    return distance if distance <= limit else None
+
+
+class TextIndex:
+    """一次 OCR 結果的查詢索引（文字、正規化文字、框、信心值）"""
+
+    _recent: 'OrderedDict[int, Any]' = OrderedDict()
+    _recent_lock = threading.Lock()
+    RECENT_SIZE = 8
+
+    def __init__(self, result: Optional[Dict[str, Any]]):
+        self.texts: List[str] = []
+        self.normalized: List[str] = []
+        self.boxes: List[List[int]] = []
+        self.scores: List[float] = []
+        if result is None:
+            return
+        scores = result.get('rec_scores')
+        for i, (text, box) in enumerate(zip(result['rec_texts'], result['rec_boxes'])):
+            self.texts.append(text)
+            self.normalized.append(normalize(text))
+            self.boxes.append([int(v) for v in box])
+            self.scores.append(float(scores[i]) if scores is not None and i < len(scores) else 1.0)
+
+    @classmethod
+    def of(cls, result: Optional[Dict[str, Any]]) -> 'TextIndex':
+        """同一個結果物件只建立一次索引（保留最近幾個）"""
+        key = id(result)
+        with cls._recent_lock:
+            cached = cls._recent.get(key)
+            if cached is not None and cached[0] is result:
+                return cached[1]
+        index = cls(result)
+        with cls._recent_lock:
+            cls._recent[key] = (result, index)
+            while len(cls._recent) > cls.RECENT_SIZE:
+                cls._recent.popitem(last=False)
+        return index
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def _hit(self, i: int, similarity: float, exact: bool) -> Hit:
+        x1, y1, x2, y2 = self.boxes[i]
+        return Hit(self.texts[i], self.boxes[i], [(x1 + x2) // 2, (y1 + y2) // 2], self.scores[i],
+                   round(similarity, 4), exact, round(similarity * self.scores[i], 4), i)
+
+    def search(self, goal: str, fuzzy: bool = False, limit: Optional[int] = None) -> List[Hit]:
+        """
+        查詢一個目標
+
+        完全相符（正則）的結果依閱讀順序在前；沒有完全相符時，一般文字的目標在
+        正規化後的文字中找（fuzzy 時再容許 allowed_edits 個增刪改），正則目標則在
+        正規化的文字上忽略大小寫再比對一次。
+
+        Returns:
+            [Hit, ...]，最多 limit 筆
+        """
+        pattern = compile_goal(goal)
+        hits = [self._hit(i, 1.0, True) for i, text in enumerate(self.texts) if pattern.search(text)]
+        if not hits:
+            hits = self._folded(goal, fuzzy)
+        return hits[:limit] if limit else hits
+
+    def search_many(self, goals: Iterable[str], fuzzy: bool = False) -> Dict[str, List[Hit]]:
+        """一次查詢多個目標"""
+        return {goal: self.search(goal, fuzzy) for goal in dict.fromkeys(goals)}
+
+    def best(self, goal: str, fuzzy: bool = False) -> Optional[Hit]:
+        hits = self.search(goal, fuzzy, limit=1)
+        return hits[0] if hits else None
+
+    def _folded(self, goal: str, fuzzy: bool) -> List[Hit]:
+        hits = []
+        if is_literal(goal):
+            target = _normalized_goal(goal)
+            if not target:
+                return []
+            if not fuzzy:
+                return [self._hit(i, 1.0, False) for i, text in enumerate(self.normalized) if target in text]
+            limit = allowed_edits(len(target))
+            for i, text in enumerate(self.normalized):
+                if len(text) < len(target) - limit:
+                    continue
+                distance = substring_distance(target, text, limit)
+                if distance is not None:
+                    hits.append(self._hit(i, 1 - distance / len(target), False))
+        else:
+            pattern = re.compile(compile_goal(goal).pattern, re.IGNORECASE)
+            for i, text in enumerate(self.texts):
+                if pattern.search(unicodedata.normalize('NFKC', text)):
+                    hits.append(self._hit(i, 1.0, False))
+        hits.sort(key=lambda hit: (-hit.rank, hit.index))
+        return hits
@@ -0,0 +1,169 @@
+"""
+CPU 核心分配：OpenCV 比對、OCR 推論與事件迴圈共用同一個行程
+
+cv2（SIFT、matchTemplate）與 PaddleOCR 各有自己的執行緒池，多個腳本同時等待畫面時
+彼此搶核心，延遲急遽上升。ThreadBudget 依設定檔把核心分成：
+
+- 事件迴圈：保留 loop_reserve 顆，只處理 HTTP 與排程
+- 視覺：最多 vision_workers 個比對同時進行，每個比對 OpenCV 使用 cv_threads 條執行緒
+- OCR：同一個模型不能並行推論，一次一個，Paddle 使用 ocr_threads 條執行緒
+
+超出的比對在執行緒池中排隊，事件迴圈不會被卡住，同時執行的腳本越多只是越慢。
+
+設定檔:
+    latency     單一腳本最快：一次一個比對，OpenCV 與 OCR 各分一半核心
+    throughput  多個腳本同時執行：比對各用一條執行緒，可同時進行多個
+
+MQA_THREAD_PROFILE 選擇設定檔（預設 latency），MQA_VISION_WORKERS / MQA_CV_THREADS /
+MQA_OCR_THREADS 覆寫個別數值。
+
+用法:
+    budget = ThreadBudget.from_env()
+    budget.apply()
+    ocr_text = OCRProcessor(cpu_threads=budget.ocr_threads)
+    pos = await budget.run_vision(mixed_template_match, path)
+    result = await budget.run_ocr(ocr_text.mask_ocr, image)
+"""
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+import cv2
+
+LATENCY = 'latency'
+THROUGHPUT = 'throughput'
+PROFILES = (LATENCY, THROUGHPUT)
+
+
+def available_cpus() -> int:
+    """本行程可使用的核心數（考慮 CPU affinity / 容器限制）"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+class ThreadBudget:
+    """依設定檔分配核心，並提供視覺與 OCR 各自的執行緒池"""
+
+    def __init__(self, profile: str = LATENCY, cpus: Optional[int] = None, loop_reserve: int = 1,
+                 vision_workers: Optional[int] = None, cv_threads: Optional[int] = None,
+                 ocr_threads: Optional[int] = None):
+        """
+        Args:
+            profile: LATENCY 或 THROUGHPUT
+            cpus: 可用核心數，預設由 available_cpus() 取得
+            loop_reserve: 留給事件迴圈的核心數（只有一顆核心時不保留）
+            vision_workers / cv_threads / ocr_threads: 覆寫設定檔的數值
+        """
+        if profile not in PROFILES:
+            raise ValueError(f"Unknown thread profile '{profile}', expected one of {PROFILES}")
+        self.profile = profile
+        self.cpus = cpus or available_cpus()
+        self.loop_reserve = loop_reserve if self.cpus > loop_reserve else 0
+        compute = max(self.cpus - self.loop_reserve, 1)
+
+        if profile == LATENCY:
+            default_ocr = max(compute // 2, 1)
+            default_workers = 1
+            default_cv = max(compute - default_ocr, 1)
+        else:
+            default_ocr = max(compute // 4, 1)
+            default_workers = max(compute - default_ocr, 1)
+            default_cv = 1
+        self.ocr_threads = ocr_threads or default_ocr
+        self.vision_workers = vision_workers or default_workers
+        self.cv_threads = cv_threads or default_cv
+
+        self._pools = {
+            'vision': ThreadPoolExecutor(self.vision_workers, thread_name_prefix='vision'),
+            'ocr': ThreadPoolExecutor(1, thread_name_prefix='ocr'),
+        }
+        self._stats = {name: {'waiting': 0, 'running': 0, 'completed': 0, 'wait_seconds': 0.0, 'busy_seconds': 0.0}
+                       for name in self._pools}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> 'ThreadBudget':
+        def env_int(name: str) -> Optional[int]:
+            value = os.environ.get(name)
+            return int(value) if value else None
+
+        return cls(profile=os.environ.get('MQA_THREAD_PROFILE', LATENCY),
+                   vision_workers=env_int('MQA_VISION_WORKERS'),
+                   cv_threads=env_int('MQA_CV_THREADS'),
+                   ocr_threads=env_int('MQA_OCR_THREADS'))
+
+    def apply(self) -> None:
+        """設定 OpenCV 的執行緒數（整個行程共用）；Paddle 的執行緒數由 ocr_threads 傳入 PaddleOCR"""
+        cv2.setNumThreads(self.cv_threads)
+
+    async def run_vision(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """在視覺執行緒池中執行 fn（模板比對等），事件迴圈等待結果"""
+        return await self._run('vision', fn, *args, **kwargs)
+
+    async def run_ocr(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """在 OCR 執行緒中執行 fn；同一時間只有一個推論"""
+        return await self._run('ocr', fn, *args, **kwargs)
+
+    async def _run(self, pool: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        stats = self._stats[pool]
+        queued_at = time.perf_counter()
+        # 'started' / 'abandoned'：排隊中被取消（例如取消工作）時不再執行，計數也要扣回
+        state = {'started': False, 'abandoned': False}
+        with self._lock:
+            stats['waiting'] += 1
+
+        def call():
+            started_at = time.perf_counter()
+            with self._lock:
+                if state['abandoned']:
+                    return None
+                state['started'] = True
+                stats['waiting'] -= 1
+                stats['running'] += 1
+                stats['wait_seconds'] += started_at - queued_at
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    stats['running'] -= 1
+                    stats['completed'] += 1
+                    stats['busy_seconds'] += time.perf_counter() - started_at
+
+        # 複製 contextvars，執行緒中的 span 仍掛在目前的 Trace 底下
+        context = contextvars.copy_context()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._pools[pool], functools.partial(context.run, call))
+        except asyncio.CancelledError:
+            with self._lock:
+                if not state['started']:
+                    state['abandoned'] = True
+                    stats['waiting'] -= 1
+            raise
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            pools = {name: {**stats, 'wait_seconds': round(stats['wait_seconds'], 3),
+                            'busy_seconds': round(stats['busy_seconds'], 3)}
+                     for name, stats in self._stats.items()}
+        return {
+            'profile': self.profile,
+            'cpus': self.cpus,
+            'loop_reserve': self.loop_reserve,
+            'vision_workers': self.vision_workers,
+            'cv_threads': self.cv_threads,
+            'cv_threads_effective': cv2.getNumThreads(),
+            'ocr_threads': self.ocr_threads,
+            'pools': pools,
+        }
+
+    def shutdown(self) -> None:
+        for pool in self._pools.values():
+            pool.shutdown(wait=False, cancel_futures=True)